@@ -0,0 +1,157 @@
+# analytics.py - Occupancy, length of stay and service intensity over a date range
+from collections import namedtuple
+from datetime import date, timedelta
+from itertools import accumulate
+
+import archive
+from cache import cached
+from database import day_number, from_day_number, get_connection
+
+try:
+    import numpy as np
+except ImportError:  # Optional: the same figures are computed in pure Python, more slowly
+    np = None
+
+DEFAULT_DAYS = 365
+MAX_DAYS = 5 * 366  # longest range one request may ask for
+# Length of stay buckets: (label, longest stay in days)
+STAY_BUCKETS = (
+    ('0-7 days', 7), ('8-30 days', 30), ('31-90 days', 90),
+    ('91-180 days', 180), ('181-365 days', 365), ('over a year', None),
+)
+
+# Length of stay of the residents discharged within the range, in days
+LengthOfStay = namedtuple('LengthOfStay', ['stays', 'mean', 'median', 'p90', 'longest', 'buckets'])
+
+# Figures for a date range; occupancy has one count per night
+Analytics = namedtuple('Analytics', [
+    'start', 'end', 'occupancy', 'peak', 'peak_date', 'average_occupancy',
+    'resident_days', 'services', 'services_per_resident_day', 'length_of_stay',
+])
+
+
+def _sources(end_day):
+    """FROM clauses for residents and services, with the archive if it holds part of the range"""
+    conn = get_connection()
+    end_month = from_day_number(end_day).strftime('%Y-%m')
+    if conn.execute('SELECT 1 FROM archived_months WHERE month <= ? LIMIT 1', (end_month,)).fetchone() is None:
+        return 'residents', 'services'
+    if not archive.attach(conn):
+        raise FileNotFoundError(f"rows before {end_month} were archived but {archive.archive_path()} is missing")
+    return ('(SELECT entry_date, discharge_date FROM main.residents '
+            'UNION ALL SELECT entry_date, discharge_date FROM archive.residents)',
+            '(SELECT service_date FROM main.services UNION ALL SELECT service_date FROM archive.services)')
+
+
+def load_stays(start_day, end_day):
+    """(entry, exit) day numbers of every stay that overlaps the range
+
+    A stay occupies a bed from its entry night up to, not including,
+    its discharge date; stays still open run past end_day. `+ 0` reads
+    the raw day numbers rather than converting them to dates. Stays
+    discharged before they began, which Resident.discharge no longer
+    allows, are left out.
+    """
+    residents, _ = _sources(end_day)
+    return get_connection().execute(f'''
+        SELECT entry_date + 0, COALESCE(discharge_date + 0, ?) FROM {residents}
+        WHERE entry_date <= ? AND COALESCE(discharge_date, ?) >= MAX(?, entry_date)
+    ''', (end_day + 1, end_day, end_day + 1, start_day)).fetchall()
+
+
+def daily_occupancy(stays, start_day, days):
+    """Residents present on each of the days nights from start_day
+
+    Each stay adds 1 to a difference array at its first night in range
+    and subtracts 1 the day it ends; a running sum turns that into the
+    nightly count, so the work is one pass over the stays plus one over
+    the days rather than stays x days.
+    """
+    if np is not None and stays:
+        bounds = np.clip(np.asarray(stays, dtype=np.int64) - start_day, 0, days)
+        diff = (np.bincount(bounds[:, 0], minlength=days + 1)
+                - np.bincount(bounds[:, 1], minlength=days + 1))
+        return np.cumsum(diff[:days]).tolist()
+    diff = [0] * (days + 1)
+    for entry, exit in stays:
+        diff[min(max(entry - start_day, 0), days)] += 1
+        diff[min(max(exit - start_day, 0), days)] -= 1
+    return list(accumulate(diff[:days]))
+
+
+def _nearest_rank(sorted_values, p):
+    return sorted_values[max(0, -(-len(sorted_values) * p // 100) - 1)]
+
+
+def length_of_stay(stays, start_day, end_day):
+    """LengthOfStay of the stays that ended between start_day and end_day"""
+    if np is not None and stays:
+        bounds = np.asarray(stays, dtype=np.int64)
+        ended = (bounds[:, 1] >= start_day) & (bounds[:, 1] <= end_day)
+        lengths = np.sort(bounds[ended, 1] - bounds[ended, 0]).tolist()
+    else:
+        lengths = sorted(exit - entry for entry, exit in stays if start_day <= exit <= end_day)
+    if not lengths:
+        return LengthOfStay(0, 0.0, 0, 0, 0, [(label, 0) for label, _ in STAY_BUCKETS])
+    buckets, i = [], 0
+    for label, longest in STAY_BUCKETS:
+        count = 0
+        while i < len(lengths) and (longest is None or lengths[i] <= longest):
+            count += 1
+            i += 1
+        buckets.append((label, count))
+    return LengthOfStay(
+        stays=len(lengths),
+        mean=sum(lengths) / len(lengths),
+        median=_nearest_rank(lengths, 50),
+        p90=_nearest_rank(lengths, 90),
+        longest=lengths[-1],
+        buckets=buckets,
+    )
+
+
+def count_services(start_day, end_day):
+    _, services = _sources(end_day)
+    return get_connection().execute(
+        f'SELECT COUNT(*) FROM {services} WHERE service_date >= ? AND service_date <= ?',
+        (start_day, end_day)).fetchone()[0]
+
+
+@cached('analytics')
+def _analytics(start_day, end_day):
+    days = end_day - start_day + 1
+    stays = load_stays(start_day, end_day)
+    occupancy = daily_occupancy(stays, start_day, days)
+    resident_days = sum(occupancy)
+    peak = max(occupancy)
+    services = count_services(start_day, end_day)
+    start = from_day_number(start_day)
+    return Analytics(
+        start=start,
+        end=from_day_number(end_day),
+        occupancy=occupancy,
+        peak=peak,
+        peak_date=start + timedelta(days=occupancy.index(peak)),
+        average_occupancy=resident_days / days,
+        resident_days=resident_days,
+        services=services,
+        services_per_resident_day=services / resident_days if resident_days else 0.0,
+        length_of_stay=length_of_stay(stays, start_day, end_day),
+    )
+
+
+def compute(start=None, end=None):
+    """Analytics for start to end inclusive (default: the DEFAULT_DAYS to today)
+
+    start and end are dates or ISO date strings. Results are cached per
+    range until the next write. Raises ValueError for a malformed date,
+    a range that ends before it starts or one longer than MAX_DAYS.
+    """
+    end = date.fromisoformat(end) if isinstance(end, str) else end or date.today()
+    start = (date.fromisoformat(start) if isinstance(start, str)
+             else start or end - timedelta(days=DEFAULT_DAYS - 1))
+    if end < start:
+        raise ValueError("the range ends before it starts")
+    if (end - start).days + 1 > MAX_DAYS:
+        raise ValueError(f"the range is longer than {MAX_DAYS} days")
+    return _analytics(day_number(start), day_number(end))
@@ -1,118 +1,331 @@
 # app.py - Flask web application for Safe Shelter
-from flask import Flask, render_template, request, redirect, url_for
+from flask import (Blueprint, Flask, Response, current_app, g, render_template, request, redirect,
+                   url_for, jsonify, abort, stream_with_context)
+from werkzeug.http import is_resource_modified
+import gzip
+import os
 import sqlite3
+import time
+import zlib
 from datetime import date
+from functools import wraps
+import analytics
+from cache import cached, query_cache
+import database
+from database import last_change
+from events import broker
+import exporter
+import metrics
+from write_queue import WriteQueue
+from models import (Resident, Service, ServiceType, Stats, PAGE_SIZE, MAX_PAGE_SIZE,
+                    SEARCH_LIMIT, MAX_SEARCH_LIMIT)
 
-app = Flask(__name__)
+# Routes are registered on every app create_app() builds
+bp = Blueprint('shelter', __name__)
 
-# Home page - Dashboard
-@app.route('/')
-def index():
-    conn = sqlite3.connect('shelter.db')
-    cursor = conn.cursor()
-    
+# Every write from this process's requests goes through one writer
+# thread, in group commits; other processes wait their turn for the
+# SQLite write lock for up to database.BUSY_TIMEOUT_MS
+writes = WriteQueue()
+
+GZIP_MIN_BYTES = 1024  # smaller pages are sent uncompressed
+
+
+def templates_version():
+    """Checksum of the templates, so a new deploy changes every ETag"""
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    checksum = 0
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), 'rb') as f:
+            checksum = zlib.crc32(f.read(), zlib.crc32(name.encode(), checksum))
+    return checksum
+
+
+TEMPLATES_VERSION = templates_version()
+
+
+def _encode_page(html):
+    """A rendered page as UTF-8, plus its gzip encoding if large enough"""
+    body = html.encode('utf-8')
+    return body, gzip.compress(body, 6) if len(body) >= GZIP_MIN_BYTES else None
+
+
+def conditional_page(view):
+    """Serve an HTML page with validators, rendering it once per data change
+
+    The ETag and Last-Modified come from database.last_change(), so a
+    client revalidating a page that has not changed gets a 304 without
+    any query or rendering. Otherwise the rendered page and its gzip
+    encoding are kept in the query cache until the next write.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        count, modified = last_change()
+        etag = f"{TEMPLATES_VERSION:08x}-{count}-{int(modified.timestamp())}"
+        # Pages list residents, so they may be kept by the browser only
+        headers = {'Cache-Control': 'private, no-cache', 'Vary': 'Accept-Encoding'}
+        if not is_resource_modified(request.environ, etag=etag, last_modified=modified):
+            response = Response(status=304, headers=headers)
+        else:
+            body, compressed = query_cache.get_or_compute(
+                ('page', request.full_path), lambda: _encode_page(view(*args, **kwargs)))
+            if compressed is not None and request.accept_encodings['gzip']:
+                response = Response(compressed, mimetype='text/html', headers=headers)
+                response.content_encoding = 'gzip'
+            else:
+                response = Response(body, mimetype='text/html', headers=headers)
+        response.set_etag(etag, weak=True)
+        response.last_modified = modified
+        return response
+    return wrapper
+
+
+def page_size():
+    """Rows per page from ?size=, capped at MAX_PAGE_SIZE"""
+    size = request.args.get('size', type=int) or current_app.config['PAGE_SIZE']
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def fetch_page(fetch):
+    """Fetch the page selected by ?after=, ?before= and ?size="""
+    size = page_size()
+    try:
+        return fetch(request.args.get('after'), request.args.get('before'), size), size
+    except ValueError:
+        abort(400)  # Malformed cursor
+
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.registry.start_request()
+
+
+@bp.after_app_request
+def record_request_time(response):
+    """Time every request by route pattern, e.g. /export/<kind>
+
+    A streamed response is timed up to its first byte.
+    """
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.registry.record_request(request.method, route, response.status_code,
+                                    time.perf_counter() - g.request_started)
+    return response
+
+
+@cached('dashboard')
+def dashboard_data():
+    """Counters and recent activity shown on the dashboard"""
     # Get statistics
-    cursor.execute('SELECT COUNT(*) FROM residents')
-    total_residents = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM services')
-    total_services = cursor.fetchone()[0]
-    
-    # Get recent residents
-    cursor.execute('SELECT * FROM residents ORDER BY entry_date DESC LIMIT 5')
-    recent_residents = cursor.fetchall()
+    totals = Stats.totals()
     
-    # Get recent services
-    cursor.execute('''
-        SELECT s.id, r.first_name, r.last_name, s.service_type, s.service_date
-        FROM services s
-        JOIN residents r ON s.resident_id = r.id
-        ORDER BY s.service_date DESC LIMIT 5
-    ''')
-    recent_services = cursor.fetchall()
+    # Get recent residents and services, newest first
+    recent_residents = Resident.page(limit=5).rows
+    recent_services = Service.page(limit=5).rows
     
-    conn.close()
-    
-    return render_template('index.html', 
-                         total_residents=total_residents,
-                         total_services=total_services,
-                         recent_residents=recent_residents,
-                         recent_services=recent_services)
+    return {
+        'total_residents': totals['residents'],
+        'total_services': totals['services'],
+        'recent_residents': recent_residents,
+        'recent_services': recent_services,
+    }
+
+residents_page = cached('residents_page')(Resident.page)
+services_page = cached('services_page')(Service.page)
+service_types = cached('service_types')(ServiceType.all)
+
+# Home page - Dashboard
+@bp.route('/')
+@conditional_page
+def index():
+    # The live updates stream carries on from the change the page shows
+    return render_template('index.html', changes=last_change()[0], **dashboard_data())
+
+# Live dashboard updates as Server-Sent Events
+@bp.route('/events')
+def events():
+    since = request.headers.get('Last-Event-ID') or request.args.get('since', '')
+    return Response(broker.stream(int(since) if since.isdigit() else None),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # Residents page
-@app.route('/residents')
+@bp.route('/residents')
+@conditional_page
 def residents():
-    conn = sqlite3.connect('shelter.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM residents ORDER BY entry_date DESC')
-    residents = cursor.fetchall()
-    conn.close()
-    return render_template('residents.html', residents=residents)
+    page, size = fetch_page(residents_page)
+    return render_template('residents.html', residents=page.rows, page=page, size=size)
+
+# Resident search - ranked prefix matches for typeahead and the picker
+@bp.route('/residents/search')
+def search_residents():
+    page = max(1, request.args.get('page', 1, type=int))
+    size = request.args.get('size', SEARCH_LIMIT, type=int)
+    size = max(1, min(size, MAX_SEARCH_LIMIT))
+    rows, has_more = Resident.search(request.args.get('q', ''), size, (page - 1) * size)
+    return jsonify({
+        'results': [{'id': r.id, 'first_name': r.first_name, 'last_name': r.last_name,
+                     'entry_date': r.entry_date.isoformat()}
+                    for r in rows],
+        'page': page,
+        'has_more': has_more,
+    })
 
 # Add resident
-@app.route('/add_resident', methods=['POST'])
+@bp.route('/add_resident', methods=['POST'])
 def add_resident():
     first_name = request.form['first_name']
     last_name = request.form['last_name']
     
     if first_name and last_name:
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        
-        # Check for duplicate
-        cursor.execute(
-            'SELECT id FROM residents WHERE LOWER(first_name) = LOWER(?) AND LOWER(last_name) = LOWER(?)',
-            (first_name, last_name)
-        )
-        
-        if not cursor.fetchone():  # Only add if not duplicate
-            cursor.execute(
-                'INSERT INTO residents (first_name, last_name, entry_date) VALUES (?, ?, ?)',
-                (first_name, last_name, str(date.today()))
-            )
-            conn.commit()
-        
-        conn.close()
+        # Only adds if not a duplicate
+        writes.call(Resident(first_name, last_name, str(date.today())).save)
+        broker.notify()
     
-    return redirect(url_for('residents'))
+    return redirect(url_for('.residents'))
+
+# Discharge resident
+@bp.route('/discharge_resident', methods=['POST'])
+def discharge_resident():
+    resident_id = request.form.get('resident_id', '')
+    if resident_id.isdigit():
+        writes.call(Resident.discharge, int(resident_id))
+        broker.notify()
+    return redirect(url_for('.residents'))
 
 # Services page
-@app.route('/services')
+@bp.route('/services')
+@conditional_page
 def services():
-    conn = sqlite3.connect('shelter.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT s.id, r.first_name, r.last_name, s.service_type, s.service_date
-        FROM services s
-        JOIN residents r ON s.resident_id = r.id
-        ORDER BY s.service_date DESC
-    ''')
-    services = cursor.fetchall()
-    
-    cursor.execute('SELECT id, first_name, last_name FROM residents ORDER BY last_name')
-    residents = cursor.fetchall()
+    page, size = fetch_page(services_page)
+    return render_template('services.html', services=page.rows, page=page, size=size,
+                           service_types=service_types())
+
+# Streaming export, e.g. /export/services?format=jsonl&start=2024-01-01&end=2024-03-31&gzip=1
+@bp.route('/export/<kind>')
+def export(kind):
+    fmt = request.args.get('format', 'csv')
+    start, end = request.args.get('start'), request.args.get('end')
+    compress = request.args.get('gzip') == '1'
+    if kind not in exporter.EXPORTS:
+        abort(404)
+    try:
+        chunks = exporter.export(kind, fmt, start, end, compress)
+    except ValueError:
+        abort(400)  # Unknown format or malformed date
     
-    conn.close()
-    return render_template('services.html', services=services, residents=residents)
+    mimetype = 'application/gzip' if compress else (
+        'text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    name = exporter.filename(kind, fmt, start, end, compress)
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+# Occupancy chart data, e.g. /analytics/occupancy?start=2024-01-01&end=2024-12-31
+@bp.route('/analytics/occupancy')
+def occupancy():
+    try:
+        report = analytics.compute(request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        abort(400)  # Malformed date or backwards range
+    stay = report.length_of_stay
+    return jsonify({
+        'start': report.start.isoformat(),
+        'end': report.end.isoformat(),
+        'occupancy': report.occupancy,
+        'peak': report.peak,
+        'peak_date': report.peak_date.isoformat(),
+        'average_occupancy': round(report.average_occupancy, 2),
+        'resident_days': report.resident_days,
+        'services': report.services,
+        'services_per_resident_day': round(report.services_per_resident_day, 3),
+        'length_of_stay': {
+            'stays': stay.stays,
+            'mean': round(stay.mean, 1),
+            'median': stay.median,
+            'p90': stay.p90,
+            'longest': stay.longest,
+            'buckets': dict(stay.buckets),
+        },
+    })
+
+# Cache hit/miss statistics
+@bp.route('/cache_stats')
+def cache_stats():
+    return jsonify(query_cache.stats())
+
+# Prometheus metrics: statement and request latency
+@bp.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Recent statements over the slow query threshold, with their plans
+@bp.route('/slow_queries')
+def slow_queries():
+    return jsonify(metrics.registry.slow_queries())
 
 # Log service
-@app.route('/log_service', methods=['POST'])
+@bp.route('/log_service', methods=['POST'])
 def log_service():
     resident_id = request.form['resident_id']
-    service_type = request.form['service_type']
+    service_type = request.form['service_type'].strip()
     
     if resident_id and service_type:
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO services (resident_id, service_type, service_date) VALUES (?, ?, ?)',
-            (resident_id, service_type, str(date.today()))
-        )
-        conn.commit()
-        conn.close()
+        try:
+            # The type lookup runs on the writer too, as a new type is a write
+            writes.call(Service.add, resident_id, service_type)
+            broker.notify()
+        except sqlite3.IntegrityError:
+            pass  # Unknown resident - nothing to log
+    
+    return redirect(url_for('.services'))
+
+# Log one service for several residents at once
+@bp.route('/log_service_batch', methods=['POST'])
+def log_service_batch():
+    resident_ids = [int(value) for value in request.form.getlist('resident_id') if value.isdigit()]
+    service_type = request.form['service_type'].strip()
+    
+    if resident_ids and service_type:
+        writes.call(Service.log_for_residents, resident_ids, service_type)
+        broker.notify()
     
-    return redirect(url_for('services'))
+    return redirect(url_for('.services'))
+
+# Another process held the write lock for longer than the busy timeout
+@bp.app_errorhandler(sqlite3.OperationalError)
+def database_busy(error):
+    if error.sqlite_errorname not in ('SQLITE_BUSY', 'SQLITE_LOCKED'):
+        raise error
+    return Response("The database is busy, please try again.\n", status=503,
+                    mimetype='text/plain', headers={'Retry-After': '1'})
+
+
+def create_app(config=None):
+    """Build the web app; config overrides the defaults
+
+    DATABASE         database file (default: SHELTER_DB or shelter.db)
+    BUSY_TIMEOUT_MS  how long a write waits for another process's lock
+                     before the request gets a 503 (default: 5000)
+    PAGE_SIZE        rows per page on /residents and /services
+
+    The database settings are process-wide, as the database module
+    keeps them; serve.py builds one app in each worker process.
+    """
+    app = Flask(__name__)
+    app.config.from_mapping(
+        DATABASE=database.DB_PATH,
+        BUSY_TIMEOUT_MS=database.BUSY_TIMEOUT_MS,
+        PAGE_SIZE=PAGE_SIZE,
+    )
+    app.config.update(config or {})
+    if (app.config['DATABASE'], app.config['BUSY_TIMEOUT_MS']) != (database.DB_PATH, database.BUSY_TIMEOUT_MS):
+        database.configure(app.config['DATABASE'], busy_timeout_ms=app.config['BUSY_TIMEOUT_MS'])
+    app.register_blueprint(bp)
+    return app
+
+
+# The default app, for `flask --app app run` and the tests
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
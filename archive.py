@@ -0,0 +1,249 @@
+# archive.py - Move discharged residents and old services to the archive database
+import argparse
+import os
+import time
+from datetime import date, timedelta
+
+import database
+from database import day_number, get_connection, month_bounds, transaction
+
+HORIZON_DAYS = 365   # rows older than this leave the live database
+BATCH_SIZE = 500     # residents or services moved per transaction
+PAUSE = 0.05         # seconds between batches, so other writers get the lock
+
+# The archive keeps the rows it is given plus its own monthly rollups,
+# in the same layout as the live tables so reports can add them up.
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS archive.residents (
+        id INTEGER PRIMARY KEY,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        entry_date JULIANDAY NOT NULL,
+        name_key TEXT,
+        discharge_date JULIANDAY
+    )''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_residents_entry_date ON residents(entry_date)',
+    '''CREATE TABLE IF NOT EXISTS archive.services (
+        id INTEGER PRIMARY KEY,
+        resident_id INTEGER NOT NULL,
+        service_type_id INTEGER NOT NULL,
+        service_date JULIANDAY NOT NULL,
+        service_time INTEGER
+    )''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_services_date ON services(service_date)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_services_resident ON services(resident_id, service_date)',
+    '''CREATE TABLE IF NOT EXISTS archive.service_types (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        key TEXT NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS archive.monthly_new_residents (
+        month TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS archive.monthly_service_counts (
+        month TEXT NOT NULL,
+        service_type_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (month, service_type_id)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS archive.monthly_resident_services (
+        month TEXT NOT NULL,
+        resident_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (month, resident_id)
+    ) WITHOUT ROWID''',
+)
+
+# Archive rollups for one month, recomputed from the archived rows
+ROLLUP_QUERIES = {
+    'monthly_new_residents': '''
+        SELECT strftime('%Y-%m', entry_date), COUNT(*) FROM archive.residents
+        WHERE entry_date >= ? AND entry_date < ? GROUP BY 1''',
+    'monthly_service_counts': '''
+        SELECT strftime('%Y-%m', service_date), service_type_id, COUNT(*) FROM archive.services
+        WHERE service_date >= ? AND service_date < ? GROUP BY 1, 2''',
+    'monthly_resident_services': '''
+        SELECT strftime('%Y-%m', service_date), resident_id, COUNT(*) FROM archive.services
+        WHERE service_date >= ? AND service_date < ? GROUP BY 1, 2''',
+}
+
+
+def archive_path():
+    """The archive file: SHELTER_ARCHIVE_DB, or e.g. shelter-archive.db next to shelter.db"""
+    path = os.environ.get('SHELTER_ARCHIVE_DB')
+    if path:
+        return path
+    root, ext = os.path.splitext(database.DB_PATH)
+    return f"{root}-archive{ext or '.db'}"
+
+
+def attach(conn=None, create=False):
+    """Attach the archive to a connection as the schema "archive"
+
+    Returns False and leaves the connection alone when there is no
+    archive yet, unless create is true. Must not be called inside a
+    transaction; an archive attached once stays attached.
+    """
+    conn = conn or get_connection()
+    if any(name == 'archive' for _, name, _ in conn.execute('PRAGMA database_list')):
+        return True
+    path = archive_path()
+    if not create and not os.path.exists(path):
+        return False
+    if database.READ_ONLY:
+        # Read-only connections are opened with URI filenames enabled
+        conn.execute('ATTACH ? AS archive', (f'file:{os.path.abspath(path)}?mode=ro',))
+        return True
+    conn.execute('ATTACH ? AS archive', (path,))
+    if create:
+        conn.execute('PRAGMA archive.journal_mode=WAL')
+        with transaction():
+            for statement in SCHEMA:
+                conn.execute(statement)
+    return True
+
+
+def totals(conn=None):
+    """Counters for the archived rows, to add to the live stats table's
+
+    Read from the archive's rollups, so it costs a few small queries;
+    all zero when nothing has been archived. Service types and months
+    already counted live are not counted again. Raises
+    FileNotFoundError if rows were archived but the archive is missing.
+    """
+    conn = conn or get_connection()
+    if conn.execute('SELECT 1 FROM archived_months LIMIT 1').fetchone() is None:
+        return {'residents': 0, 'services': 0, 'service_types': 0, 'active_months': 0}
+    if not attach(conn):
+        raise FileNotFoundError(f"rows were archived but {archive_path()} is missing")
+    return dict(conn.execute('''
+        SELECT 'residents', COALESCE(SUM(count), 0) FROM archive.monthly_new_residents
+        UNION ALL SELECT 'services', COALESCE(SUM(count), 0) FROM archive.monthly_service_counts
+        UNION ALL SELECT 'service_types', COUNT(DISTINCT service_type_id) FROM archive.monthly_service_counts
+            WHERE service_type_id NOT IN (SELECT service_type_id FROM main.service_type_counts)
+        UNION ALL SELECT 'active_months', COUNT(DISTINCT month) FROM archive.monthly_service_counts
+            WHERE month NOT IN (SELECT month FROM main.service_month_counts)
+    '''))
+
+
+def _placeholders(values):
+    return ','.join('?' * len(values))
+
+
+def _refresh_rollups(conn, months):
+    """Recompute the archive rollups of months from the archived rows
+
+    Recomputing rather than adding makes a batch safe to repeat.
+    """
+    for month in months:
+        bounds = month_bounds(month)
+        for table, query in ROLLUP_QUERIES.items():
+            conn.execute(f'DELETE FROM archive.{table} WHERE month = ?', (month,))
+            rows = conn.execute(query, bounds).fetchall()
+            if rows:
+                conn.executemany(
+                    f'INSERT INTO archive.{table} VALUES ({_placeholders(rows[0])})', rows)
+
+
+def archive_batch(cutoff, batch_size=BATCH_SIZE):
+    """Move one batch of rows dated before cutoff (a day number)
+
+    Takes up to batch_size residents discharged before cutoff together
+    with all their services or, once there are none left, up to
+    batch_size services dated before cutoff. No batch moves more than
+    batch_size services: residents with more than that have their
+    services moved first, batch by batch, and follow once the rest
+    fit. The rows are copied to the
+    archive and deleted from the live tables in one short transaction;
+    the delete triggers keep the live counters and rollups in step.
+    Returns (residents, services) moved.
+    """
+    conn = get_connection()
+    with transaction():
+        resident_ids = [row[0] for row in conn.execute(
+            '''SELECT id FROM main.residents WHERE discharge_date < ?
+               ORDER BY discharge_date LIMIT ?''', (cutoff, batch_size))]
+        if resident_ids:
+            service_ids = [row[0] for row in conn.execute(
+                f'SELECT id FROM main.services WHERE resident_id IN ({_placeholders(resident_ids)}) LIMIT ?',
+                resident_ids + [batch_size + 1])]
+            if len(service_ids) > batch_size:
+                # Too many for one batch: just services this time, the residents later
+                resident_ids, service_ids = [], service_ids[:batch_size]
+        else:
+            service_ids = [row[0] for row in conn.execute(
+                '''SELECT id FROM main.services WHERE service_date < ?
+                   ORDER BY service_date LIMIT ?''', (cutoff, batch_size))]
+        if not resident_ids and not service_ids:
+            return 0, 0
+
+        services = _placeholders(service_ids)
+        residents = _placeholders(resident_ids)
+        months = {row[0] for row in conn.execute(
+            f"SELECT DISTINCT strftime('%Y-%m', service_date) FROM main.services WHERE id IN ({services})",
+            service_ids)}
+        months.update(row[0] for row in conn.execute(
+            f"SELECT DISTINCT strftime('%Y-%m', entry_date) FROM main.residents WHERE id IN ({residents})",
+            resident_ids))
+
+        conn.execute('INSERT OR REPLACE INTO archive.service_types SELECT id, name, key FROM main.service_types')
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.services
+            SELECT id, resident_id, service_type_id, service_date, service_time
+            FROM main.services WHERE id IN ({services})
+        ''', service_ids)
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.residents
+            SELECT id, first_name, last_name, entry_date, name_key, discharge_date
+            FROM main.residents WHERE id IN ({residents})
+        ''', resident_ids)
+        _refresh_rollups(conn, sorted(months))
+
+        conn.execute(f'DELETE FROM main.services WHERE id IN ({services})', service_ids)
+        conn.execute(f'DELETE FROM main.residents WHERE id IN ({residents})', resident_ids)
+        conn.executemany('INSERT OR IGNORE INTO main.archived_months (month) VALUES (?)',
+                         [(month,) for month in months])
+    return len(resident_ids), len(service_ids)
+
+
+def archive(horizon_days=HORIZON_DAYS, batch_size=BATCH_SIZE, pause=PAUSE, today=None):
+    """Move everything older than the horizon to the archive, batch by batch
+
+    Each batch holds the write lock only for its own short transaction
+    and the job sleeps for pause seconds between batches, so the app
+    keeps writing while a large backlog is archived. Safe to interrupt
+    and run again. Returns (residents, services) moved.
+
+    SQLite commits the live and archive files separately in WAL mode,
+    so a crash during a commit can leave a batch in both; the next run
+    copies it again over itself and finishes the delete.
+    """
+    cutoff = day_number((today or date.today()) - timedelta(days=horizon_days))
+    attach(get_connection(), create=True)
+    moved_residents = moved_services = 0
+    while True:
+        residents, services = archive_batch(cutoff, batch_size)
+        if not residents and not services:
+            return moved_residents, moved_services
+        moved_residents += residents
+        moved_services += services
+        time.sleep(pause)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move discharged residents and old services to the archive")
+    parser.add_argument('--horizon-days', type=int, default=HORIZON_DAYS,
+                        help=f"archive rows older than this many days (default: {HORIZON_DAYS})")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f"rows moved per transaction (default: {BATCH_SIZE})")
+    parser.add_argument('--pause', type=float, default=PAUSE,
+                        help=f"seconds to wait between batches (default: {PAUSE})")
+    args = parser.parse_args()
+
+    residents, services = archive(args.horizon_days, args.batch_size, args.pause)
+    print(f"✓ Archived {residents} residents and {services} services to {archive_path()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+# benchmark.py - Performance benchmarks for Safe Shelter
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import database
+import seed_data
+from app import app
+from cache import query_cache
+from models import Resident, Service, ServiceType, Stats
+from reports import ShelterReports
+
+# name -> (residents, services); "large" is the size the shelter plans for
+SCALES = {
+    'small': (1_000, 20_000),
+    'medium': (10_000, 500_000),
+    'large': (100_000, 10_000_000),
+}
+END = date(2024, 12, 31)   # last day of the synthetic history, fixed so runs compare
+# The system report is compared on a 1M-service database, the size it was tuned for
+SYSTEM_REPORT_SIZE = (50_000, 20)   # residents, services per resident
+RUNS = 30
+MAX_SECONDS = 10           # stop timing a case early once it has taken this long
+THRESHOLD = 1.25           # p50 slowdown reported as a regression by compare
+
+
+def populate(residents=1000, services_per_resident=5):
+    """Fill the configured database with synthetic rows"""
+    seed_data.seed(residents, residents * services_per_resident, end=date.today())
+
+
+def bench_requests(path='/', requests=500, reuse=True):
+    """Return requests/sec for a route through the Flask test client
+
+    With reuse=False the thread's connection is closed after every
+    request, reproducing the old connect-per-request behaviour.
+    """
+    client = app.test_client()
+    client.get(path)
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+        if not reuse:
+            database.close_connection()
+    return requests / (time.perf_counter() - started)
+
+
+def legacy_system_report():
+    """The nine separate queries the system report used to issue"""
+    cursor = database.get_connection().cursor()
+    thirty_days_ago = date.today() - timedelta(days=30)
+    current_month = date.today().strftime("%Y-%m")
+    for sql, params in (
+        ('SELECT COUNT(*) FROM residents', ()),
+        ('SELECT COUNT(*) FROM services', ()),
+        ('SELECT COUNT(DISTINCT service_type_id) FROM services', ()),
+        ("SELECT COUNT(DISTINCT strftime('%Y-%m', service_date)) FROM services", ()),
+        ('SELECT COUNT(*) FROM residents WHERE entry_date >= ?', (thirty_days_ago,)),
+        ('SELECT COUNT(*) FROM services WHERE service_date >= ?', (thirty_days_ago,)),
+        ('''SELECT service_type_id, COUNT(*), COUNT(DISTINCT resident_id)
+           FROM services GROUP BY service_type_id ORDER BY 2 DESC''', ()),
+        ("SELECT COUNT(*) FROM residents WHERE strftime('%Y-%m', entry_date) = ?", (current_month,)),
+        ("SELECT COUNT(*) FROM services WHERE strftime('%Y-%m', service_date) = ?", (current_month,)),
+    ):
+        cursor.execute(sql, params).fetchall()
+
+
+def bench_system_report(repeat=5):
+    """Return (legacy, single-pass) best-of-N seconds for the system report"""
+    timings = []
+    for build in (legacy_system_report, ShelterReports.build_system_report):
+        best = float('inf')
+        for _ in range(repeat):
+            query_cache.clear()
+            started = time.perf_counter()
+            build()
+            best = min(best, time.perf_counter() - started)
+        timings.append(best)
+    return timings
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def measure(run, runs=RUNS, max_seconds=MAX_SECONDS, warm=False):
+    """Time run() and return its latency percentiles and peak memory
+
+    One untimed call warms up SQLite's page cache and checks the case
+    works. The query cache is cleared before every timed call unless
+    warm is true, so the figures are for the real work. Peak memory is
+    taken by tracemalloc on a separate call, as tracing slows Python.
+    """
+    run()
+    timings = []
+    deadline = time.perf_counter() + max_seconds
+    while len(timings) < runs and (len(timings) < 3 or time.perf_counter() < deadline):
+        if not warm:
+            query_cache.clear()
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+
+    if not warm:
+        query_cache.clear()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'runs': len(timings),
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'max_ms': timings[-1] * 1000,
+        'peak_kb': peak / 1024,
+    }
+
+
+def _get(client, path):
+    """A GET that fails the benchmark instead of timing an error page"""
+    def run():
+        response = client.get(path)
+        response.get_data()  # Streamed responses are produced as they are read
+        assert response.status_code == 200, (path, response.status_code)
+    return run
+
+
+def _post(client, path, data):
+    def run():
+        response = client.post(path, data=data() if callable(data) else data)
+        assert response.status_code == 302, (path, response.status_code)
+    return run
+
+
+def cases(client):
+    """Every route, model method and report, as name -> callable
+
+    Arguments are picked from the data: a resident in the middle of the
+    list, the last full month of history and so on.
+    """
+    conn = database.get_connection()
+    residents = Stats.totals()['residents']
+    middle = Resident.page_at(residents // 2, 1).rows[0]
+    services_middle = Stats.totals()['services'] // 2
+    month_end = END.replace(day=1) - timedelta(days=1)  # The last full month
+    month_start = month_end.replace(day=1)
+    last_month = month_start.strftime('%Y-%m')
+    year_start = (month_start - timedelta(days=334)).strftime('%Y-%m')
+    prefix = middle[1][:3]
+    new_names = (f"Bench{n}" for n in itertools.count())
+    resident_id = conn.execute('SELECT MAX(id) FROM residents').fetchone()[0]
+
+    return {
+        'GET /': _get(client, '/'),
+        'GET /residents': _get(client, '/residents'),
+        'GET /residents?after': _get(client, f'/residents?after={Resident.cursor(middle)}'),
+        'GET /residents/search': _get(client, f'/residents/search?q={prefix}'),
+        'GET /services': _get(client, '/services'),
+        'GET /export/services (1 month)': _get(
+            client, f'/export/services?start={month_start}&end={month_end}'),
+        'GET /export/monthly_services': _get(client, '/export/monthly_services'),
+        'GET /cache_stats': _get(client, '/cache_stats'),
+        'POST /add_resident': _post(
+            client, '/add_resident', lambda: {'first_name': next(new_names), 'last_name': 'Resident'}),
+        'POST /log_service': _post(
+            client, '/log_service', {'resident_id': resident_id, 'service_type': 'Meals'}),
+        'POST /log_service_batch': _post(
+            client, '/log_service_batch', {'resident_id': [resident_id, middle[0]], 'service_type': 'Meals'}),
+        'POST /discharge_resident': _post(
+            client, '/discharge_resident', {'resident_id': middle[0]}),
+        'Resident.check_duplicate': lambda: Resident.check_duplicate(middle[1], middle[2]),
+        'Resident.get_all': Resident.get_all,
+        'Resident.page': Resident.page,
+        'Resident.page_at (middle)': lambda: Resident.page_at(residents // 2),
+        'Resident.search': lambda: Resident.search(prefix),
+        'Service.add': lambda: Service.add(resident_id, 'Counseling'),
+        'Service.page': Service.page,
+        'Service.page_at (middle)': lambda: Service.page_at(services_middle),
+        'ServiceType.all': ServiceType.all,
+        'Stats.totals': Stats.totals,
+        'Stats.service_type_counts': Stats.service_type_counts,
+        'ShelterReports.build_monthly_report': lambda: ShelterReports.build_monthly_report(last_month),
+        'ShelterReports.build_monthly_reports (12 months)': lambda: ShelterReports.build_monthly_reports(
+            year_start, last_month),
+        'ShelterReports.build_system_report': lambda: ShelterReports.build_system_report(
+            datetime.combine(END, datetime.min.time())),
+    }
+
+
+def scale_database(scale, seed, data_dir):
+    """Path of a seeded database for a scale, generating it on first use
+
+    Generating the large scale takes several minutes, so the files are
+    kept in data_dir and reused by later runs with the same seed.
+    """
+    residents, services = SCALES[scale]
+    path = os.path.join(data_dir, f"{scale}-seed{seed}.db")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        print(f"   Generating {scale}: {residents:,} residents, {services:,} services")
+        partial = path + '.partial'
+        database.configure(partial)
+        database.create_database()
+        seed_data.seed(residents, services, seed, END)
+        database.close_connection()
+        os.replace(partial, path)
+    return path
+
+
+def run_scale(path, names=None, runs=RUNS, max_seconds=MAX_SECONDS, warm=False):
+    """Measure every case against a scratch copy of the database at path"""
+    with tempfile.TemporaryDirectory() as tmp:
+        work = os.path.join(tmp, 'bench.db')
+        source = sqlite3.connect(path)
+        target = sqlite3.connect(work)
+        source.backup(target)  # The write cases must not change the cached data
+        source.close()
+        target.close()
+        database.configure(work)
+        try:
+            results = {}
+            for name, run in cases(app.test_client()).items():
+                if names and not any(part in name for part in names):
+                    continue
+                results[name] = measure(run, runs, max_seconds, warm)
+                print(f"   {name:<50}{results[name]['p50_ms']:>9.2f}{results[name]['p95_ms']:>9.2f}"
+                      f"{results[name]['p99_ms']:>9.2f} ms{results[name]['peak_kb']:>10.0f} KB")
+            return results
+        finally:
+            database.close_connection()
+
+
+def git_commit():
+    """The checked-out commit, marked -dirty if the tree has changes"""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_suite(scales, seed=0, data_dir='.benchmark-data', names=None, runs=RUNS,
+              max_seconds=MAX_SECONDS, warm=False):
+    """Benchmark every case at each scale and return the results as a dict"""
+    results = {
+        'commit': git_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'seed': seed,
+        'warm_cache': warm,
+        'scales': {},
+    }
+    previous = database.DB_PATH
+    try:
+        for scale in scales:
+            residents, services = SCALES[scale]
+            path = scale_database(scale, seed, data_dir)
+            print(f"\n{scale}: {residents:,} residents, {services:,} services")
+            print(f"   {'Case':<50}{'p50':>9}{'p95':>9}{'p99':>12}{'peak':>11}")
+            results['scales'][scale] = {
+                'residents': residents,
+                'services': services,
+                'cases': run_scale(path, names, runs, max_seconds, warm),
+            }
+    finally:
+        database.configure(previous)
+    return results
+
+
+def compare(old, new, threshold=THRESHOLD):
+    """Print p50/p95 changes between two result files; return the regressions
+
+    A case regresses when its p50 grows by more than threshold times.
+    """
+    regressions = []
+    print(f"{old['commit']} -> {new['commit']}")
+    for scale, measured in new['scales'].items():
+        before = old['scales'].get(scale, {}).get('cases', {})
+        print(f"\n{scale}")
+        print(f"   {'Case':<50}{'p50 before':>12}{'after':>10}{'p95 before':>12}{'after':>10}")
+        for name, result in measured['cases'].items():
+            if name not in before:
+                print(f"   {name:<50}{'(new)':>12}{result['p50_ms']:>10.2f}")
+                continue
+            ratio = result['p50_ms'] / max(before[name]['p50_ms'], 1e-6)
+            flag = ''
+            if ratio > threshold:
+                regressions.append((scale, name, ratio))
+                flag = f"  ▲ {ratio:.2f}x"
+            print(f"   {name:<50}{before[name]['p50_ms']:>12.2f}{result['p50_ms']:>10.2f}"
+                  f"{before[name]['p95_ms']:>12.2f}{result['p95_ms']:>10.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Safe Shelter benchmarks",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="examples:\n"
+               "  python benchmark.py suite --scales small,medium\n"
+               "  python benchmark.py compare benchmarks/OLD.json benchmarks/NEW.json\n"
+               "  python benchmark.py system-report        # 1M services, legacy vs single pass\n"
+               "  python benchmark.py connections")
+    commands = parser.add_subparsers(dest='command')
+
+    suite = commands.add_parser('suite', help="time every route, model method and report")
+    suite.add_argument('--scales', default='small,medium',
+                       help=f"comma-separated, from {', '.join(SCALES)} (default: small,medium)")
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--runs', type=int, default=RUNS, help=f"timed calls per case (default: {RUNS})")
+    suite.add_argument('--max-seconds', type=float, default=MAX_SECONDS,
+                       help="stop timing a slow case after this long")
+    suite.add_argument('--only', action='append', help="run only cases whose name contains this")
+    suite.add_argument('--warm', action='store_true', help="keep the query cache between calls")
+    suite.add_argument('--data-dir', default='.benchmark-data', help="where seeded databases are kept")
+    suite.add_argument('-o', '--output', help="results file (default: benchmarks/<commit>.json)")
+
+    comparison = commands.add_parser('compare', help="compare two results files")
+    comparison.add_argument('old')
+    comparison.add_argument('new')
+    comparison.add_argument('--threshold', type=float, default=THRESHOLD,
+                            help=f"p50 ratio counted as a regression (default: {THRESHOLD})")
+
+    connections = commands.add_parser('connections', help="shared vs per-request connections")
+    connections.add_argument('--requests', type=int, default=500)
+    connections.add_argument('--residents', type=int, default=1000)
+    connections.add_argument('--services-per-resident', type=int, default=5)
+    residents, per_resident = SYSTEM_REPORT_SIZE
+    report = commands.add_parser(
+        'system-report', help=f"legacy vs single-pass system report "
+                              f"(default: {residents * per_resident:,} services)")
+    report.add_argument('--residents', type=int, default=residents,
+                        help=f"(default: {residents:,})")
+    report.add_argument('--services-per-resident', type=int, default=per_resident,
+                        help=f"(default: {per_resident})")
+    args = parser.parse_args()
+
+    if args.command == 'suite':
+        scales = args.scales.split(',')
+        unknown = set(scales) - set(SCALES)
+        if unknown:
+            parser.error(f"unknown scale {', '.join(sorted(unknown))}")
+        results = run_suite(scales, args.seed, args.data_dir, args.only, args.runs,
+                            args.max_seconds, args.warm)
+        output = args.output or os.path.join('benchmarks', f"{results['commit']}.json")
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results saved to: {output}")
+        return
+
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        print(f"\n{len(regressions)} regression(s) over {args.threshold}x")
+        raise SystemExit(1 if regressions else 0)
+
+    if args.command not in ('connections', 'system-report'):
+        parser.print_help()
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.configure(os.path.join(tmp, 'bench.db'))
+        database.create_database()
+        populate(args.residents, args.services_per_resident)
+
+        if args.command == 'system-report':
+            legacy, single_pass = bench_system_report()
+            print(f"System report: {legacy * 1000:.0f} ms legacy, "
+                  f"{single_pass * 1000:.0f} ms single pass ({legacy / single_pass:.1f}x)")
+            database.close_connection()
+            return
+
+        print(f"{'Route':<12}{'per-request conn':>20}{'shared conn':>15}")
+        for path in ('/', '/services'):
+            before = bench_requests(path, args.requests, reuse=False)
+            after = bench_requests(path, args.requests, reuse=True)
+            print(f"{path:<12}{before:>16.0f} r/s{after:>11.0f} r/s")
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# cache.py - Result cache for dashboard and report queries
+import sys
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from database import write_generation
+
+MAX_ENTRIES = 512
+MAX_BYTES = 32 * 1024 * 1024
+
+
+def _sizeof(obj, seen=None):
+    """Approximate memory held by a query result"""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_sizeof(k, seen) + _sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += _sizeof(vars(obj), seen)
+    return size
+
+
+class QueryCache:
+    """LRU cache of query results, dropped whenever the database changes
+
+    Entries are stamped with database.write_generation() when computed
+    and only served while the generation is unchanged, so a single
+    cheap PRAGMA decides whether anything cached is still valid.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (generation, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing it on a miss"""
+        generation = write_generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value = compute()
+        size = _sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (generation, size, value)
+                self._bytes += size
+                while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+                    self.evictions += 1
+        return value
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# Shared by the web app and the reports
+query_cache = QueryCache()
+
+
+def cached(name):
+    """Decorator caching a query function by name and arguments"""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            return query_cache.get_or_compute(key, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorate
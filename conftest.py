@@ -0,0 +1,16 @@
+# conftest.py - Shared pytest fixtures for Safe Shelter
+import pytest
+import database
+
+# A script run by hand against ./shelter.db, not a pytest module
+collect_ignore = ['test_duplicate.py']
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Fresh shelter database in a temporary directory"""
+    previous = database.DB_PATH
+    database.configure(str(tmp_path / 'shelter.db'))
+    database.create_database()
+    yield database.get_connection()
+    database.configure(previous)
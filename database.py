@@ -1,13 +1,262 @@
 # Safe Shelter Database - Clean Version
+import os
+import re
 import sqlite3
+import threading
+import unicodedata
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
 
-def create_database():
-    """Create the database tables"""
-    conn = sqlite3.connect('shelter.db')
-    cursor = conn.cursor()
-    
-    # Residents table
-    cursor.execute('''
+import metrics
+
+# Database file used by every module. Override with the SHELTER_DB
+# environment variable or by calling configure() before first use.
+DB_PATH = os.environ.get('SHELTER_DB', 'shelter.db')
+READ_ONLY = False
+# How long a statement waits for another connection's write lock
+# before failing with "database is locked"
+BUSY_TIMEOUT_MS = int(os.environ.get('SHELTER_BUSY_TIMEOUT_MS', '5000'))
+
+# Applied to every new connection
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',      # 16 MB page cache
+    'PRAGMA mmap_size=268435456',    # 256 MB memory-mapped I/O
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA foreign_keys=ON',
+)
+
+# Dates are stored as integer Julian day numbers: compact, sortable, and
+# understood directly by SQLite's date functions, so strftime('%Y-%m',
+# service_date) still gives the month. Columns declared JULIANDAY come
+# back as datetime.date, and date parameters are stored as day numbers.
+JULIAN_OFFSET = 1721425  # date.toordinal() + JULIAN_OFFSET = Julian day number
+
+
+def day_number(value):
+    """Julian day number of a date or an ISO date string"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value.toordinal() + JULIAN_OFFSET
+
+
+def from_day_number(number):
+    """The date of a Julian day number"""
+    return date.fromordinal(int(number) - JULIAN_OFFSET)
+
+
+def month_bounds(year_month):
+    """Day numbers of the first day of the month and of the next month
+
+    Used as a half-open range, date >= start AND date < end, which an
+    index on the date column answers directly.
+    """
+    year, month = map(int, year_month.split('-'))
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return day_number(date(year, month, 1)), day_number(date(next_year, next_month, 1))
+
+
+sqlite3.register_adapter(date, day_number)
+sqlite3.register_converter('JULIANDAY', from_day_number)
+
+_local = threading.local()
+_migrated = set()
+_migrate_lock = threading.Lock()
+_generation = 0
+_generation_lock = threading.Lock()
+_change_count = None  # changes.generation when a connection last took its baseline
+_connections_opened = 0
+_last_change = (None, None)  # (write_generation, last_change() result)
+
+
+def configure(path, readonly=False, busy_timeout_ms=None):
+    """Point the access layer at a different database file
+
+    With readonly=True connections are opened read-only and migrations
+    are left to the processes that write, e.g. report workers.
+    busy_timeout_ms, if given, replaces BUSY_TIMEOUT_MS.
+    """
+    global DB_PATH, READ_ONLY, BUSY_TIMEOUT_MS, _change_count
+    close_connection()
+    _change_count = None
+    DB_PATH = path
+    READ_ONLY = readonly
+    if busy_timeout_ms is not None:
+        BUSY_TIMEOUT_MS = busy_timeout_ms
+    _bump_generation()
+
+
+def connect(path=None, readonly=False):
+    """Open a new tuned connection (not shared between threads)"""
+    path = path or DB_PATH
+    # Traced connections time every statement for /metrics
+    factory = metrics.TracedConnection if metrics.ENABLED else sqlite3.Connection
+    if readonly:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, isolation_level=None,
+                               detect_types=sqlite3.PARSE_DECLTYPES, factory=factory)
+    else:
+        conn = sqlite3.connect(path, isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES,
+                               factory=factory)
+    if metrics.ENABLED:
+        conn.set_trace_callback(metrics.registry.trace)
+    for pragma in PRAGMAS:
+        if readonly and pragma.startswith('PRAGMA journal_mode'):
+            continue
+        conn.execute(pragma)
+    conn.execute(f'PRAGMA busy_timeout={int(BUSY_TIMEOUT_MS)}')
+    return conn
+
+
+def get_connection():
+    """Return this thread's connection, opening it on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = connect(readonly=READ_ONLY)
+        _local.conn = conn
+        _local.path = DB_PATH
+        _local.seen = None  # write_generation() takes a baseline for it
+        _count_connection()
+        if not READ_ONLY:
+            _ensure_migrated(DB_PATH)
+    return conn
+
+
+def _count_connection():
+    global _connections_opened
+    with _generation_lock:
+        _connections_opened += 1
+
+
+def connections_opened():
+    """Number of connections get_connection() has opened in this process
+
+    A connection opened after the database file was replaced or
+    restored sees the new file, so anything remembered from the old
+    one, such as row ids, should be looked up again when this changes.
+    """
+    return _connections_opened
+
+
+def close_connection():
+    """Close this thread's connection if one is open"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+        _local.seen = None
+
+
+@contextmanager
+def transaction():
+    """Run a block of writes as one transaction on this thread's connection
+
+    Commits when the block finishes and rolls back if it raises.
+    Nested blocks join the outer transaction.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    _local.after_commit = []
+    try:
+        yield conn
+    except BaseException:
+        _local.after_commit = None
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    _bump_generation()
+    callbacks, _local.after_commit = _local.after_commit, None
+    for callback in callbacks:
+        callback()
+
+
+def after_commit(callback):
+    """Call callback() once this thread's transaction() commits
+
+    Called at once outside a transaction, and dropped if the
+    transaction rolls back.
+    """
+    pending = getattr(_local, 'after_commit', None)
+    if pending is None:
+        callback()
+    else:
+        pending.append(callback)
+
+
+def _bump_generation():
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+
+def write_generation():
+    """Return a number that changes whenever the database is written
+
+    Commits through transaction() bump it directly. Writes by other
+    connections or processes are noticed through PRAGMA data_version,
+    and any other writes on this thread through total_changes, both
+    compared with the values this thread saw last time.
+
+    A new connection has nothing to compare with, so its first look
+    only takes that baseline and checks the shared change count
+    instead; a thread opening its connection does not invalidate what
+    the other threads have cached.
+    """
+    conn = get_connection()
+    seen = (conn.execute('PRAGMA data_version').fetchone()[0], conn.total_changes)
+    previous = getattr(_local, 'seen', None)
+    if previous != seen:
+        _local.seen = seen
+        if previous is None:
+            _check_change_count(conn)
+        else:
+            _bump_generation()
+    return _generation
+
+
+def _check_change_count(conn):
+    """Bump the generation if the changes row moved since the last baseline"""
+    global _change_count, _generation
+    try:
+        count = conn.execute('SELECT generation FROM changes').fetchone()[0]
+    except sqlite3.OperationalError:
+        count = None  # Not migrated yet (read-only); assume it changed
+    with _generation_lock:
+        if count is None or count != _change_count:
+            _change_count = count
+            _generation += 1
+
+
+def last_change():
+    """(count, time) of the writes to residents, services and service types
+
+    Both come from the changes row, which triggers bump on every such
+    write, so all processes agree on them; the row is only read again
+    once write_generation() has noticed a write. The time is a UTC
+    datetime to the second.
+    """
+    global _last_change
+    generation = write_generation()
+    seen, change = _last_change
+    if seen != generation:
+        count, seconds = get_connection().execute('SELECT generation, modified_at FROM changes').fetchone()
+        change = (count, datetime.fromtimestamp(seconds, timezone.utc))
+        _last_change = (generation, change)
+    return change
+
+
+# Schema migrations, applied in order. PRAGMA user_version records how
+# many have run, so existing shelter.db files are upgraded in place.
+
+def _create_tables(conn):
+    """Version 1: residents and services tables"""
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS residents (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             first_name TEXT NOT NULL,
@@ -15,9 +264,7 @@ def create_database():
             entry_date TEXT NOT NULL
         )
     ''')
-    
-    # Services table
-    cursor.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS services (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             resident_id INTEGER NOT NULL,
@@ -25,11 +272,597 @@ def create_database():
             service_date TEXT NOT NULL
         )
     ''')
-    
-    conn.commit()
-    conn.close()
+
+
+def _add_indexes_and_foreign_keys(conn):
+    """Version 2: services.resident_id foreign key and hot-query indexes"""
+    # SQLite cannot add a constraint to an existing table, so rebuild it
+    conn.execute('''
+        CREATE TABLE services_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            resident_id INTEGER NOT NULL REFERENCES residents(id),
+            service_type TEXT NOT NULL,
+            service_date TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO services_new (id, resident_id, service_type, service_date)
+        SELECT id, resident_id, service_type, service_date FROM services
+    ''')
+    conn.execute('DROP TABLE services')
+    conn.execute('ALTER TABLE services_new RENAME TO services')
+
+    orphans = conn.execute('PRAGMA foreign_key_check(services)').fetchall()
+    if orphans:
+        print(f"Warning: {len(orphans)} services reference missing residents")
+
+    # Dashboard/residents page: ORDER BY entry_date, 30-day filters
+    conn.execute('CREATE INDEX idx_residents_entry_date ON residents(entry_date)')
+    # Resident dropdown: ORDER BY last_name
+    conn.execute('CREATE INDEX idx_residents_last_name ON residents(last_name, first_name)')
+    # Duplicate check on LOWER(first_name), LOWER(last_name)
+    conn.execute('CREATE INDEX idx_residents_name_lower ON residents(LOWER(first_name), LOWER(last_name))')
+    # ORDER BY service_date and service_date range filters
+    conn.execute('CREATE INDEX idx_services_date ON services(service_date)')
+    # JOIN services ON resident_id
+    conn.execute('CREATE INDEX idx_services_resident ON services(resident_id, service_date)')
+    # GROUP BY service_type with COUNT(DISTINCT resident_id)
+    conn.execute('CREATE INDEX idx_services_type ON services(service_type, resident_id)')
+
+
+def _normalize_name(name):
+    """Name normalization as the migrations below apply it
+
+    A frozen copy of models.normalize_name as it was when they were
+    written, so a migration keeps producing the keys it always did.
+    Changing how models normalizes names takes a new migration that
+    re-keys residents and service types.
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch))
+    return ' '.join(name.casefold().split())
+
+
+def _add_name_key(conn):
+    """Version 3: normalized, uniquely indexed resident name key"""
+    conn.execute('ALTER TABLE residents ADD COLUMN name_key TEXT')
+    keys = {}
+    for resident_id, first_name, last_name in conn.execute(
+            'SELECT id, first_name, last_name FROM residents ORDER BY id').fetchall():
+        keys.setdefault(f"{_normalize_name(first_name)}|{_normalize_name(last_name)}", resident_id)
+    conn.executemany('UPDATE residents SET name_key = ? WHERE id = ?', keys.items())
+
+    # Duplicates admitted before this migration keep a NULL key
+    skipped = conn.execute('SELECT COUNT(*) FROM residents WHERE name_key IS NULL').fetchone()[0]
+    if skipped:
+        print(f"Warning: {skipped} existing duplicate residents left without a name key")
+
+    conn.execute('DROP INDEX idx_residents_name_lower')
+    conn.execute('CREATE UNIQUE INDEX idx_residents_name_key ON residents(name_key)')
+
+
+def _add_import_progress(conn):
+    """Version 4: checkpoints for resumable bulk imports"""
+    conn.execute('''
+        CREATE TABLE import_progress (
+            source TEXT PRIMARY KEY,
+            rows_done INTEGER NOT NULL
+        )
+    ''')
+
+
+# The statements below are written against services' type column as
+# {type}: the free-text service_type up to version 8, service_type_id
+# from version 9 on. _typed() fills it in for a schema version.
+TYPE_COLUMN = 'service_type_id'
+
+
+def _typed(sql, column=TYPE_COLUMN):
+    """Fill the type column into a statement, or a tuple or dict of them"""
+    if isinstance(sql, dict):
+        return {name: query.format(type=column) for name, query in sql.items()}
+    if isinstance(sql, tuple):
+        return tuple(statement.format(type=column) for statement in sql)
+    return sql.format(type=column)
+
+
+# Trigger-maintained counters read by the dashboard and reports
+STATS_TRIGGERS = (
+    '''CREATE TRIGGER residents_stats_insert AFTER INSERT ON residents BEGIN
+        UPDATE stats SET value = value + 1 WHERE name = 'residents';
+    END''',
+    '''CREATE TRIGGER residents_stats_delete AFTER DELETE ON residents BEGIN
+        UPDATE stats SET value = value - 1 WHERE name = 'residents';
+    END''',
+    '''CREATE TRIGGER services_stats_insert AFTER INSERT ON services BEGIN
+        UPDATE stats SET value = value + 1 WHERE name = 'services';
+        INSERT INTO service_type_counts ({type}, count) VALUES (NEW.{type}, 1)
+            ON CONFLICT({type}) DO UPDATE SET count = count + 1;
+        INSERT INTO service_month_counts (month, count) VALUES (strftime('%Y-%m', NEW.service_date), 1)
+            ON CONFLICT(month) DO UPDATE SET count = count + 1;
+    END''',
+    '''CREATE TRIGGER services_stats_delete AFTER DELETE ON services BEGIN
+        UPDATE stats SET value = value - 1 WHERE name = 'services';
+        UPDATE service_type_counts SET count = count - 1 WHERE {type} = OLD.{type};
+        DELETE FROM service_type_counts WHERE {type} = OLD.{type} AND count <= 0;
+        UPDATE service_month_counts SET count = count - 1 WHERE month = strftime('%Y-%m', OLD.service_date);
+        DELETE FROM service_month_counts WHERE month = strftime('%Y-%m', OLD.service_date) AND count <= 0;
+    END''',
+    '''CREATE TRIGGER services_stats_update AFTER UPDATE OF {type}, service_date ON services BEGIN
+        UPDATE service_type_counts SET count = count - 1 WHERE {type} = OLD.{type};
+        DELETE FROM service_type_counts WHERE {type} = OLD.{type} AND count <= 0;
+        UPDATE service_month_counts SET count = count - 1 WHERE month = strftime('%Y-%m', OLD.service_date);
+        DELETE FROM service_month_counts WHERE month = strftime('%Y-%m', OLD.service_date) AND count <= 0;
+        INSERT INTO service_type_counts ({type}, count) VALUES (NEW.{type}, 1)
+            ON CONFLICT({type}) DO UPDATE SET count = count + 1;
+        INSERT INTO service_month_counts (month, count) VALUES (strftime('%Y-%m', NEW.service_date), 1)
+            ON CONFLICT(month) DO UPDATE SET count = count + 1;
+    END''',
+    # Distinct types and months follow the rows of the two count tables
+    '''CREATE TRIGGER service_types_stats_insert AFTER INSERT ON service_type_counts BEGIN
+        UPDATE stats SET value = value + 1 WHERE name = 'service_types';
+    END''',
+    '''CREATE TRIGGER service_types_stats_delete AFTER DELETE ON service_type_counts BEGIN
+        UPDATE stats SET value = value - 1 WHERE name = 'service_types';
+    END''',
+    '''CREATE TRIGGER active_months_stats_insert AFTER INSERT ON service_month_counts BEGIN
+        UPDATE stats SET value = value + 1 WHERE name = 'active_months';
+    END''',
+    '''CREATE TRIGGER active_months_stats_delete AFTER DELETE ON service_month_counts BEGIN
+        UPDATE stats SET value = value - 1 WHERE name = 'active_months';
+    END''',
+)
+
+# Recomputes every counter from the base tables
+STATS_QUERIES = {
+    'stats': '''
+        SELECT 'residents', COUNT(*) FROM residents
+        UNION ALL SELECT 'services', COUNT(*) FROM services
+        UNION ALL SELECT 'service_types', COUNT(DISTINCT {type}) FROM services
+        UNION ALL SELECT 'active_months', COUNT(DISTINCT strftime('%Y-%m', service_date)) FROM services
+    ''',
+    'service_type_counts': '''
+        SELECT {type}, COUNT(*) FROM services GROUP BY {type}
+    ''',
+    'service_month_counts': '''
+        SELECT strftime('%Y-%m', service_date), COUNT(*) FROM services GROUP BY 1
+    ''',
+}
+
+
+def _add_stats(conn):
+    """Version 5: counters for the dashboard, kept current by triggers"""
+    conn.execute('CREATE TABLE stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID')
+    conn.execute('''
+        CREATE TABLE service_type_counts (
+            service_type TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE service_month_counts (
+            month TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    for trigger in _typed(STATS_TRIGGERS, 'service_type'):
+        conn.execute(trigger)
+    _rebuild_counters(conn, STATS_QUERIES, 'service_type')
+
+
+# Per-month aggregates so monthly reports never touch the base tables
+ROLLUP_TRIGGERS = (
+    '''CREATE TRIGGER residents_rollup_insert AFTER INSERT ON residents BEGIN
+        INSERT INTO monthly_new_residents (month, count) VALUES (strftime('%Y-%m', NEW.entry_date), 1)
+            ON CONFLICT(month) DO UPDATE SET count = count + 1;
+    END''',
+    '''CREATE TRIGGER residents_rollup_delete AFTER DELETE ON residents BEGIN
+        UPDATE monthly_new_residents SET count = count - 1 WHERE month = strftime('%Y-%m', OLD.entry_date);
+    END''',
+    '''CREATE TRIGGER residents_rollup_update AFTER UPDATE OF entry_date ON residents BEGIN
+        UPDATE monthly_new_residents SET count = count - 1 WHERE month = strftime('%Y-%m', OLD.entry_date);
+        INSERT INTO monthly_new_residents (month, count) VALUES (strftime('%Y-%m', NEW.entry_date), 1)
+            ON CONFLICT(month) DO UPDATE SET count = count + 1;
+    END''',
+    '''CREATE TRIGGER services_rollup_insert AFTER INSERT ON services BEGIN
+        INSERT INTO monthly_service_counts (month, {type}, count)
+            VALUES (strftime('%Y-%m', NEW.service_date), NEW.{type}, 1)
+            ON CONFLICT(month, {type}) DO UPDATE SET count = count + 1;
+        INSERT INTO monthly_resident_services (month, resident_id, count)
+            VALUES (strftime('%Y-%m', NEW.service_date), NEW.resident_id, 1)
+            ON CONFLICT(month, resident_id) DO UPDATE SET count = count + 1;
+    END''',
+    '''CREATE TRIGGER services_rollup_delete AFTER DELETE ON services BEGIN
+        UPDATE monthly_service_counts SET count = count - 1
+            WHERE month = strftime('%Y-%m', OLD.service_date) AND {type} = OLD.{type};
+        UPDATE monthly_resident_services SET count = count - 1
+            WHERE month = strftime('%Y-%m', OLD.service_date) AND resident_id = OLD.resident_id;
+    END''',
+    '''CREATE TRIGGER services_rollup_update AFTER UPDATE OF {type}, service_date, resident_id ON services BEGIN
+        UPDATE monthly_service_counts SET count = count - 1
+            WHERE month = strftime('%Y-%m', OLD.service_date) AND {type} = OLD.{type};
+        UPDATE monthly_resident_services SET count = count - 1
+            WHERE month = strftime('%Y-%m', OLD.service_date) AND resident_id = OLD.resident_id;
+        INSERT INTO monthly_service_counts (month, {type}, count)
+            VALUES (strftime('%Y-%m', NEW.service_date), NEW.{type}, 1)
+            ON CONFLICT(month, {type}) DO UPDATE SET count = count + 1;
+        INSERT INTO monthly_resident_services (month, resident_id, count)
+            VALUES (strftime('%Y-%m', NEW.service_date), NEW.resident_id, 1)
+            ON CONFLICT(month, resident_id) DO UPDATE SET count = count + 1;
+    END''',
+)
+
+ROLLUP_QUERIES = {
+    'monthly_new_residents': '''
+        SELECT strftime('%Y-%m', entry_date), COUNT(*) FROM residents GROUP BY 1
+    ''',
+    'monthly_service_counts': '''
+        SELECT strftime('%Y-%m', service_date), {type}, COUNT(*)
+        FROM services GROUP BY 1, 2
+    ''',
+    'monthly_resident_services': '''
+        SELECT strftime('%Y-%m', service_date), resident_id, COUNT(*)
+        FROM services GROUP BY 1, 2
+    ''',
+}
+
+
+def _add_monthly_rollups(conn):
+    """Version 6: per-month service, resident and admission counts"""
+    conn.execute('''
+        CREATE TABLE monthly_new_residents (
+            month TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE monthly_service_counts (
+            month TEXT NOT NULL,
+            service_type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (month, service_type)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE monthly_resident_services (
+            month TEXT NOT NULL,
+            resident_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (month, resident_id)
+        ) WITHOUT ROWID
+    ''')
+    # Top residents of a month
+    conn.execute('CREATE INDEX idx_monthly_resident_top ON monthly_resident_services(month, count)')
+    for trigger in _typed(ROLLUP_TRIGGERS, 'service_type'):
+        conn.execute(trigger)
+    _rebuild_counters(conn, ROLLUP_QUERIES, 'service_type')
+
+
+def _widen_service_type_index(conn):
+    """Version 7: let the system report's single pass read only the index"""
+    conn.execute('DROP INDEX idx_services_type')
+    conn.execute('CREATE INDEX idx_services_type ON services(service_type, resident_id, service_date)')
+
+
+# Keep residents_fts in step with residents
+FTS_TRIGGERS = (
+    '''CREATE TRIGGER residents_fts_insert AFTER INSERT ON residents BEGIN
+        INSERT INTO residents_fts (rowid, first_name, last_name)
+            VALUES (NEW.id, NEW.first_name, NEW.last_name);
+    END''',
+    '''CREATE TRIGGER residents_fts_delete AFTER DELETE ON residents BEGIN
+        INSERT INTO residents_fts (residents_fts, rowid, first_name, last_name)
+            VALUES ('delete', OLD.id, OLD.first_name, OLD.last_name);
+    END''',
+    '''CREATE TRIGGER residents_fts_update AFTER UPDATE OF first_name, last_name ON residents BEGIN
+        INSERT INTO residents_fts (residents_fts, rowid, first_name, last_name)
+            VALUES ('delete', OLD.id, OLD.first_name, OLD.last_name);
+        INSERT INTO residents_fts (rowid, first_name, last_name)
+            VALUES (NEW.id, NEW.first_name, NEW.last_name);
+    END''',
+)
+
+
+def _add_resident_search(conn):
+    """Version 8: FTS5 full-text index over resident names"""
+    conn.execute('''
+        CREATE VIRTUAL TABLE residents_fts USING fts5(
+            first_name, last_name,
+            content='residents', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='1 2 3'
+        )
+    ''')
+    conn.execute("INSERT INTO residents_fts(residents_fts) VALUES ('rebuild')")
+    for trigger in FTS_TRIGGERS:
+        conn.execute(trigger)
+
+
+def _encode_service_types(conn):
+    """Version 9: service types stored once in service_types, referenced by id
+
+    Spellings that differ only in case, accents or spacing
+    ("Counseling", "counseling ") become one type, named after its most
+    used spelling.
+    """
+    conn.execute('''
+        CREATE TABLE service_types (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            key TEXT NOT NULL UNIQUE
+        )
+    ''')
+    conn.execute('CREATE TEMP TABLE service_type_spellings (spelling TEXT PRIMARY KEY, type_id INTEGER)')
+    ids = {}
+    for spelling, _ in conn.execute(
+            'SELECT service_type, COUNT(*) FROM services GROUP BY service_type ORDER BY 2 DESC, 1').fetchall():
+        key = _normalize_name(spelling)
+        if key not in ids:
+            ids[key] = conn.execute('INSERT INTO service_types (name, key) VALUES (?, ?)',
+                                    (' '.join(spelling.split()), key)).lastrowid
+        conn.execute('INSERT INTO temp.service_type_spellings VALUES (?, ?)', (spelling, ids[key]))
+
+    # Counters and their triggers are re-keyed on the type id
+    for trigger in STATS_TRIGGERS + ROLLUP_TRIGGERS:
+        conn.execute('DROP TRIGGER IF EXISTS ' + re.search(r'CREATE TRIGGER (\w+)', trigger).group(1))
+    conn.execute('DROP TABLE service_type_counts')
+    conn.execute('DROP TABLE monthly_service_counts')
+    conn.execute('''
+        CREATE TABLE service_type_counts (
+            service_type_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE monthly_service_counts (
+            month TEXT NOT NULL,
+            service_type_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (month, service_type_id)
+        ) WITHOUT ROWID
+    ''')
+
+    conn.execute('''
+        CREATE TABLE services_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            resident_id INTEGER NOT NULL REFERENCES residents(id),
+            service_type_id INTEGER NOT NULL REFERENCES service_types(id),
+            service_date TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO services_new (id, resident_id, service_type_id, service_date)
+        SELECT s.id, s.resident_id, t.type_id, s.service_date
+        FROM services s
+        JOIN temp.service_type_spellings t ON t.spelling = s.service_type
+    ''')
+    conn.execute('DROP TABLE services')
+    conn.execute('ALTER TABLE services_new RENAME TO services')
+    conn.execute('DROP TABLE temp.service_type_spellings')
+
+    conn.execute('CREATE INDEX idx_services_date ON services(service_date)')
+    conn.execute('CREATE INDEX idx_services_resident ON services(resident_id, service_date)')
+    conn.execute('CREATE INDEX idx_services_type ON services(service_type_id, resident_id, service_date)')
+    for trigger in _typed(STATS_TRIGGERS + ROLLUP_TRIGGERS):
+        conn.execute(trigger)
+    _rebuild_counters(conn, {**STATS_QUERIES, **ROLLUP_QUERIES})
+
+
+def _store_dates_as_day_numbers(conn):
+    """Version 10: entry_date and service_date as Julian day numbers
+
+    Both tables are rebuilt with JULIANDAY columns that only accept
+    integers, and services gain an optional service_time in seconds
+    after midnight. Month rollups are unchanged: strftime() reads day
+    numbers as well as ISO text.
+    """
+    for trigger in STATS_TRIGGERS + ROLLUP_TRIGGERS + FTS_TRIGGERS:
+        conn.execute('DROP TRIGGER IF EXISTS ' + re.search(r'CREATE TRIGGER (\w+)', trigger).group(1))
+
+    conn.execute('''
+        CREATE TABLE residents_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            entry_date JULIANDAY NOT NULL CHECK (typeof(entry_date) = 'integer'),
+            name_key TEXT
+        )
+    ''')
+    # julianday() gives midnight (x.5); the day number is the following noon
+    conn.execute('''
+        INSERT INTO residents_new (id, first_name, last_name, entry_date, name_key)
+        SELECT id, first_name, last_name, CAST(julianday(entry_date) + 0.5 AS INTEGER), name_key
+        FROM residents
+    ''')
+    conn.execute('DROP TABLE residents')
+    conn.execute('ALTER TABLE residents_new RENAME TO residents')
+    conn.execute('CREATE INDEX idx_residents_entry_date ON residents(entry_date)')
+    conn.execute('CREATE INDEX idx_residents_last_name ON residents(last_name, first_name)')
+    conn.execute('CREATE UNIQUE INDEX idx_residents_name_key ON residents(name_key)')
+
+    conn.execute('''
+        CREATE TABLE services_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            resident_id INTEGER NOT NULL REFERENCES residents(id),
+            service_type_id INTEGER NOT NULL REFERENCES service_types(id),
+            service_date JULIANDAY NOT NULL CHECK (typeof(service_date) = 'integer'),
+            service_time INTEGER CHECK (service_time BETWEEN 0 AND 86399)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO services_new (id, resident_id, service_type_id, service_date)
+        SELECT id, resident_id, service_type_id, CAST(julianday(service_date) + 0.5 AS INTEGER)
+        FROM services
+    ''')
+    conn.execute('DROP TABLE services')
+    conn.execute('ALTER TABLE services_new RENAME TO services')
+    conn.execute('CREATE INDEX idx_services_date ON services(service_date)')
+    conn.execute('CREATE INDEX idx_services_resident ON services(resident_id, service_date)')
+    conn.execute('CREATE INDEX idx_services_type ON services(service_type_id, resident_id, service_date)')
+
+    for trigger in _typed(STATS_TRIGGERS + ROLLUP_TRIGGERS) + FTS_TRIGGERS:
+        conn.execute(trigger)
+
+
+def _add_discharge_tracking(conn):
+    """Version 11: resident discharge dates and the archived months list
+
+    archived_months names every month with rows moved to the archive
+    database by archive.py, so reports know when to read it as well.
+    """
+    conn.execute('''
+        ALTER TABLE residents ADD COLUMN discharge_date JULIANDAY
+            CHECK (discharge_date IS NULL OR typeof(discharge_date) = 'integer')
+    ''')
+    # Archival looks for long-discharged residents; most rows are NULL
+    conn.execute('''
+        CREATE INDEX idx_residents_discharge_date ON residents(discharge_date)
+        WHERE discharge_date IS NOT NULL
+    ''')
+    conn.execute('CREATE TABLE archived_months (month TEXT PRIMARY KEY) WITHOUT ROWID')
+
+
+# Every write to a table the web pages show bumps the changes row
+CHANGE_TRIGGERS = tuple(
+    f'''CREATE TRIGGER {table}_changed_{event.lower()} AFTER {event} ON {table} BEGIN
+        UPDATE changes SET generation = generation + 1,
+                           modified_at = CAST(strftime('%s', 'now') AS INTEGER);
+    END'''
+    for table in ('residents', 'services', 'service_types')
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+)
+
+
+def _add_change_marker(conn):
+    """Version 12: a one-row count and time of the last data change
+
+    Used as the validator for conditional web requests. Kept in the
+    database rather than in memory so every process serving the pages
+    hands out the same ETags.
+    """
+    conn.execute('''
+        CREATE TABLE changes (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL,
+            modified_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT INTO changes VALUES (1, 1, CAST(strftime('%s', 'now') AS INTEGER))")
+    for trigger in CHANGE_TRIGGERS:
+        conn.execute(trigger)
+
+
+MIGRATIONS = [
+    _create_tables,
+    _add_indexes_and_foreign_keys,
+    _add_name_key,
+    _add_import_progress,
+    _add_stats,
+    _add_monthly_rollups,
+    _widen_service_type_index,
+    _add_resident_search,
+    _encode_service_types,
+    _store_dates_as_day_numbers,
+    _add_discharge_tracking,
+    _add_change_marker,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate():
+    """Apply any pending migrations and return the number applied"""
+    conn = get_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        # Table rebuilds must not trip foreign key actions
+        conn.execute('PRAGMA foreign_keys=OFF')
+        try:
+            with transaction():
+                MIGRATIONS[number - 1](conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+        finally:
+            conn.execute('PRAGMA foreign_keys=ON')
+    return SCHEMA_VERSION - version
+
+
+def _ensure_migrated(path):
+    """Run migrations once per database file per process"""
+    with _migrate_lock:
+        if path not in _migrated:
+            migrate()
+            _migrated.add(path)
+
+
+def _rebuild_counters(conn, queries, column=TYPE_COLUMN):
+    """Replace counter tables with values freshly computed from the base tables"""
+    for table, query in _typed(queries, column).items():
+        rows = conn.execute(query).fetchall()
+        conn.execute(f'DELETE FROM {table}')
+        if rows:
+            placeholders = ', '.join('?' * len(rows[0]))
+            conn.executemany(f'INSERT INTO {table} VALUES ({placeholders})', rows)
+    # Inserting into the count tables bumped the scalar counters again
+    conn.executemany('UPDATE stats SET value = ? WHERE name = ?',
+                     [(value, name) for name, value in conn.execute(_typed(STATS_QUERIES['stats'], column))])
+
+
+def backfill_rollups():
+    """Rebuild the monthly rollup tables from the full service history"""
+    with transaction() as conn:
+        _rebuild_counters(conn, ROLLUP_QUERIES)
+
+
+def check_stats(repair=False):
+    """Compare the trigger-maintained counters with the base tables
+
+    Covers the dashboard counters and the monthly rollups. Returns a
+    list of (table, key, stored, actual) differences, and rebuilds the
+    drifted tables when repair is true.
+    """
+    conn = get_connection()
+    drift = []
+    drifted = {}
+    with transaction():
+        for table, query in _typed({**STATS_QUERIES, **ROLLUP_QUERIES}).items():
+            actual = {row[:-1]: row[-1] for row in conn.execute(query)}
+            stored = {row[:-1]: row[-1] for row in conn.execute(f'SELECT * FROM {table}')}
+            for key in sorted(actual.keys() | stored.keys()):
+                # Rollups keep zero rows for months whose services were removed
+                if actual.get(key, 0) != stored.get(key, 0):
+                    drift.append((table, '/'.join(map(str, key)), stored.get(key), actual.get(key)))
+                    drifted[table] = query
+        if drifted and repair:
+            _rebuild_counters(conn, drifted)
+    return drift
+
+
+def create_database():
+    """Create the database tables"""
+    migrate()
     print("Database tables created successfully!")
 
 # Test the function
 if __name__ == "__main__":
-    create_database()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Safe Shelter database maintenance")
+    parser.add_argument('command', nargs='?', default='create',
+                        choices=['create', 'check-stats', 'backfill-rollups'])
+    parser.add_argument('--repair', action='store_true', help="fix any counter drift found")
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        create_database()
+    elif args.command == 'backfill-rollups':
+        backfill_rollups()
+        print("✓ Monthly rollups rebuilt")
+    else:
+        drift = check_stats(args.repair)
+        for table, key, stored, actual in drift:
+            print(f"   {table}[{key}]: stored {stored}, actual {actual}")
+        if not drift:
+            print("✓ Counters are consistent")
+        elif args.repair:
+            print(f"✓ Repaired {len(drift)} counters")
+        else:
+            print(f"✗ {len(drift)} counters drifted (run with --repair to fix)")
@@ -0,0 +1,227 @@
+# events.py - Live dashboard updates pushed as Server-Sent Events
+import json
+import logging
+import threading
+from collections import deque
+
+import archive
+from database import get_connection, last_change
+from models import Resident, Service, Stats
+
+POLL_SECONDS = 1.0        # how often writes by other processes are looked for
+KEEPALIVE_SECONDS = 15.0  # comment sent on a quiet stream so proxies keep it open
+MAX_PENDING = 100         # messages a slow client may fall behind by
+RECENT_ROWS = 5           # rows in the dashboard's recent activity tables
+
+log = logging.getLogger('shelter.events')
+
+
+def format_event(event, data, event_id=None):
+    """One message in the text/event-stream format"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+# Tells the dashboard to reload: rows were removed, or it missed changes
+RESET = format_event('reset', {})
+
+
+def resident_event(row):
+    return {'id': row.id, 'first_name': row.first_name, 'last_name': row.last_name,
+            'entry_date': row.entry_date.isoformat()}
+
+
+def service_event(row):
+    return {'id': row.id, 'first_name': row.first_name, 'last_name': row.last_name,
+            'service_type': row.service_type, 'service_date': row.service_date.isoformat(),
+            'service_time': row.service_time}
+
+
+class Subscriber:
+    """Messages waiting to be sent down one open event stream"""
+
+    def __init__(self, max_pending=MAX_PENDING):
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._ready = threading.Condition()
+
+    def put(self, message):
+        with self._ready:
+            if len(self._pending) >= self.max_pending:
+                # Too far behind to catch up: reload rather than replay
+                self._pending.clear()
+                message = RESET
+            self._pending.append(message)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """The next message, or None if none arrived within timeout"""
+        with self._ready:
+            if not self._pending:
+                self._ready.wait(timeout)
+            return self._pending.popleft() if self._pending else None
+
+
+class EventBroker:
+    """Turns database writes into dashboard events for every open stream
+
+    A single watcher thread checks database.last_change() every
+    poll_seconds, or at once when notify() is called after a write. On
+    a change it reads the new residents, new services and counters once
+    and hands the same encoded messages to every subscriber, so the
+    queries run per change rather than per open dashboard.
+
+    Event ids are the database change count, which all processes share:
+    a client reconnecting with an older Last-Event-ID, or subscribing
+    with an older ?since= than the broker has seen, is told to reload.
+    """
+
+    def __init__(self, poll_seconds=POLL_SECONDS, max_pending=MAX_PENDING):
+        self.poll_seconds = poll_seconds
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closing = False
+        self._forget()
+
+    def _forget(self):
+        self.count = None          # change count the state below is from
+        self.totals = None         # (residents, services)
+        self.last_ids = (0, 0)     # newest (resident, service) ids seen
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._closing = False
+                self._thread = threading.Thread(target=self._run, name='shelter-events', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            if self._closing:
+                return
+            try:
+                with self._poll_lock:
+                    with self._lock:
+                        idle = not self._subscribers
+                    if not idle:
+                        self._poll()
+            except Exception:
+                log.exception("Failed to read dashboard changes")
+
+    def _baseline(self, conn, count, totals):
+        self.totals = totals
+        self.last_ids = (conn.execute('SELECT COALESCE(MAX(id), 0) FROM residents').fetchone()[0],
+                         conn.execute('SELECT COALESCE(MAX(id), 0) FROM services').fetchone()[0])
+        self.count = count
+
+    def _poll(self):
+        """Publish what changed since the last poll; returns the messages"""
+        if self.count is not None and last_change()[0] == self.count:
+            return []  # The usual case, answered without a query
+        conn = get_connection()
+        archived = archive.totals(conn)  # Attaches the archive, which a transaction may not
+        # One read transaction, so the count and the rows agree
+        conn.execute('BEGIN')
+        try:
+            count = conn.execute('SELECT generation FROM changes').fetchone()[0]
+            # Live counts, so rows deleted by archiving are noticed
+            totals = Stats.totals(include_archive=False)
+            totals = (totals['residents'], totals['services'])
+            if self.count is None:
+                self._baseline(conn, count, totals)
+                return []
+            if totals[0] < self.totals[0] or totals[1] < self.totals[1]:
+                # Rows were deleted (e.g. archived); the recent lists may have shifted
+                self._baseline(conn, count, totals)
+                messages = [RESET]
+            else:
+                residents = Resident.added_after(self.last_ids[0], RECENT_ROWS)
+                services = Service.added_after(self.last_ids[1], RECENT_ROWS)
+                messages = [format_event('resident', resident_event(row), count) for row in residents]
+                messages += [format_event('service', service_event(row), count) for row in services]
+                if totals != self.totals:
+                    messages.append(format_event(
+                        'stats', {'total_residents': totals[0] + archived['residents'],
+                                  'total_services': totals[1] + archived['services']}, count))
+                self.last_ids = (residents[-1].id if residents else self.last_ids[0],
+                                 services[-1].id if services else self.last_ids[1])
+                self.totals = totals
+                self.count = count
+        finally:
+            conn.execute('COMMIT')
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            for message in messages:
+                subscriber.put(message)
+        return messages
+
+    def poll(self):
+        """Look for changes now, as the watcher thread does"""
+        with self._poll_lock:
+            return self._poll()
+
+    def notify(self):
+        """Wake the watcher after a write, instead of waiting for its next poll"""
+        self._wake.set()
+
+    def subscribe(self, since=None):
+        """Open a stream for a page rendered at change count since"""
+        subscriber = Subscriber(self.max_pending)
+        with self._poll_lock:
+            if self.count is None:
+                self._poll()
+            if since is not None and since < self.count:
+                subscriber.put(RESET)
+            with self._lock:
+                self._subscribers.add(subscriber)
+        self._start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._poll_lock:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+                idle = not self._subscribers
+            if idle:
+                self._forget()  # Start afresh with the next subscriber
+
+    def stream(self, since=None, keepalive=KEEPALIVE_SECONDS):
+        """Yield text/event-stream messages until the client goes away
+
+        The subscription is opened when the first message is wanted and
+        closed when the generator is, i.e. when the response ends.
+        """
+        subscriber = self.subscribe(since)
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                message = subscriber.get(keepalive)
+                yield ': keepalive\n\n' if message is None else message
+                if message is RESET:
+                    return  # The page reloads and opens a new stream
+        finally:
+            self.unsubscribe(subscriber)
+
+    def close(self):
+        """Stop the watcher thread"""
+        with self._lock:
+            thread = self._thread
+            self._closing = True
+        self._wake.set()
+        if thread is not None and thread.is_alive():
+            thread.join()
+
+
+# Shared by the web app
+broker = EventBroker()
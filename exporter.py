@@ -0,0 +1,193 @@
+# exporter.py - Streaming CSV / JSON Lines export for Safe Shelter
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date, timedelta
+
+import archive
+from database import get_connection
+
+BATCH_SIZE = 1000
+FORMATS = ('csv', 'jsonl')
+
+# kind -> (columns, select, range column, order, other conditions);
+# rollup kinds filter by month and skip months whose count fell to zero.
+# {table} names are filled in by _sources().
+EXPORTS = {
+    'residents': (
+        ('id', 'first_name', 'last_name', 'entry_date'),
+        'SELECT id, first_name, last_name, entry_date FROM {residents}',
+        'entry_date', 'entry_date, id', ()),
+    'services': (
+        ('id', 'resident_id', 'first_name', 'last_name', 'service_type', 'service_date',
+         'service_time'),
+        '''SELECT s.id, s.resident_id, r.first_name, r.last_name, t.name, s.service_date,
+                  time(s.service_time, 'unixepoch')
+           FROM {services} s
+           JOIN {residents} r ON s.resident_id = r.id
+           JOIN service_types t ON t.id = s.service_type_id''',
+        's.service_date', 's.service_date, s.id', ()),
+    'monthly_residents': (
+        ('month', 'new_residents'),
+        'SELECT month, count FROM {monthly_new_residents}',
+        'month', 'month', ('count > 0',)),
+    'monthly_services': (
+        ('month', 'service_type', 'services'),
+        '''SELECT m.month, t.name, m.count
+           FROM {monthly_service_counts} m
+           JOIN service_types t ON t.id = m.service_type_id''',
+        'm.month', 'm.month, m.count DESC, t.name', ('m.count > 0',)),
+}
+
+# Columns read from each table, and the key a month's rollup rows are summed by
+ARCHIVED_TABLES = {
+    'residents': 'id, first_name, last_name, entry_date',
+    'services': 'id, resident_id, service_type_id, service_date, service_time',
+}
+ARCHIVED_ROLLUPS = {
+    'monthly_new_residents': 'month',
+    'monthly_service_counts': 'month, service_type_id',
+}
+
+
+def _sources(conn, start_month, end_month):
+    """Table names for the export queries, with the archive if it holds part of the range"""
+    archived = conn.execute('SELECT 1 FROM archived_months WHERE month >= COALESCE(?, month) '
+                            'AND month <= COALESCE(?, month) LIMIT 1', (start_month, end_month)).fetchone()
+    names = {name: name for name in (*ARCHIVED_TABLES, *ARCHIVED_ROLLUPS)}
+    if archived is None:
+        return names
+    if not archive.attach(conn):
+        raise FileNotFoundError(f"rows in the range were archived but {archive.archive_path()} is missing")
+    for table, columns in ARCHIVED_TABLES.items():
+        names[table] = (f'(SELECT {columns} FROM main.{table} '
+                        f'UNION ALL SELECT {columns} FROM archive.{table})')
+    for table, key in ARCHIVED_ROLLUPS.items():
+        names[table] = (f'(SELECT {key}, SUM(count) AS count FROM (SELECT * FROM main.{table} '
+                        f'UNION ALL SELECT * FROM archive.{table}) GROUP BY {key})')
+    return names
+
+
+def open_export(kind, start=None, end=None):
+    """Run the export query and return (columns, cursor)
+
+    start and end are inclusive ISO dates (either may be None); for the
+    monthly kinds they select whole months. Months moved out by
+    archive.py are read from the archive as well. Raises ValueError for
+    an unknown kind or a malformed date before any row is read, and
+    FileNotFoundError if the range was archived but the archive is gone.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f"unknown export {kind!r}")
+    columns, select, range_column, order, conditions = EXPORTS[kind]
+    start, end = [date.fromisoformat(value) if value else None for value in (start, end)]
+
+    # Half-open ranges: from start up to the day (or month) after end
+    where, params = list(conditions), []
+    if range_column.endswith('month'):
+        bounds = [start and start.strftime('%Y-%m'), end and end.strftime('%Y-%m')]
+        ops = ('>=', '<=')
+    else:
+        bounds = [start, end and end + timedelta(days=1)]
+        ops = ('>=', '<')
+    for value, op in zip(bounds, ops):
+        if value:
+            where.append(f"{range_column} {op} ?")
+            params.append(value)
+    conn = get_connection()
+    months = [value and value.strftime('%Y-%m') for value in (start, end)]
+    sql = select.format(**_sources(conn, *months)) + (' WHERE ' + ' AND '.join(where) if where else '') + f' ORDER BY {order}'
+    # A cursor of its own: rows are stepped out of SQLite as they are fetched
+    return columns, conn.cursor().execute(sql, params)
+
+
+def _batches(cursor, batch_size):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def csv_chunks(columns, cursor, batch_size=BATCH_SIZE):
+    """Yield the header and then one CSV text chunk per batch of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in _batches(cursor, batch_size):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # Header of an empty export
+
+
+def jsonl_chunks(columns, cursor, batch_size=BATCH_SIZE):
+    """Yield one JSON Lines text chunk per batch of rows"""
+    for rows in _batches(cursor, batch_size):
+        yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + '\n'
+                      for row in rows)
+
+
+def gzip_chunks(chunks):
+    """Compress a stream of byte chunks into a gzip stream as it goes"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(kind, fmt='csv', start=None, end=None, compress=False, batch_size=BATCH_SIZE):
+    """Return an iterator of encoded chunks of an export
+
+    The query runs (and the arguments are checked) immediately; rows are
+    then read batch_size at a time as the iterator is consumed, so memory
+    does not grow with the size of the export.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}")
+    columns, cursor = open_export(kind, start, end)
+    chunks = csv_chunks if fmt == 'csv' else jsonl_chunks
+    encoded = (chunk.encode('utf-8') for chunk in chunks(columns, cursor, batch_size))
+    return gzip_chunks(encoded) if compress else encoded
+
+
+def filename(kind, fmt, start=None, end=None, compress=False):
+    """Download name such as services_2024-01-01_2024-03-31.csv.gz"""
+    name = '_'.join([kind] + [value for value in (start, end) if value])
+    return f"{name}.{fmt}" + ('.gz' if compress else '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export residents, services or monthly summaries")
+    parser.add_argument('kind', choices=sorted(EXPORTS))
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--start', help="first date to include (YYYY-MM-DD)")
+    parser.add_argument('--end', help="last date to include (YYYY-MM-DD)")
+    parser.add_argument('--gzip', action='store_true', help="compress the output")
+    parser.add_argument('-o', '--output', help="file to write (default: standard output)")
+    args = parser.parse_args()
+
+    try:
+        chunks = export(args.kind, args.format, args.start, args.end, args.gzip)
+    except ValueError as e:
+        parser.error(str(e))
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    if args.output:
+        print(f"✓ Exported {args.kind} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
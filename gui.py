@@ -1,17 +1,39 @@
 # gui.py - Safe Shelter Management System GUI
+import sys
 import tkinter as tk
-from tkinter import messagebox
-import sqlite3
-from models import Resident, Service
+from tkinter import messagebox, ttk
+from datetime import date
+from gui_views import ListSource, ModelSource, VirtualList
+from gui_worker import BackgroundWorker, FrameLatencyProbe
+from models import Resident, Service, ServiceType
+
+SEARCH_RESULTS = 100
+PROGRESS_DELAY = 0.3  # seconds before a running job shows the progress bar
+
+
+def format_resident(resident):
+    left = f", Discharged: {resident.discharge_date}" if resident.discharge_date else ""
+    return f"ID {resident.id}: {resident.first_name} {resident.last_name} (Entered: {resident.entry_date}{left})"
+
+
+def format_service(service):
+    at = f" at {service.service_time[:5]}" if service.service_time else ""
+    return f"• {service.service_type} for {service.first_name} {service.last_name} on {service.service_date}{at}"
+
 
 class ShelterApp:
-    def __init__(self):
+    def __init__(self, probe=False):
         self.window = tk.Tk()
         self.window.title("Safe Shelter Management System")
-        self.window.geometry("600x600")
+        self.window.geometry("600x650")
+        
+        # Database work runs off the Tk thread so the window never freezes
+        self.worker = BackgroundWorker(self.window, on_progress=self.show_progress)
+        self.probe = FrameLatencyProbe(self.window) if probe else None
         
         self.create_widgets()
         self.refresh_list()
+        self.load_service_types()
     
     def create_widgets(self):
         # Title
@@ -42,6 +64,8 @@ class ShelterApp:
         tk.Label(search_frame, text="Search:").pack(side=tk.LEFT, padx=5)
         self.search_entry = tk.Entry(search_frame, width=25)
         self.search_entry.pack(side=tk.LEFT, padx=5)
+        self.search_entry.bind("<KeyRelease>", self.search_as_you_type)
+        self.search_job = None
         
         search_btn = tk.Button(search_frame, text="Search", command=self.search_residents,
                               bg="orange", fg="white")
@@ -59,24 +83,26 @@ class ShelterApp:
         self.resident_id_entry.grid(row=0, column=1, padx=5, pady=5)
         
         tk.Label(service_frame, text="Service Type:").grid(row=0, column=2, padx=5, pady=5, sticky="w")
-        self.service_type_entry = tk.Entry(service_frame, width=20)
+        # Existing types to pick from; a new one can still be typed in
+        self.service_type_entry = ttk.Combobox(service_frame, width=18)
         self.service_type_entry.grid(row=0, column=3, padx=5, pady=5)
         
         service_btn = tk.Button(service_frame, text="Log Service", command=self.log_service,
                                bg="blue", fg="white")
         service_btn.grid(row=0, column=4, padx=10, pady=5)
         
-        # Residents List Section
-        list_frame = tk.LabelFrame(self.window, text="Current Residents", padx=10, pady=10)
-        list_frame.pack(padx=20, pady=10, fill="both", expand=True)
+        batch_btn = tk.Button(service_frame, text="Log for Selected Residents",
+                              command=self.log_service_for_selected)
+        batch_btn.grid(row=1, column=2, columnspan=3, padx=10, pady=5, sticky="e")
         
-        # Create a scrollbar
-        scrollbar = tk.Scrollbar(list_frame)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        # Residents List Section (only the rows on screen are loaded)
+        self.list_frame = tk.LabelFrame(self.window, text="Current Residents", padx=10, pady=10)
+        self.list_frame.pack(padx=20, pady=10, fill="both", expand=True)
         
-        self.residents_list = tk.Listbox(list_frame, yscrollcommand=scrollbar.set, height=12)
+        self.residents_list = VirtualList(self.list_frame, self.worker, format_resident,
+                                          empty_text="No residents in database",
+                                          selectmode=tk.EXTENDED)
         self.residents_list.pack(fill="both", expand=True)
-        scrollbar.config(command=self.residents_list.yview)
         
         # Button Frame
         btn_frame = tk.Frame(self.window)
@@ -88,8 +114,44 @@ class ShelterApp:
         report_btn = tk.Button(btn_frame, text="View Services", command=self.view_services)
         report_btn.pack(side=tk.LEFT, padx=5)
         
+        discharge_btn = tk.Button(btn_frame, text="Discharge Selected", command=self.discharge_selected)
+        discharge_btn.pack(side=tk.LEFT, padx=5)
+        
         exit_btn = tk.Button(btn_frame, text="Exit", command=self.window.quit, bg="red", fg="white")
         exit_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Status bar with progress for long-running database work
+        status_frame = tk.Frame(self.window)
+        status_frame.pack(side=tk.BOTTOM, fill="x", padx=20, pady=5)
+        self.status_label = tk.Label(status_frame, text="Ready", anchor="w")
+        self.status_label.pack(side=tk.LEFT, fill="x", expand=True)
+        self.progress = ttk.Progressbar(status_frame, mode="indeterminate", length=120)
+        self.progress_running = False
+    
+    def show_progress(self, running):
+        """Show the progress bar while a job has run longer than PROGRESS_DELAY"""
+        slow = [(description, elapsed) for description, elapsed in running if elapsed >= PROGRESS_DELAY]
+        if slow:
+            description, elapsed = max(slow, key=lambda job: job[1])
+            self.status_label.config(text=f"{description}... {elapsed:.1f}s")
+            if not self.progress_running:
+                self.progress.pack(side=tk.RIGHT)
+                self.progress.start(15)
+                self.progress_running = True
+        elif self.progress_running:
+            self.progress.stop()
+            self.progress.pack_forget()
+            self.progress_running = False
+            self.status_label.config(text="Ready")
+        if self.probe is not None and not slow:
+            lag = self.probe.summary()
+            if lag:
+                self.status_label.config(
+                    text=f"Frame lag p50 {lag['p50']:.1f} ms, p95 {lag['p95']:.1f} ms, max {lag['max']:.0f} ms")
+    
+    def show_error(self, title):
+        """Error callback for background jobs"""
+        return lambda error: messagebox.showerror("Error", f"{title}: {error}")
     
     def add_resident(self):
         """Add a new resident to the database with duplicate checking"""
@@ -100,22 +162,26 @@ class ShelterApp:
             messagebox.showerror("Error", "Please enter both first and last name")
             return
         
-        # Check for duplicate BEFORE adding
-        if Resident.check_duplicate(first, last):
+        # Add the resident (rejected atomically if a duplicate)
+        resident = Resident(first, last, str(date.today()))
+        self.worker.submit(resident.save, description="Saving resident",
+                           on_done=lambda result: self.resident_saved(resident),
+                           on_error=self.show_error("Failed to add resident"))
+    
+    def resident_saved(self, resident):
+        """Report the outcome of add_resident once the save finishes"""
+        first, last = resident.first_name, resident.last_name
+        if resident.id is None:
             messagebox.showerror("Error", 
                 f"⚠️ DUPLICATE RESIDENT ⚠️\n\n"
                 f"Resident '{first} {last}' already exists in the system!\n\n"
                 f"Please check the residents list or use a different name.")
             return
         
-        # Add the resident (only if not a duplicate)
-        from datetime import date
-        resident = Resident(first, last, str(date.today()))
-        resident.save()
         messagebox.showinfo("Success", 
             f"✅ RESIDENT ADDED\n\n"
             f"Name: {first} {last}\n"
-            f"Entry Date: {date.today()}\n\n"
+            f"Entry Date: {resident.entry_date}\n\n"
             f"Resident has been added to the database.")
         
         # Clear fields and refresh list
@@ -123,122 +189,153 @@ class ShelterApp:
         self.last_entry.delete(0, tk.END)
         self.refresh_list()
     
-    def search_residents(self):
+    def search_residents(self, event=None):
         """Search residents by name"""
-        search_term = self.search_entry.get().strip().lower()
+        search_term = self.search_entry.get().strip()
         
         if not search_term:
-            messagebox.showwarning("Search", "Please enter a name to search for")
+            if event is None:
+                messagebox.showwarning("Search", "Please enter a name to search for")
+            else:
+                self.refresh_list()  # Search box cleared while typing
             return
         
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM residents 
-            WHERE LOWER(first_name) LIKE ? OR LOWER(last_name) LIKE ? OR 
-                  LOWER(first_name || ' ' || last_name) LIKE ?
-            ORDER BY last_name
-        ''', (f'%{search_term}%', f'%{search_term}%', f'%{search_term}%'))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        # Display results
-        self.residents_list.delete(0, tk.END)
-        
+        # A newer search or refresh on the "list" channel cancels this one
+        self.worker.submit(Resident.search, search_term, SEARCH_RESULTS,
+                           channel="list", description="Searching",
+                           on_done=lambda found: self.show_search_results(search_term, *found),
+                           on_error=self.show_error("Search failed"))
+    
+    def show_search_results(self, search_term, results, has_more):
+        """Display search results in the residents list"""
         if results:
-            self.residents_list.insert(tk.END, f"=== SEARCH RESULTS ({len(results)} found) ===")
-            for resident in results:
-                display_text = f"ID {resident[0]}: {resident[1]} {resident[2]} (Entered: {resident[3]})"
-                self.residents_list.insert(tk.END, display_text)
+            shown = f"first {len(results)} shown" if has_more else f"{len(results)} found"
+            self.list_frame.config(text=f"Search Results ({shown})")
         else:
-            self.residents_list.insert(tk.END, f"No residents found for '{search_term}'")
+            self.list_frame.config(text="Search Results")
+        self.residents_list.empty_text = f"No residents found for '{search_term}'"
+        self.residents_list.set_source(ListSource(results))
+    
+    def search_as_you_type(self, event):
+        """Re-run the search shortly after the user stops typing"""
+        if self.search_job is not None:
+            self.window.after_cancel(self.search_job)
+        self.search_job = self.window.after(250, self.search_residents, event)
     
     def log_service(self):
         """Log a service for a resident"""
         try:
             resident_id = int(self.resident_id_entry.get().strip())
-            service_type = self.service_type_entry.get().strip()
-            
-            if service_type:
-                Service.add(resident_id, service_type)
-                messagebox.showinfo("Success", 
-                                  f"✅ SERVICE LOGGED\n\n"
-                                  f"Service: {service_type}\n"
-                                  f"For Resident ID: {resident_id}\n"
-                                  f"Date: {date.today().isoformat()}")
-                self.resident_id_entry.delete(0, tk.END)
-                self.service_type_entry.delete(0, tk.END)
-            else:
-                messagebox.showerror("Error", "Please enter a service type")
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid resident ID number")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to log service: {str(e)}")
+            return
+        service_type = self.service_type_entry.get().strip()
+        
+        if not service_type:
+            messagebox.showerror("Error", "Please enter a service type")
+            return
+        
+        self.worker.submit(Service.add, resident_id, service_type, description="Logging service",
+                           on_done=lambda result: self.service_logged(resident_id, service_type),
+                           on_error=self.show_error("Failed to log service"))
     
-    def refresh_list(self):
-        """Refresh the residents list from database"""
-        self.residents_list.delete(0, tk.END)
-        residents = Resident.get_all()
+    def service_logged(self, resident_id, service_type):
+        """Confirm a logged service once the insert finishes"""
+        messagebox.showinfo("Success", 
+                          f"✅ SERVICE LOGGED\n\n"
+                          f"Service: {service_type}\n"
+                          f"For Resident ID: {resident_id}\n"
+                          f"Date: {date.today().isoformat()}")
+        self.resident_id_entry.delete(0, tk.END)
+        self.service_type_entry.delete(0, tk.END)
+        self.load_service_types()
+    
+    def log_service_for_selected(self):
+        """Log the service type for every resident selected in the list"""
+        resident_ids = [row.id for row in self.residents_list.selected_rows()]
+        service_type = self.service_type_entry.get().strip()
         
-        if not residents:
-            self.residents_list.insert(tk.END, "No residents in database")
-        else:
-            for resident in residents:
-                display_text = f"ID {resident[0]}: {resident[1]} {resident[2]} (Entered: {resident[3]})"
-                self.residents_list.insert(tk.END, display_text)
+        if not resident_ids:
+            messagebox.showerror("Error", "Select one or more residents in the list")
+            return
+        if not service_type:
+            messagebox.showerror("Error", "Please enter a service type")
+            return
+        
+        self.worker.submit(Service.log_for_residents, resident_ids, service_type,
+                           description="Logging services",
+                           on_done=lambda logged: self.services_logged(logged, service_type),
+                           on_error=self.show_error("Failed to log services"))
+    
+    def services_logged(self, logged, service_type):
+        """Confirm a batch of logged services"""
+        messagebox.showinfo("Success", 
+                          f"✅ SERVICES LOGGED\n\n"
+                          f"Service: {service_type}\n"
+                          f"Residents: {logged}\n"
+                          f"Date: {date.today().isoformat()}")
+        self.residents_list.clear_selection()
+        self.service_type_entry.delete(0, tk.END)
+        self.load_service_types()
+    
+    def discharge_selected(self):
+        """Mark every resident selected in the list as discharged today"""
+        resident_ids = [row.id for row in self.residents_list.selected_rows()]
+        if not resident_ids:
+            messagebox.showerror("Error", "Select one or more residents in the list")
+            return
+        if not messagebox.askyesno("Discharge", f"Discharge {len(resident_ids)} resident(s) today?"):
+            return
+        
+        self.worker.submit(lambda: [Resident.discharge(resident_id) for resident_id in resident_ids],
+                           description="Discharging residents",
+                           on_done=lambda results: self.refresh_list(),
+                           on_error=self.show_error("Failed to discharge residents"))
+    
+    def load_service_types(self):
+        """Fill the service type picker, most used types first"""
+        self.worker.submit(ServiceType.all, channel="service_types", description="Loading service types",
+                           on_done=lambda types: self.service_type_entry.config(
+                               values=[name for _, name in types]),
+                           on_error=self.show_error("Failed to load service types"))
+    
+    def refresh_list(self):
+        """Show residents from the database, most recent entry first"""
+        self.worker.submit(lambda: None, channel="list")  # Drops any search still running
+        self.list_frame.config(text="Current Residents")
+        self.residents_list.empty_text = "No residents in database"
+        self.residents_list.set_source(ModelSource(Resident, 'residents'), "Loading residents")
     
     def view_services(self):
-        """Show all services logged"""
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        
-        # Get all services with resident names
-        cursor.execute('''
-            SELECT services.id, residents.first_name, residents.last_name, 
-                   services.service_type, services.service_date
-            FROM services
-            JOIN residents ON services.resident_id = residents.id
-            ORDER BY services.service_date DESC
-        ''')
-        
-        services = cursor.fetchall()
-        conn.close()
-        
-        # Create a new window to display services
+        """Open a window listing logged services, loaded as they scroll into view"""
         services_window = tk.Toplevel(self.window)
         services_window.title("Logged Services")
         services_window.geometry("500x400")
         
-        tk.Label(services_window, text="All Logged Services", 
-                font=("Arial", 14, "bold")).pack(pady=10)
+        title = tk.Label(services_window, text="All Logged Services", 
+                        font=("Arial", 14, "bold"))
+        title.pack(pady=10)
         
-        # Create text widget to display services
-        text_widget = tk.Text(services_window, wrap=tk.WORD, height=15)
-        scrollbar = tk.Scrollbar(services_window, command=text_widget.yview)
-        text_widget.config(yscrollcommand=scrollbar.set)
-        
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        text_widget.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
-        
-        if services:
-            text_widget.insert(tk.END, f"Total Services: {len(services)}\n\n")
-            for service in services:
-                text = f"• {service[3]} for {service[1]} {service[2]} on {service[4]}\n"
-                text_widget.insert(tk.END, text)
-        else:
-            text_widget.insert(tk.END, "No services have been logged yet.")
-        
-        text_widget.config(state=tk.DISABLED)  # Make read-only
+        services_list = VirtualList(services_window, self.worker, format_service, height=15,
+                                    empty_text="No services have been logged yet.")
+        services_list.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        services_list.bind("<<ListLoaded>>", lambda e: title.config(
+            text=f"All Logged Services ({services_list.total})"))
+        services_list.set_source(ModelSource(Service, 'services'), "Loading services")
         
         tk.Button(services_window, text="Close", 
                  command=services_window.destroy).pack(pady=10)
     
     def run(self):
         """Start the application"""
-        self.window.mainloop()
+        try:
+            self.window.mainloop()
+        finally:
+            self.worker.shutdown()
+            if self.probe is not None:
+                print("Frame latency (ms):", self.probe.summary())
 
-# Start the application
+# Start the application (pass --probe to measure UI frame latency)
 if __name__ == "__main__":
-    app = ShelterApp()
+    app = ShelterApp(probe="--probe" in sys.argv)
     app.run()
\ No newline at end of file
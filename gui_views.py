@@ -0,0 +1,245 @@
+# gui_views.py - Virtualized list widget for the Tkinter GUI
+import tkinter as tk
+from tkinter import font as tkfont
+
+from models import Stats
+
+PREFETCH = 50       # rows fetched ahead of the visible window
+MAX_BUFFER = 500    # rows kept in memory around the visible window
+
+
+class ModelSource:
+    """Rows of a model with keyset paging (Resident, Service) for a VirtualList
+
+    The total comes from the trigger-maintained stats table, so opening a
+    view costs one page read however large the table is. It counts the
+    live rows only, as the pages do; archived rows are not listed.
+    """
+
+    def __init__(self, model, total_name):
+        self.model = model
+        self.total_name = total_name
+
+    def count(self):
+        return Stats.totals(include_archive=False).get(self.total_name, 0)
+
+    def at(self, offset, limit):
+        return self.model.page_at(offset, limit).rows
+
+    def after(self, row, limit):
+        return self.model.page(after=self.model.cursor(row), limit=limit).rows
+
+    def before(self, row, limit):
+        return self.model.page(before=self.model.cursor(row), limit=limit).rows
+
+
+class ListSource:
+    """Rows already in memory, e.g. search results, for a VirtualList"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.index = {row[0]: i for i, row in enumerate(self.rows)}
+
+    def count(self):
+        return len(self.rows)
+
+    def at(self, offset, limit):
+        return self.rows[offset:offset + limit]
+
+    def after(self, row, limit):
+        start = self.index[row[0]] + 1
+        return self.rows[start:start + limit]
+
+    def before(self, row, limit):
+        end = self.index[row[0]]
+        return self.rows[max(0, end - limit):end]
+
+
+class VirtualList(tk.Frame):
+    """A Listbox that only ever holds the rows currently on screen
+
+    Rows live in a buffer of at most MAX_BUFFER around the visible
+    window. Scrolling near either end of the buffer fetches the next
+    PREFETCH rows by keyset from the row at that end; dragging the
+    scrollbar somewhere outside the buffer reloads it at that offset.
+    Fetches run on the BackgroundWorker and rows not loaded yet show as
+    "Loading...".
+    """
+
+    def __init__(self, master, worker, format_row, empty_text="No rows", height=12,
+                 selectmode=tk.BROWSE, **options):
+        super().__init__(master, **options)
+        self.worker = worker
+        self.format_row = format_row
+        self.empty_text = empty_text
+        self.channel = f"view-{id(self)}"
+        self.source = None
+        self.total = 0
+        self.top = 0      # index of the first visible row
+        self.start = 0    # index of self.rows[0]
+        self.rows = []
+        self.loading = False
+        self.selected = {}  # row id -> row, kept while rows scroll out of view
+
+        self.scrollbar = tk.Scrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox = tk.Listbox(self, height=height, activestyle="none",
+                                  selectmode=selectmode, exportselection=False)
+        self.listbox.pack(side=tk.LEFT, fill="both", expand=True)
+        self.visible = height
+        self.line_height = tkfont.nametofont(self.listbox.cget("font")).metrics("linespace") + 1
+
+        self.listbox.bind("<Configure>", self.on_resize)
+        self.listbox.bind("<<ListboxSelect>>", self.on_select)
+        self.listbox.bind("<MouseWheel>", lambda e: self.scroll_by(-3 if e.delta > 0 else 3))
+        self.listbox.bind("<Button-4>", lambda e: self.scroll_by(-3))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll_by(3))
+        self.listbox.bind("<Up>", lambda e: self.scroll_by(-1))
+        self.listbox.bind("<Down>", lambda e: self.scroll_by(1))
+        self.listbox.bind("<Prior>", lambda e: self.scroll_by(-self.visible))
+        self.listbox.bind("<Next>", lambda e: self.scroll_by(self.visible))
+        self.listbox.bind("<Home>", lambda e: self.scroll_to(0))
+        self.listbox.bind("<End>", lambda e: self.scroll_to(self.total))
+
+    def set_source(self, source, description="Loading"):
+        """Show rows from source, starting at the top"""
+        self.source = source
+        self.total, self.top, self.start, self.rows = 0, 0, 0, []
+        self.selected = {}
+        self.loading = True
+        limit = self.visible + PREFETCH
+        self.worker.submit(lambda: (source.count(), source.at(0, limit)),
+                           channel=self.channel, description=description,
+                           on_done=self.opened, on_error=self.failed)
+
+    def opened(self, result):
+        self.total, self.rows = result
+        self.total = max(self.total, len(self.rows))
+        self.loading = False
+        self.render()
+        self.event_generate("<<ListLoaded>>")  # Lets owners show self.total
+
+    def failed(self, error):
+        self.loading = False
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, f"Could not load rows: {error}")
+
+    def visible_rows(self):
+        """The loaded rows currently on screen, top to bottom"""
+        first = self.top - self.start
+        return self.rows[max(0, first):max(0, first + self.visible)]
+
+    def selected_rows(self):
+        """Rows selected by the user, including ones scrolled out of view"""
+        return list(self.selected.values())
+
+    def clear_selection(self):
+        self.selected = {}
+        self.listbox.selection_clear(0, tk.END)
+
+    def on_select(self, event):
+        chosen = set(self.listbox.curselection())
+        if self.listbox.cget("selectmode") in (tk.BROWSE, tk.SINGLE):
+            self.selected = {}
+        offset = max(0, self.start - self.top)  # "Loading..." lines above the rows
+        for index, row in enumerate(self.visible_rows(), start=offset):
+            if index in chosen:
+                self.selected[row[0]] = row
+            else:
+                self.selected.pop(row[0], None)
+
+    def on_resize(self, event):
+        visible = max(1, event.height // self.line_height)
+        if visible != self.visible:
+            self.visible = visible
+            self.scroll_to(self.top)
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * self.total))
+        elif unit == "pages":
+            self.scroll_by(int(amount) * self.visible)
+        else:
+            self.scroll_by(int(amount))
+        return "break"
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.top + rows)
+        return "break"
+
+    def scroll_to(self, top):
+        self.top = max(0, min(top, self.total - self.visible))
+        self.render()
+        self.fetch()
+
+    def render(self):
+        """Redraw the visible window from the buffer"""
+        self.listbox.delete(0, tk.END)
+        if self.total == 0 and not self.loading:
+            self.listbox.insert(tk.END, self.empty_text)
+        for index in range(self.top, min(self.top + self.visible, self.total)):
+            position = index - self.start
+            if 0 <= position < len(self.rows):
+                self.listbox.insert(tk.END, self.format_row(self.rows[position]))
+                if self.rows[position][0] in self.selected:
+                    self.listbox.selection_set(tk.END)
+            else:
+                self.listbox.insert(tk.END, "Loading...")
+        if self.total > self.visible:
+            self.scrollbar.set(self.top / self.total, (self.top + self.visible) / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def fetch(self):
+        """Load rows around the visible window if the buffer is running out"""
+        if self.loading or self.source is None or self.total == 0:
+            return
+        source, end = self.source, self.start + len(self.rows)
+        if not self.rows or self.top >= end or self.top + self.visible <= self.start:
+            # Jumped past the buffer: reload it around the new position
+            offset, limit = max(0, self.top - PREFETCH // 2), self.visible + PREFETCH
+            job = lambda: (offset, limit, source.at(offset, limit))
+        elif self.top + self.visible + PREFETCH // 2 > end and end < self.total:
+            last = self.rows[-1]
+            job = lambda: (end, PREFETCH, source.after(last, PREFETCH))
+        elif self.top - PREFETCH // 2 < self.start and self.start > 0:
+            first = self.rows[0]
+            job = lambda: (None, PREFETCH, source.before(first, PREFETCH))
+        else:
+            return
+        self.loading = True
+        self.worker.submit(job, channel=self.channel, description="Loading rows",
+                           on_done=self.fetched, on_error=self.failed)
+
+    def fetched(self, result):
+        offset, limit, rows = result
+        self.loading = False
+        if offset is None:
+            self.rows[:0] = rows
+            self.start -= len(rows)
+            if len(rows) < limit and self.start > 0:
+                # Reached the first row; rows were deleted since counting
+                self.top -= self.start
+                self.total -= self.start
+                self.start = 0
+        else:
+            if offset == self.start + len(self.rows) and self.rows:
+                self.rows.extend(rows)
+            else:
+                self.start, self.rows = offset, rows
+            if len(rows) < limit:
+                # Reached the last row; rows may have been deleted since counting
+                self.total = self.start + len(self.rows)
+        self.trim()
+        self.scroll_to(self.top)
+
+    def trim(self):
+        """Drop buffered rows far from the visible window"""
+        excess = len(self.rows) - MAX_BUFFER
+        if excess <= 0:
+            return
+        if self.top - self.start > len(self.rows) // 2:
+            del self.rows[:excess]
+            self.start += excess
+        else:
+            del self.rows[-excess:]
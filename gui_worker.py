@@ -0,0 +1,144 @@
+# gui_worker.py - Background database work for the Tkinter GUI
+import itertools
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from database import get_connection
+
+
+class BackgroundWorker:
+    """Runs database calls on a thread pool and hands results back to Tk
+
+    Tk widgets may only be touched from the main thread, so finished
+    jobs are put on a queue that the main loop drains with after() and
+    their callbacks run there.
+
+    Jobs submitted on the same channel supersede each other: when a new
+    search starts, the previous one is cancelled if it has not started,
+    interrupted if its query is running, and its result dropped if it
+    already finished.
+    """
+
+    def __init__(self, widget, workers=2, poll_ms=25, on_progress=None):
+        self.widget = widget
+        self.poll_ms = poll_ms
+        self.on_progress = on_progress
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shelter-db')
+        self.results = queue.Queue()
+        self._tickets = itertools.count(1)
+        self._lock = threading.Lock()
+        self._latest = {}     # channel -> newest ticket
+        self._futures = {}    # ticket -> future
+        self._running = {}    # ticket -> connection running it
+        self._started = {}    # ticket -> (description, start time)
+        self.widget.after(self.poll_ms, self._poll)
+
+    def submit(self, func, *args, on_done=None, on_error=None, channel=None, description="Working"):
+        """Run func(*args) in the background and call on_done(result) on the UI thread"""
+        ticket = next(self._tickets)
+        with self._lock:
+            if channel is not None:
+                stale = self._latest.get(channel)
+                self._latest[channel] = ticket
+                if stale is not None:
+                    self._cancel(stale)
+            self._started[ticket] = (description, time.perf_counter())
+            self._futures[ticket] = self.executor.submit(
+                self._run, ticket, channel, func, args, on_done, on_error)
+        return ticket
+
+    def _cancel(self, ticket):
+        future = self._futures.get(ticket)
+        if future is not None and future.cancel():
+            self._forget(ticket)
+            return
+        conn = self._running.get(ticket)
+        if conn is not None:
+            conn.interrupt()  # Aborts the query running on the worker thread
+
+    def _forget(self, ticket):
+        self._futures.pop(ticket, None)
+        self._running.pop(ticket, None)
+        self._started.pop(ticket, None)
+
+    def _run(self, ticket, channel, func, args, on_done, on_error):
+        with self._lock:
+            self._running[ticket] = get_connection()
+        try:
+            result, error = func(*args), None
+        except Exception as e:
+            result, error = None, e
+        with self._lock:
+            self._running.pop(ticket, None)
+        self.results.put((ticket, channel, on_done, on_error, result, error))
+
+    def is_stale(self, ticket, channel):
+        return channel is not None and self._latest.get(channel) != ticket
+
+    def _poll(self):
+        """Deliver finished jobs on the Tk main thread"""
+        while True:
+            try:
+                ticket, channel, on_done, on_error, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._forget(ticket)
+                stale = self.is_stale(ticket, channel)
+            if stale:
+                continue
+            if error is not None:
+                if isinstance(error, sqlite3.OperationalError) and 'interrupted' in str(error):
+                    continue
+                if on_error:
+                    on_error(error)
+                else:
+                    raise error
+            elif on_done:
+                on_done(result)
+
+        if self.on_progress:
+            now = time.perf_counter()
+            with self._lock:
+                running = [(description, now - started) for description, started in self._started.values()]
+            self.on_progress(running)
+        self.widget.after(self.poll_ms, self._poll)
+
+    def shutdown(self):
+        with self._lock:
+            for ticket in list(self._futures):
+                self._cancel(ticket)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class FrameLatencyProbe:
+    """Measures how late the Tk event loop runs a timer that should fire every frame
+
+    A responsive UI fires each tick within a few milliseconds of its
+    deadline; a query blocking the main thread shows up as a long tick.
+    """
+
+    def __init__(self, widget, interval_ms=16, samples=1000):
+        self.widget = widget
+        self.interval = interval_ms / 1000
+        self.lags = deque(maxlen=samples)
+        self._last = time.perf_counter()
+        self.widget.after(interval_ms, self._tick)
+
+    def _tick(self):
+        now = time.perf_counter()
+        self.lags.append(max(0.0, now - self._last - self.interval) * 1000)
+        self._last = now
+        self.widget.after(int(self.interval * 1000), self._tick)
+
+    def summary(self):
+        """p50/p95/p99/max lag in milliseconds over the recent samples"""
+        lags = sorted(self.lags)
+        if not lags:
+            return {}
+        pick = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))]
+        return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': lags[-1]}
@@ -0,0 +1,151 @@
+# importer.py - Bulk import of residents and services for Safe Shelter
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import date
+from itertools import islice
+
+from database import get_connection, transaction
+from models import Resident, Service, name_key
+
+BATCH_SIZE = 5000
+
+
+def read_rows(path):
+    """Yield one dict per record from a CSV or JSON Lines file"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def _text(row, field):
+    value = str(row.get(field) or '').strip()
+    if not value:
+        raise ValueError(f"missing {field}")
+    return value
+
+
+def _date(row, field):
+    return date.fromisoformat(_text(row, field)).isoformat()
+
+
+def resident_batch(rows):
+    """Validate resident records into (first, last, entry_date) tuples"""
+    valid, errors = [], []
+    seen = set()
+    for line, row in rows:
+        try:
+            first, last = _text(row, 'first_name'), _text(row, 'last_name')
+            record = (first, last, _date(row, 'entry_date'))
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        key = name_key(first, last)
+        if key not in seen:  # Same person twice in one batch
+            seen.add(key)
+            valid.append(record)
+    return valid, errors
+
+
+def service_batch(rows):
+    """Validate service records into (resident_id, service_type, service_date) tuples
+
+    A record names its resident either by resident_id or by first_name
+    and last_name, which are matched against existing residents.
+    """
+    parsed, errors = [], []
+    for line, row in rows:
+        try:
+            if row.get('resident_id') not in (None, ''):
+                resident = int(row['resident_id'])
+            else:
+                resident = name_key(_text(row, 'first_name'), _text(row, 'last_name'))
+            parsed.append((line, resident, _text(row, 'service_type'), _date(row, 'service_date')))
+        except ValueError as e:
+            errors.append((line, str(e)))
+
+    ids = Resident.existing_ids(r for _, r, _, _ in parsed if isinstance(r, int))
+    keys = Resident.ids_for_keys(r for _, r, _, _ in parsed if isinstance(r, str))
+    valid = []
+    for line, resident, service_type, service_date in parsed:
+        resident_id = keys.get(resident) if isinstance(resident, str) else resident
+        if resident_id is None or (isinstance(resident, int) and resident not in ids):
+            errors.append((line, "unknown resident"))
+        else:
+            valid.append((resident_id, service_type, service_date))
+    return valid, errors
+
+
+IMPORTERS = {
+    'residents': (resident_batch, Resident.save_many),
+    'services': (service_batch, Service.add_many),
+}
+
+
+def import_file(path, kind, batch_size=BATCH_SIZE, restart=False):
+    """Stream a file into the database in batched transactions
+
+    Each batch is committed together with a checkpoint, so a failed
+    import can be rerun and continues after the last committed batch.
+    Returns (rows read, rows inserted, invalid rows).
+    """
+    validate, insert = IMPORTERS[kind]
+    source = f"{kind}:{os.path.abspath(path)}"
+    conn = get_connection()
+    if restart:
+        with transaction():
+            conn.execute('DELETE FROM import_progress WHERE source = ?', (source,))
+    row = conn.execute('SELECT rows_done FROM import_progress WHERE source = ?', (source,)).fetchone()
+    done = row[0] if row else 0
+    if done:
+        print(f"Resuming after {done} rows already imported")
+
+    rows = islice(enumerate(read_rows(path), start=1), done, None)
+    read = inserted = invalid = 0
+    started = time.perf_counter()
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        valid, errors = validate(batch)
+        for line, message in errors[:5]:
+            print(f"   Row {line}: {message}")
+        with transaction():
+            inserted += insert(valid)
+            done += len(batch)
+            conn.execute(
+                'INSERT INTO import_progress (source, rows_done) VALUES (?, ?) '
+                'ON CONFLICT(source) DO UPDATE SET rows_done = excluded.rows_done',
+                (source, done)
+            )
+        read += len(batch)
+        invalid += len(errors)
+        rate = read / (time.perf_counter() - started)
+        print(f"   {done} rows processed ({rate:,.0f} rows/sec)")
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✓ Imported {inserted} {kind} from {read} rows "
+          f"({invalid} invalid, {read - inserted - invalid} duplicates) "
+          f"in {elapsed:.1f}s")
+    return read, inserted, invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import residents or services")
+    parser.add_argument('kind', choices=sorted(IMPORTERS))
+    parser.add_argument('path', help="CSV file or JSON Lines (.jsonl) file")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore any checkpoint and import from the first row")
+    args = parser.parse_args()
+    import_file(args.path, args.kind, args.batch_size, args.restart)
+
+
+if __name__ == "__main__":
+    main()
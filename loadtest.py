@@ -0,0 +1,265 @@
+# loadtest.py - Concurrent write and mixed HTTP load tests for Safe Shelter
+import argparse
+import http.client
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from urllib.parse import urlencode
+
+import database
+import seed_data
+from benchmark import percentile
+from database import transaction
+from models import Resident, ServiceType
+from write_queue import WriteQueue
+
+INSERT = 'INSERT INTO services (resident_id, service_type_id, service_date) VALUES (?, ?, ?)'
+
+
+def direct_write(params):
+    """One transaction per service, as log_service did before the write queue"""
+    with transaction() as conn:
+        conn.execute(INSERT, params)
+
+
+def run_writers(write, writers=50, per_writer=100, residents=100):
+    """Start writers threads together, each logging per_writer services
+
+    Returns (writes per second, p99 latency in ms).
+    """
+    barrier = threading.Barrier(writers + 1)
+    latencies = []
+    lock = threading.Lock()
+    today = date.today()
+    meals = ServiceType.id_for('Meals')
+
+    def writer(n):
+        mine = []
+        barrier.wait()
+        for i in range(per_writer):
+            started = time.perf_counter()
+            write((((n * per_writer + i) % residents) + 1, meals, today))
+            mine.append(time.perf_counter() - started)
+        database.close_connection()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[int(len(latencies) * 0.99) - 1] * 1000
+
+
+# Mixed traffic: request kind -> relative frequency, roughly a shift of
+# staff browsing, searching and logging services
+MIX = {
+    'dashboard': 30, 'residents': 15, 'services': 15, 'search': 15,
+    'log_service': 20, 'add_resident': 5,
+}
+WRITES = ('log_service', 'add_resident')
+SEARCHES = ('mar', 'gar', 'ana lo', 'sm', 'kim', 'pat')
+
+
+def start_server(workers, db_path):
+    """Run serve.py on a free port; returns (process, port)"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py'),
+         '--workers', str(workers), '--port', '0', '--db', db_path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = process.stdout.readline()  # ✓ Serving on http://127.0.0.1:PORT with N workers
+    if not line:
+        raise RuntimeError("serve.py did not start")
+    return process, int(line.split('http://', 1)[1].split()[0].rsplit(':', 1)[1].rstrip('/'))
+
+
+def request_for(kind, rng, residents):
+    """(method, path, form) for one request of a kind"""
+    if kind == 'dashboard':
+        return 'GET', '/', None
+    if kind in ('residents', 'services'):
+        return 'GET', f'/{kind}', None
+    if kind == 'search':
+        return 'GET', '/residents/search?' + urlencode({'q': rng.choice(SEARCHES)}), None
+    if kind == 'log_service':
+        return 'POST', '/log_service', {'resident_id': rng.randint(1, residents),
+                                        'service_type': rng.choice(list(seed_data.SERVICE_TYPES))}
+    return 'POST', '/add_resident', {'first_name': f'Load{rng.getrandbits(40):x}', 'last_name': 'Test'}
+
+
+def run_clients(port, clients, seconds, residents, seed=0):
+    """Send MIX traffic from clients threads for seconds
+
+    Every request opens its own connection, so the kernel spreads them
+    over the workers. Returns {kind: [(seconds, status), ...]}.
+    """
+    kinds, weights = list(MIX), list(MIX.values())
+    results = {kind: [] for kind in MIX}
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+    deadline = []
+
+    def client(n):
+        rng = random.Random(seed * 1000 + n)
+        mine = {kind: [] for kind in MIX}
+        barrier.wait()
+        while time.perf_counter() < deadline[0]:
+            kind = rng.choices(kinds, weights)[0]
+            method, path, form = request_for(kind, rng, residents)
+            body = urlencode(form) if form else None
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form else {}
+            started = time.perf_counter()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except OSError:
+                status = 0
+            finally:
+                conn.close()
+            mine[kind].append((time.perf_counter() - started, status))
+        with lock:
+            for kind, samples in mine.items():
+                results[kind].extend(samples)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    deadline.append(time.perf_counter() + seconds)
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(samples, seconds):
+    """Throughput, latency percentiles in ms and error count of samples"""
+    latencies = sorted(latency for latency, _ in samples)
+    if not latencies:
+        return {'requests': 0, 'per_second': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0,
+                'max_ms': 0.0, 'errors': 0, 'busy': 0}
+    return {
+        'requests': len(latencies),
+        'per_second': len(latencies) / seconds,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'errors': sum(1 for _, status in samples if not 200 <= status < 400),
+        'busy': sum(1 for _, status in samples if status == 503),
+    }
+
+
+def run_http(workers_list, clients, seconds, residents, services, seed=0):
+    """Mixed traffic against serve.py with each worker count in turn
+
+    Every run starts from a copy of the same seeded database. Returns
+    {workers: {'all': ..., 'reads': ..., 'writes': ...}} summaries.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, 'template.db')
+        database.configure(template)
+        database.create_database()
+        seed_data.seed(residents, services, seed)
+        conn = database.get_connection()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        database.close_connection()
+
+        summaries = {}
+        for workers in workers_list:
+            path = os.path.join(tmp, f'workers-{workers}.db')
+            source = database.connect(template)
+            target = database.connect(path)
+            source.backup(target)
+            source.close()
+            target.close()
+
+            process, port = start_server(workers, path)
+            try:
+                results = run_clients(port, clients, seconds, residents, seed)
+            finally:
+                process.terminate()
+                process.wait()
+            everything = [sample for samples in results.values() for sample in samples]
+            writes = [sample for kind in WRITES for sample in results[kind]]
+            reads = [sample for kind in MIX if kind not in WRITES for sample in results[kind]]
+            summaries[workers] = {'all': summarize(everything, seconds),
+                                  'reads': summarize(reads, seconds),
+                                  'writes': summarize(writes, seconds)}
+    return summaries
+
+
+def print_http(summaries):
+    print(f"{'workers':>7}  {'traffic':<7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'errors':>6} {'503s':>5}")
+    for workers, groups in summaries.items():
+        for name, s in groups.items():
+            print(f"{workers:>7}  {name:<7} {s['per_second']:8,.0f} {s['p50_ms']:8.1f} {s['p95_ms']:8.1f} "
+                  f"{s['p99_ms']:8.1f} {s['max_ms']:8.1f} {s['errors']:>6} {s['busy']:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Safe Shelter load tests")
+    commands = parser.add_subparsers(dest='command')
+
+    writes = commands.add_parser('writes', help="compare direct and group-committed writes")
+    writes.add_argument('--writers', type=int, default=50)
+    writes.add_argument('--per-writer', type=int, default=100)
+    writes.add_argument('--synchronous', default='NORMAL', choices=['NORMAL', 'FULL'],
+                        help="PRAGMA synchronous for the test database")
+
+    mixed = commands.add_parser('http', help="mixed read/write traffic against serve.py")
+    mixed.add_argument('--workers', default='1,2,4',
+                       help="comma-separated worker process counts to try (default: 1,2,4)")
+    mixed.add_argument('--clients', type=int, default=16, help="concurrent clients (default: 16)")
+    mixed.add_argument('--seconds', type=float, default=10, help="per worker count (default: 10)")
+    mixed.add_argument('--residents', type=int, default=1000)
+    mixed.add_argument('--services', type=int, default=20000)
+    mixed.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'http':
+        workers = [int(value) for value in args.workers.split(',')]
+        print(f"{args.clients} clients, {args.seconds:g}s per run, {args.residents:,} residents, "
+              f"{args.services:,} services")
+        print_http(run_http(workers, args.clients, args.seconds, args.residents, args.services,
+                            args.seed))
+        return
+    if args.command != 'writes':
+        parser.print_help()
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.PRAGMAS = database.PRAGMAS + (f'PRAGMA synchronous={args.synchronous}',)
+        database.configure(os.path.join(tmp, 'loadtest.db'))
+        database.create_database()
+        Resident.save_many((f'First{i}', f'Last{i}', '2024-01-01') for i in range(100))
+
+        print(f"{args.writers} writers x {args.per_writer} services, synchronous={args.synchronous}")
+        direct, direct_p99 = run_writers(direct_write, args.writers, args.per_writer)
+        print(f"   One commit per write: {direct:8,.0f} writes/sec  p99 {direct_p99:6.1f} ms")
+
+        writes = WriteQueue()
+        queued, queued_p99 = run_writers(
+            lambda params: writes.execute(INSERT, params), args.writers, args.per_writer)
+        writes.close()
+        print(f"   Group commit:         {queued:8,.0f} writes/sec  p99 {queued_p99:6.1f} ms"
+              f"  ({writes.writes / writes.commits:.0f} writes per commit)")
+        print(f"   Throughput gain: {queued / direct:.1f}x")
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -20,9 +20,8 @@ def test_system():
     
     # 4. Show all residents
     print("\nCurrent residents:")
-    residents = Resident.get_all()
-    for r in residents:
-        print(f"  - ID {r[0]}: {r[1]} {r[2]} (Entered: {r[3]})")
+    for r in Resident.iter_all():
+        print(f"  - ID {r.id}: {r.first_name} {r.last_name} (Entered: {r.entry_date})")
     
     print("\n✅ System test complete!")
 
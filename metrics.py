@@ -0,0 +1,366 @@
+# metrics.py - Query tracing, request timing and Prometheus metrics
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+
+# Set SHELTER_METRICS=0 to open plain, untraced connections
+ENABLED = os.environ.get('SHELTER_METRICS', '1') != '0'
+# Statements slower than this are logged with their query plan
+SLOW_QUERY_SECONDS = float(os.environ.get('SHELTER_SLOW_QUERY_MS', '100')) / 1000
+SLOW_LOG_SIZE = 100
+# Rows a TracedCursor reads at a time when iterated, timing each batch
+ITER_BATCH = 256
+# A slow one of these is a wait for the write lock, not a slow query
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+# Slow statements whose plan is not captured
+NO_PLAN = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'PRAGMA')
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+MAX_LABEL = 300
+
+log = logging.getLogger('shelter.slow_queries')
+log.addHandler(logging.NullHandler())  # Shown only where logging is configured
+_local = threading.local()
+
+
+def normalize(sql):
+    """One line of SQL with runs of whitespace collapsed"""
+    return ' '.join(sql.split())
+
+
+def _strip_literals(sql):
+    """Replace the values in traced SQL with ? so like statements group together"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    return re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their count and sum"""
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class StatementStats:
+    """Running totals for one SQL statement"""
+    __slots__ = ('latency', 'rows', 'trace_events')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.trace_events = 0
+
+
+def _label(value):
+    value = value if len(value) <= MAX_LABEL else value[:MAX_LABEL - 3] + '...'
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _statement(sql):
+    """Labels for a statement; the id tells apart ones that truncate alike"""
+    return f'id="{zlib.crc32(sql.encode()):08x}",statement="{_label(sql)}"'
+
+
+class Metrics:
+    """Statement and request figures collected by this process"""
+
+    def __init__(self, slow_seconds=SLOW_QUERY_SECONDS):
+        self.slow_seconds = slow_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.statements = {}      # normalized sql -> StatementStats
+            self.untimed = {}         # traced sql run outside a TracedCursor -> count
+            self.requests = {}        # (method, route) -> Histogram
+            self.responses = {}       # (method, route, status) -> count
+            self.request_sql = {}     # route -> [statements, seconds]
+            self.slow = deque(maxlen=SLOW_LOG_SIZE)
+            self.slow_total = 0
+
+    def record_statement(self, cursor, sql, parameters, seconds, rows, trace_events):
+        key = normalize(sql)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats()
+            stats.latency.observe(seconds)
+            stats.rows += rows
+            stats.trace_events += trace_events
+        request = getattr(_local, 'request', None)
+        if request is not None:
+            request[0] += 1
+            request[1] += seconds
+        if seconds >= self.slow_seconds and not key.upper().startswith(TRANSACTION_CONTROL):
+            self._log_slow(cursor, sql, key, parameters, seconds, rows)
+
+    def _log_slow(self, cursor, sql, key, parameters, seconds, rows):
+        """Keep a slow statement with its EXPLAIN QUERY PLAN, if it is a read"""
+        if key.upper().startswith(NO_PLAN):
+            plan = []
+        else:
+            try:
+                # A plain cursor, so the EXPLAIN is not itself traced
+                plan = [row[3] for row in sqlite3.Cursor(cursor.connection).execute(
+                    'EXPLAIN QUERY PLAN ' + sql, parameters)]
+            except (sqlite3.Error, ValueError) as e:
+                plan = [f"(no plan: {e})"]
+        entry = {
+            'statement': key,
+            'seconds': round(seconds, 6),
+            'rows': rows,
+            'plan': plan,
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with self._lock:
+            self.slow.append(entry)
+            self.slow_total += 1
+        log.warning("%.1f ms, %d rows: %s\n    %s", seconds * 1000, rows, key, '\n    '.join(plan))
+
+    def trace(self, sql):
+        """sqlite3 trace callback: every statement SQLite starts
+
+        Statements run through a TracedCursor are credited to it, which
+        counts the trigger programs a write sets off; anything else is
+        counted by its text with the values taken out.
+        """
+        active = getattr(_local, 'active', None)
+        if active is not None:
+            active._trace_events += 1
+            return
+        if sql.startswith('EXPLAIN QUERY PLAN'):
+            return  # The slow query log's own EXPLAIN
+        key = normalize(_strip_literals(sql))
+        with self._lock:
+            self.untimed[key] = self.untimed.get(key, 0) + 1
+
+    def start_request(self):
+        _local.request = [0, 0.0]
+
+    def record_request(self, method, route, status, seconds):
+        statements, sql_seconds = getattr(_local, 'request', None) or (0, 0.0)
+        _local.request = None
+        with self._lock:
+            histogram = self.requests.get((method, route))
+            if histogram is None:
+                histogram = self.requests[(method, route)] = Histogram()
+            histogram.observe(seconds)
+            self.responses[(method, route, status)] = self.responses.get((method, route, status), 0) + 1
+            totals = self.request_sql.setdefault(route, [0, 0.0])
+            totals[0] += statements
+            totals[1] += sql_seconds
+
+    def slow_queries(self):
+        """The most recent slow statements, newest first"""
+        with self._lock:
+            return list(reversed(self.slow))
+
+    def render(self):
+        """Everything in the Prometheus text exposition format"""
+        out = []
+
+        def header(name, kind, text):
+            out.append(f'# HELP {name} {text}')
+            out.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            statements = sorted(self.statements.items())
+            header('shelter_sql_seconds', 'histogram', 'Time per SQL statement, from execute to its last row')
+            for sql, stats in statements:
+                out.extend(stats.latency.lines('shelter_sql_seconds', _statement(sql)))
+            header('shelter_sql_rows_total', 'counter', 'Rows returned or changed per SQL statement')
+            for sql, stats in statements:
+                out.append(f'shelter_sql_rows_total{{{_statement(sql)}}} {stats.rows}')
+            header('shelter_sql_trace_events_total', 'counter',
+                   'Statements SQLite started for each SQL statement, including trigger programs')
+            for sql, stats in statements:
+                out.append(f'shelter_sql_trace_events_total{{{_statement(sql)}}} {stats.trace_events}')
+            header('shelter_sql_untimed_total', 'counter', 'Traced statements run outside the timing wrappers')
+            for sql, count in sorted(self.untimed.items()):
+                out.append(f'shelter_sql_untimed_total{{{_statement(sql)}}} {count}')
+            header('shelter_sql_slow_total', 'counter',
+                   f'SQL statements slower than {self.slow_seconds * 1000:g} ms')
+            out.append(f'shelter_sql_slow_total {self.slow_total}')
+
+            header('shelter_http_request_seconds', 'histogram', 'Time per request, by route')
+            for (method, route), histogram in sorted(self.requests.items()):
+                out.extend(histogram.lines('shelter_http_request_seconds',
+                                           f'method="{method}",route="{_label(route)}"'))
+            header('shelter_http_responses_total', 'counter', 'Responses by route and status')
+            for (method, route, status), count in sorted(self.responses.items()):
+                out.append(f'shelter_http_responses_total{{method="{method}",route="{_label(route)}",'
+                           f'status="{status}"}} {count}')
+            header('shelter_http_sql_statements_total', 'counter', 'SQL statements run by requests, by route')
+            for route, (statements_run, _) in sorted(self.request_sql.items()):
+                out.append(f'shelter_http_sql_statements_total{{route="{_label(route)}"}} {statements_run}')
+            header('shelter_http_sql_seconds_total', 'counter', 'Time in SQL during requests, by route')
+            for route, (_, seconds) in sorted(self.request_sql.items()):
+                out.append(f'shelter_http_sql_seconds_total{{route="{_label(route)}"}} {seconds:.6f}')
+        return '\n'.join(out) + '\n'
+
+
+registry = Metrics()
+
+
+class TracedCursor(sqlite3.Cursor):
+    """A cursor that times each statement from execute to its last row
+
+    Time spent inside execute and the fetch calls is added up, so a
+    statement whose rows are streamed out later is still timed in full
+    but time the caller spends between fetches is not. Iterating reads
+    ITER_BATCH rows at a time and times each batch rather than each
+    row. A statement is recorded once its rows run out, or when the
+    cursor is executed again, closed or released.
+    """
+    _sql = None
+    _buffer = ()
+    _position = 0
+
+    def _begin(self, sql, parameters):
+        self._finish()
+        self._sql, self._parameters = sql, parameters
+        self._seconds, self._rows, self._trace_events = 0.0, 0, 0
+        self._buffer, self._position = (), 0
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        sql, self._sql = self._sql, None
+        rows = self._rows or max(self.rowcount, 0)
+        registry.record_statement(self, sql, self._parameters, self._seconds, rows, self._trace_events)
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql, parameters)
+        _local.active = self
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except BaseException:
+            self._seconds += time.perf_counter() - started
+            self._finish()
+            raise
+        finally:
+            _local.active = None
+        self._seconds += time.perf_counter() - started
+        if self.description is None:
+            self._finish()  # Not a query: nothing left to read
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        # The first parameters are kept for EXPLAIN should this be slow
+        rows = iter(seq_of_parameters)
+        first = next(rows, None)
+        seq_of_parameters = rows if first is None else itertools.chain([first], rows)
+        self._begin(sql, first or ())
+        _local.active = self
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            _local.active = None
+            self._seconds += time.perf_counter() - started
+            self._finish()
+        return self
+
+    def _fetched(self, started, rows, done):
+        if self._sql is None:
+            return
+        self._seconds += time.perf_counter() - started
+        self._rows += rows
+        if done:
+            self._finish()
+
+    def _buffered(self, size=None):
+        """Rows read ahead by iteration and not yet handed out"""
+        end = len(self._buffer) if size is None else min(len(self._buffer), self._position + size)
+        rows = list(self._buffer[self._position:end])
+        self._position = end
+        return rows
+
+    def fetchone(self):
+        if self._position < len(self._buffer):
+            return self._buffered(1)[0]
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._buffered(size)
+        if len(rows) < size:
+            started = time.perf_counter()
+            more = super().fetchmany(size - len(rows))
+            self._fetched(started, len(more), len(more) < size - len(rows))
+            rows += more
+        return rows
+
+    def fetchall(self):
+        rows = self._buffered()
+        started = time.perf_counter()
+        more = super().fetchall()
+        self._fetched(started, len(more), True)
+        return rows + more
+
+    def __next__(self):
+        if self._position < len(self._buffer):
+            row = self._buffer[self._position]
+            self._position += 1
+            return row
+        started = time.perf_counter()
+        self._buffer, self._position = super().fetchmany(ITER_BATCH), 0
+        self._fetched(started, len(self._buffer), not self._buffer)
+        if not self._buffer:
+            raise StopIteration
+        self._position = 1
+        return self._buffer[0]
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass  # The connection may already be closed
+
+
+class TracedConnection(sqlite3.Connection):
+    """A connection whose cursors, including execute()'s, are TracedCursors"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
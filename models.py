@@ -1,49 +1,400 @@
 # models.py - Core classes for Safe Shelter
-import sqlite3
-from datetime import date
+import re
+import threading
+import unicodedata
+from collections import namedtuple
+from datetime import date, datetime
+import archive
+import database
+from database import day_number, get_connection, transaction
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+ITER_BATCH_SIZE = 1000
+
+# Rows as the models return them: plain tuples underneath, with no
+# per-row __dict__, that can also be read by field name
+ResidentRecord = namedtuple('ResidentRecord', [
+    'id', 'first_name', 'last_name', 'entry_date', 'name_key', 'discharge_date'
+])
+ServiceRecord = namedtuple('ServiceRecord', [
+    'id', 'first_name', 'last_name', 'service_type', 'service_date', 'service_time'
+])
+
+
+def normalize_name(name):
+    """Casefold a name and strip accents and extra whitespace"""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch))
+    return ' '.join(name.casefold().split())
+
+
+def name_key(first_name, last_name):
+    """Normalized name used to detect duplicate residents
+
+    Case, accents and extra whitespace are ignored, so
+    (" María ", "GARCIA") and ("maria", "garcia") give the same key.
+    """
+    return f"{normalize_name(first_name)}|{normalize_name(last_name)}"
+
+
+def now():
+    """Today's date and the seconds since midnight, as services record them"""
+    current = datetime.now()
+    return current.date(), current.hour * 3600 + current.minute * 60 + current.second
+
+
+def _row_factory(record):
+    make = record._make
+    return lambda cursor, row: make(row)
+
+
+ROW_FACTORIES = {record: _row_factory(record) for record in (ResidentRecord, ServiceRecord)}
+
+
+def _query(record, sql, params=()):
+    """Run sql on a cursor of its own that returns rows as record"""
+    cursor = get_connection().cursor()
+    cursor.row_factory = ROW_FACTORIES[record]
+    return cursor.execute(sql, params)
+
+
+def _iter_batches(record, select, id_column, batch_size):
+    """Yield every row of select in id order, batch_size rows per query
+
+    Each batch is a fresh keyset read (id_column > last id), so no
+    statement stays open between batches and only one batch of rows is
+    held at a time however large the table grows.
+    """
+    last_id = 0
+    while True:
+        rows = _query(record, f"{select} WHERE {id_column} > ? ORDER BY {id_column} LIMIT ?",
+                      (last_id, batch_size)).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
+
+
+class Page:
+    """One page of rows plus cursors for the newer and older pages"""
+
+    def __init__(self, rows, newer=None, older=None):
+        self.rows = rows
+        self.newer = newer
+        self.older = older
+
+
+def _cursor(sort_date, row_id):
+    return f"{day_number(sort_date)}~{row_id}"
+
+
+def _parse_cursor(cursor):
+    sort_value, row_id = cursor.rsplit('~', 1)
+    return int(sort_value), int(row_id)
+
+
+def _keyset_page(record, select, sort_column, id_column, key, after, before, limit):
+    """Fetch one page ordered newest first by (sort_column, id_column)
+
+    Pages are located by the key of a neighbouring row rather than an
+    OFFSET, so every page is an index range scan of limit + 1 rows.
+    `after` continues past the oldest row of the previous page and
+    `before` walks back from the newest row of the next page.
+    """
+    order = f"{sort_column}, {id_column}"
+    if before:
+        rows = _query(
+            record, f"{select} WHERE ({order}) > (?, ?) ORDER BY {sort_column}, {id_column} LIMIT ?",
+            (*_parse_cursor(before), limit + 1)
+        ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        newer = _cursor(*key(rows[0])) if more else None
+        older = _cursor(*key(rows[-1])) if rows else None
+    else:
+        where, params = '', ()
+        if after:
+            where, params = f"WHERE ({order}) < (?, ?)", _parse_cursor(after)
+        rows = _query(
+            record, f"{select} {where} ORDER BY {sort_column} DESC, {id_column} DESC LIMIT ?",
+            (*params, limit + 1)
+        ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        newer = _cursor(*key(rows[0])) if after and rows else None
+        older = _cursor(*key(rows[-1])) if more else None
+    return Page(rows, newer, older)
+
+
+def _page_at(record, select, sort_column, id_column, key, keys_query, offset, limit):
+    """Fetch the page starting `offset` rows from the newest
+
+    keys_query lists (sort, id) pairs newest first straight from a
+    covering index, so the OFFSET walk skips index entries only and the
+    page itself is an ordinary keyset read. Used to jump to a position,
+    e.g. when a scrollbar is dragged.
+    """
+    start = get_connection().execute(
+        f"{keys_query} LIMIT 1 OFFSET ?", (max(0, offset),)
+    ).fetchone()
+    if start is None:
+        return Page([])
+    # Rows older than (sort, id + 1) are the start row and everything after it
+    return _keyset_page(record, select, sort_column, id_column, key,
+                        _cursor(start[0], start[1] + 1), None, limit)
+
 
 class Resident:
     """Represents a shelter resident"""
 
-    def __init__(self, first_name, last_name, entry_date):        
+    def __init__(self, first_name, last_name, entry_date):
         self.first_name = first_name
         self.last_name = last_name
         self.entry_date = entry_date
+        self.id = None
 
     def save(self):
-        """Save resident to database"""
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO residents (first_name, last_name, entry_date) VALUES (?, ?, ?)',
-            (self.first_name, self.last_name, self.entry_date)    
-        )
-        conn.commit()
-        conn.close()
+        """Save resident to database unless the name is already taken
+
+        The duplicate check and the insert are one statement, so two
+        concurrent saves of the same person cannot both succeed.
+        """
+        with transaction() as conn:
+            cursor = conn.execute(
+                '''INSERT INTO residents (first_name, last_name, entry_date, name_key)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(name_key) DO NOTHING''',
+                (self.first_name, self.last_name, day_number(self.entry_date),
+                 name_key(self.first_name, self.last_name))
+            )
+        if cursor.rowcount == 0:
+            return "Duplicate resident"
+        self.id = cursor.lastrowid
         return "Resident saved"
 
+    @staticmethod
+    def save_many(rows):
+        """Insert (first_name, last_name, entry_date) rows in one transaction
+
+        Rows whose name is already taken are skipped. Returns the number
+        of residents inserted.
+        """
+        with transaction() as conn:
+            cursor = conn.executemany(
+                '''INSERT INTO residents (first_name, last_name, entry_date, name_key)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(name_key) DO NOTHING''',
+                ((first, last, day_number(entry_date), name_key(first, last))
+                 for first, last, entry_date in rows)
+            )
+        return cursor.rowcount
+
+    @staticmethod
+    def discharge(resident_id, discharge_date=None):
+        """Record that a resident has left the shelter (today by default)
+
+        Discharged residents stay in the live database until archive.py
+        moves them out once the discharge is older than its horizon. A
+        discharge dated before the resident's entry is refused.
+        """
+        discharge_day = day_number(discharge_date or date.today())
+        with transaction() as conn:
+            cursor = conn.execute(
+                'UPDATE residents SET discharge_date = ? WHERE id = ? AND entry_date <= ?',
+                (discharge_day, resident_id, discharge_day)
+            )
+            if not cursor.rowcount:
+                exists = conn.execute('SELECT 1 FROM residents WHERE id = ?', (resident_id,)).fetchone()
+                return "Discharge date is before entry date" if exists else "Resident not found"
+        return "Resident discharged"
+
+    @staticmethod
+    def ids_for_keys(keys):
+        """Map name keys to resident ids for the keys that exist"""
+        keys = list(keys)
+        found = {}
+        conn = get_connection()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            found.update(conn.execute(
+                f"SELECT name_key, id FROM residents WHERE name_key IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+        return found
+
+    @staticmethod
+    def existing_ids(ids):
+        """Return the subset of resident ids that exist"""
+        ids = list(ids)
+        found = set()
+        conn = get_connection()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            found.update(row[0] for row in conn.execute(
+                f"SELECT id FROM residents WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+        return found
+
     @staticmethod
     def get_all():
-        """Get all residents from database"""
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM residents ORDER BY id')     
-        residents = cursor.fetchall()
-        conn.close()
-        return residents
+        """Get all residents from database as ResidentRecords"""
+        return _query(ResidentRecord, 'SELECT * FROM residents ORDER BY id').fetchall()
+
+    @staticmethod
+    def iter_all(batch_size=ITER_BATCH_SIZE):
+        """Yield every resident as a ResidentRecord, in id order
+
+        Unlike get_all, rows are read batch_size at a time, so listing a
+        large table keeps only one batch in memory.
+        """
+        return _iter_batches(ResidentRecord, 'SELECT * FROM residents', 'id', batch_size)
+
+    @staticmethod
+    def added_after(last_id, limit=PAGE_SIZE):
+        """The newest residents with an id above last_id, in the order they were added"""
+        rows = _query(ResidentRecord, 'SELECT * FROM residents WHERE id > ? ORDER BY id DESC LIMIT ?',
+                      (last_id, limit)).fetchall()
+        return rows[::-1]
 
     @staticmethod
     def check_duplicate(first_name, last_name):
         """Check if resident already exists in database"""
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT id FROM residents WHERE LOWER(first_name) = LOWER(?) AND LOWER(last_name) = LOWER(?)',
-            (first_name, last_name)
+        cursor = get_connection().execute(
+            'SELECT id FROM residents WHERE name_key = ?',
+            (name_key(first_name, last_name),)
         )
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None  # Returns True if duplicate exists
+        return cursor.fetchone() is not None  # Returns True if duplicate exists
+
+    @staticmethod
+    def cursor(row):
+        """Page cursor pointing at a residents row"""
+        return _cursor(row.entry_date, row.id)
+
+    @staticmethod
+    def page(after=None, before=None, limit=PAGE_SIZE):
+        """One page of residents, most recent entry first"""
+        return _keyset_page(
+            ResidentRecord, 'SELECT * FROM residents', 'entry_date', 'id',
+            lambda row: (row.entry_date, row.id), after, before, limit
+        )
+
+    @staticmethod
+    def page_at(offset, limit=PAGE_SIZE):
+        """The page of residents starting `offset` rows from the most recent"""
+        return _page_at(
+            ResidentRecord, 'SELECT * FROM residents', 'entry_date', 'id',
+            lambda row: (row.entry_date, row.id),
+            'SELECT entry_date, id FROM residents ORDER BY entry_date DESC, id DESC',
+            offset, limit
+        )
+
+    @staticmethod
+    def search(text, limit=SEARCH_LIMIT, offset=0):
+        """Residents matching every word of text as a name prefix
+
+        Uses the residents_fts index, so "mar gar" finds Maria Garcia
+        without scanning the table. Results are ranked best match first
+        and capped at MAX_SEARCH_LIMIT per call; returns (ResidentRecords,
+        has_more).
+        """
+        words = re.findall(r'\w+', normalize_name(text))
+        if not words:
+            return [], False
+        query = ' '.join(f'"{word}"*' for word in words)
+        limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+        rows = _query(
+            ResidentRecord,
+            '''SELECT r.* FROM residents_fts f
+               JOIN residents r ON r.id = f.rowid
+               WHERE residents_fts MATCH ?
+               ORDER BY f.rank
+               LIMIT ? OFFSET ?''',
+            (query, limit + 1, offset)
+        ).fetchall()
+        return rows[:limit], len(rows) > limit
+
+
+class ServiceType:
+    """Service types, stored once in service_types and referenced by id"""
+
+    # key -> id. Ids never change once committed, so each type is looked
+    # up once per database file; the map starts afresh whenever a new
+    # connection is opened, in case the file was replaced or restored.
+    _ids = {}
+    _ids_for = None  # database.connections_opened() the map is from
+    # Per thread: keys of types added in a transaction not yet committed
+    _local = threading.local()
+
+    @staticmethod
+    def _uncommitted():
+        keys = getattr(ServiceType._local, 'uncommitted', None)
+        if keys is None:
+            keys = ServiceType._local.uncommitted = set()
+        return keys
+
+    @staticmethod
+    def id_for(name):
+        """Id of the service type called name, adding the type if it is new
+
+        Names are matched like resident names, so "counseling " is the
+        existing "Counseling". Raises ValueError for a blank name.
+        """
+        key = normalize_name(name)
+        if not key:
+            raise ValueError("service type is blank")
+        conn = get_connection()
+        if ServiceType._ids_for != database.connections_opened():
+            ServiceType._ids = {}
+            ServiceType._ids_for = database.connections_opened()
+        type_id = ServiceType._ids.get(key)
+        if type_id is not None:
+            return type_id
+
+        uncommitted = ServiceType._uncommitted()
+        row = conn.execute('SELECT id FROM service_types WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            with transaction():
+                conn.execute('INSERT INTO service_types (name, key) VALUES (?, ?) ON CONFLICT(key) DO NOTHING',
+                             (' '.join(name.split()), key))
+                row = conn.execute('SELECT id FROM service_types WHERE key = ?', (key,)).fetchone()
+            if conn.in_transaction:
+                uncommitted.add(key)
+        if conn.in_transaction and key in uncommitted:
+            # Added by this transaction, which may yet roll back, in whole
+            # or to a savepoint: remember it once it is committed
+            database.after_commit(lambda: ServiceType._remember(key))
+        else:
+            ServiceType._ids[key] = row[0]
+        return row[0]
+
+    @staticmethod
+    def _remember(key):
+        ServiceType._uncommitted().discard(key)
+        row = get_connection().execute('SELECT id FROM service_types WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            ServiceType._ids[key] = row[0]
+
+    @staticmethod
+    def all():
+        """Return (id, name) pairs, most used first"""
+        cursor = get_connection().execute('''
+            SELECT t.id, t.name FROM service_types t
+            LEFT JOIN service_type_counts c ON c.service_type_id = t.id
+            ORDER BY COALESCE(c.count, 0) DESC, t.name
+        ''')
+        return cursor.fetchall()
+
+
+# Services with resident names, as ServiceRecords list them
+SERVICE_ROWS = '''SELECT s.id, r.first_name, r.last_name, t.name, s.service_date,
+                         time(s.service_time, 'unixepoch')
+                  FROM services s
+                  JOIN residents r ON s.resident_id = r.id
+                  JOIN service_types t ON t.id = s.service_type_id'''
 
 
 class Service:
@@ -51,15 +402,115 @@ class Service:
 
     @staticmethod
     def add(resident_id, service_type):
-        """Add a service record"""
-        today = date.today().isoformat()
-
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO services (resident_id, service_type, service_date) VALUES (?, ?, ?)',
-            (resident_id, service_type, today)
+        """Add a service record dated now"""
+        today, service_time = now()
+        type_id = ServiceType.id_for(service_type)
+
+        with transaction() as conn:
+            conn.execute(
+                '''INSERT INTO services (resident_id, service_type_id, service_date, service_time)
+                   VALUES (?, ?, ?, ?)''',
+                (resident_id, type_id, today, service_time)
+            )
+        return "Service logged"
+
+    @staticmethod
+    def add_many(rows, service_time=None):
+        """Insert (resident_id, service_type, service_date) rows in one transaction
+
+        service_date may be a date or an ISO date string; service_time,
+        in seconds after midnight, applies to every row.
+        """
+        rows = list(rows)
+        type_ids = {name: ServiceType.id_for(name) for name in {row[1] for row in rows}}
+        with transaction() as conn:
+            cursor = conn.executemany(
+                '''INSERT INTO services (resident_id, service_type_id, service_date, service_time)
+                   VALUES (?, ?, ?, ?)''',
+                ((resident_id, type_ids[service_type], day_number(service_date), service_time)
+                 for resident_id, service_type, service_date in rows)
+            )
+        return cursor.rowcount
+
+    @staticmethod
+    def log_for_residents(resident_ids, service_type, service_date=None):
+        """Log one service for many residents in a single transaction
+
+        Ids that do not belong to a resident are skipped. Returns the
+        number of services logged.
+        """
+        service_time = None
+        if service_date is None:
+            service_date, service_time = now()
+        ServiceType.id_for(service_type)  # Added, if new, outside the batch transaction
+        with transaction():
+            ids = Resident.existing_ids(set(resident_ids))
+            return Service.add_many(((resident_id, service_type, service_date)
+                                     for resident_id in sorted(ids)), service_time)
+
+    @staticmethod
+    def cursor(row):
+        """Page cursor pointing at a row from Service.page"""
+        return _cursor(row.service_date, row.id)
+
+    @staticmethod
+    def page(after=None, before=None, limit=PAGE_SIZE):
+        """One page of services with resident names, most recent first"""
+        return _keyset_page(
+            ServiceRecord, SERVICE_ROWS, 's.service_date', 's.id',
+            lambda row: (row.service_date, row.id), after, before, limit
+        )
+
+    @staticmethod
+    def page_at(offset, limit=PAGE_SIZE):
+        """The page of services starting `offset` rows from the most recent"""
+        return _page_at(
+            ServiceRecord, SERVICE_ROWS, 's.service_date', 's.id',
+            lambda row: (row.service_date, row.id),
+            'SELECT service_date, id FROM services ORDER BY service_date DESC, id DESC',
+            offset, limit
         )
-        conn.commit()
-        conn.close()
-        return "Service logged"
\ No newline at end of file
+
+    @staticmethod
+    def added_after(last_id, limit=PAGE_SIZE):
+        """The newest services with an id above last_id, in the order they were logged"""
+        rows = _query(ServiceRecord, f'{SERVICE_ROWS} WHERE s.id > ? ORDER BY s.id DESC LIMIT ?',
+                      (last_id, limit)).fetchall()
+        return rows[::-1]
+
+    @staticmethod
+    def iter_services(batch_size=ITER_BATCH_SIZE):
+        """Yield every service with resident names as a ServiceRecord, oldest logged first
+
+        Rows are read batch_size at a time, like Resident.iter_all.
+        """
+        return _iter_batches(ServiceRecord, SERVICE_ROWS, 's.id', batch_size)
+
+
+class Stats:
+    """Counters kept current by database triggers"""
+
+    @staticmethod
+    def totals(include_archive=True):
+        """Return residents, services, service_types and active_months counts
+
+        The counters cover the live tables; the archived rows are added
+        in from the archive's rollups unless include_archive is false.
+        Must not be called inside a transaction if anything has been
+        archived, as the archive may need attaching.
+        """
+        totals = dict(get_connection().execute('SELECT name, value FROM stats'))
+        if include_archive:
+            for name, value in archive.totals().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    @staticmethod
+    def service_type_counts():
+        """Return (service type name, count) pairs, most used first"""
+        cursor = get_connection().execute('''
+            SELECT t.name, c.count FROM service_type_counts c
+            JOIN service_types t ON t.id = c.service_type_id
+            ORDER BY c.count DESC
+        ''')
+        return cursor.fetchall()
\ No newline at end of file
@@ -1,190 +1,446 @@
 # reports.py - Reporting module for Safe Shelter
-import sqlite3
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+import argparse
 import csv
+import multiprocessing
+import os
+import analytics
+import archive
+import database
+from cache import cached
+from database import day_number, get_connection, month_bounds
+from models import Stats
+
+
+def months_between(start, end):
+    """Every YYYY-MM month from start to end inclusive"""
+    year, month = map(int, start.split('-'))
+    months = []
+    while f"{year:04d}-{month:02d}" <= end:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _open_readonly(path):
+    """Process pool initializer: report workers only ever read"""
+    database.configure(path, readonly=True)
+
+
+def _build_month(year_month):
+    return ShelterReports.build_monthly_report(year_month)
+
+
+def _attach_archive_for(year_month=None):
+    """Attach the archive database if year_month (default: any month) has rows in it
+
+    Returns True when the figures must include the archive.
+    """
+    conn = get_connection()
+    if year_month is None:
+        archived = conn.execute('SELECT 1 FROM archived_months LIMIT 1').fetchone()
+    else:
+        archived = conn.execute('SELECT 1 FROM archived_months WHERE month = ?', (year_month,)).fetchone()
+    if archived is None:
+        return False
+    if not archive.attach(conn):
+        archived = f"{year_month} was" if year_month else "rows were"
+        raise FileNotFoundError(f"{archived} archived but {archive.archive_path()} is missing")
+    return True
+
+
+@cached('system_figures')
+def _system_figures(since, month_start, month_end):
+    """Windowed counts for the system report, in one pass per table
+
+    Only the live tables are scanned: archived services are added to
+    the per-type counts from the archive's monthly rollup, so the cost
+    does not grow with the archive. Unique residents and the windowed
+    counts are of live rows, which hold everything newer than the
+    archive horizon.
+    """
+    archived = ''
+    if _attach_archive_for():
+        archived = '''
+            UNION ALL
+            SELECT service_type_id, SUM(count), 0, 0, 0
+            FROM archive.monthly_service_counts
+            GROUP BY service_type_id'''
+    cursor = get_connection().cursor()
+    cursor.execute('''
+        SELECT COALESCE(SUM(entry_date >= ?), 0),
+               COALESCE(SUM(entry_date >= ? AND entry_date < ?), 0)
+        FROM main.residents
+        WHERE entry_date >= MIN(?, ?)
+    ''', (since, month_start, month_end, since, month_start))
+    recent_residents, month_residents = cursor.fetchone()
+    
+    cursor.execute(f'''
+        SELECT t.name, SUM(f.count), SUM(f.unique_residents), SUM(f.recent), SUM(f.this_month)
+        FROM (
+            SELECT service_type_id, COUNT(*) as count,
+                   COUNT(DISTINCT resident_id) as unique_residents,
+                   SUM(service_date >= ?) as recent,
+                   SUM(service_date >= ? AND service_date < ?) as this_month
+            FROM main.services
+            GROUP BY service_type_id{archived}
+        ) f
+        JOIN service_types t ON t.id = f.service_type_id
+        GROUP BY f.service_type_id
+        HAVING SUM(f.count) > 0
+        ORDER BY SUM(f.count) DESC
+    ''', (since, month_start, month_end))
+    service_breakdown = []
+    total_services = recent_services = month_services = 0
+    for service_type, count, unique_res, recent, this_month in cursor:
+        service_breakdown.append((service_type, count, unique_res))
+        total_services += count
+        recent_services += recent
+        month_services += this_month
+    
+    return (recent_residents, month_residents, service_breakdown,
+            total_services, recent_services, month_services)
+
+
+# Figures for the monthly activity report
+MonthlyReport = namedtuple('MonthlyReport', [
+    'year_month', 'new_residents', 'total_residents', 'services', 'top_residents',
+])
+
+# Every figure in the comprehensive system report
+SystemReport = namedtuple('SystemReport', [
+    'generated', 'total_residents', 'total_services', 'unique_service_types',
+    'active_months', 'recent_residents', 'recent_services', 'service_breakdown',
+    'current_month', 'month_residents', 'month_services',
+])
+
 
 class ShelterReports:
     @staticmethod
-    def monthly_report(year_month=None):
-        """Generate monthly activity report"""
-        if year_month is None:
-            year_month = datetime.now().strftime("%Y-%m")
-        
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        
-        # Get month start and end
-        year, month = map(int, year_month.split('-'))
-        
-        print(f"\n{'='*60}")
-        print(f"SAFE SHELTER - MONTHLY REPORT: {year_month}")
-        print(f"{'='*60}")
+    @cached('monthly_report')
+    def build_monthly_report(year_month):
+        """Compute the monthly activity report as a MonthlyReport
+
+        Counts come from the monthly rollup tables, so a report costs
+        the same for any month however much history is stored. Months
+        with rows moved out by archive.py also read the archive's
+        rollups, which is attached for them.
+        """
+        cursor = get_connection().cursor()
+        if _attach_archive_for(year_month):
+            rollup = lambda table: f"(SELECT * FROM main.{table} UNION ALL SELECT * FROM archive.{table})"
+            names = ('COALESCE(r.first_name, a.first_name), COALESCE(r.last_name, a.last_name)',
+                     'LEFT JOIN main.residents r ON r.id = m.resident_id '
+                     'LEFT JOIN archive.residents a ON a.id = m.resident_id')
+        else:
+            rollup = lambda table: table
+            names = ('r.first_name, r.last_name', 'JOIN residents r ON r.id = m.resident_id')
         
         # New residents this month
-        cursor.execute('''
-            SELECT COUNT(*) FROM residents 
-            WHERE strftime('%Y-%m', entry_date) = ?
-        ''', (year_month,))
+        cursor.execute(f'SELECT COALESCE(SUM(count), 0) FROM {rollup("monthly_new_residents")} '
+                       'WHERE month = ?', (year_month,))
         new_residents = cursor.fetchone()[0]
         
         # Services provided this month
-        cursor.execute('''
-            SELECT service_type, COUNT(*) as count 
-            FROM services 
-            WHERE strftime('%Y-%m', service_date) = ?
-            GROUP BY service_type
-            ORDER BY count DESC
+        cursor.execute(f'''
+            SELECT t.name, m.count
+            FROM (SELECT service_type_id, SUM(count) AS count
+                  FROM {rollup("monthly_service_counts")}
+                  WHERE month = ? GROUP BY service_type_id) m
+            JOIN service_types t ON t.id = m.service_type_id
+            WHERE m.count > 0
+            ORDER BY m.count DESC
         ''', (year_month,))
         services = cursor.fetchall()
         
-        # Total residents
-        cursor.execute('SELECT COUNT(*) FROM residents')
-        total_residents = cursor.fetchone()[0]
+        # Top residents by services
+        cursor.execute(f'''
+            SELECT {names[0]}, m.count
+            FROM (SELECT resident_id, SUM(count) AS count
+                  FROM {rollup("monthly_resident_services")}
+                  WHERE month = ? GROUP BY resident_id) m
+            {names[1]}
+            WHERE m.count > 0
+            ORDER BY m.count DESC
+            LIMIT 5
+        ''', (year_month,))
+        top_residents = cursor.fetchall()
+        
+        return MonthlyReport(
+            year_month=year_month,
+            new_residents=new_residents,
+            total_residents=Stats.totals()['residents'],
+            services=services,
+            top_residents=top_residents,
+        )
+
+    @staticmethod
+    def build_monthly_reports(start, end, workers=1):
+        """MonthlyReports for every month from start to end, in order
+
+        With workers > 1 the months are spread over a pool of worker
+        processes, each with its own read-only connection, and only the
+        report data comes back. Workers are spawned rather than forked so
+        no open SQLite handle is shared with a child. A month read from
+        the rollups takes well under a millisecond, so starting the pool
+        only pays off for very long ranges or a slow disk.
+        """
+        months = months_between(start, end)
+        workers = min(workers or os.cpu_count() or 1, len(months))
+        if workers <= 1:
+            return [ShelterReports.build_monthly_report(month) for month in months]
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_open_readonly,
+                                 initargs=(os.path.abspath(database.DB_PATH),)) as pool:
+            chunksize = max(1, len(months) // (workers * 4))
+            return list(pool.map(_build_month, months, chunksize=chunksize))
+
+    @staticmethod
+    def print_monthly_report(report):
+        """Print a MonthlyReport to the console"""
+        print(f"\n{'='*60}")
+        print(f"SAFE SHELTER - MONTHLY REPORT: {report.year_month}")
+        print(f"{'='*60}")
         
         # Print report
         print(f"\n📊 MONTHLY STATISTICS")
-        print(f"   New Residents: {new_residents}")
-        print(f"   Total Residents: {total_residents}")
+        print(f"   New Residents: {report.new_residents}")
+        print(f"   Total Residents: {report.total_residents}")
         
-        if services:
+        if report.services:
             print(f"\n📋 SERVICES PROVIDED")
-            for service_type, count in services:
+            for service_type, count in report.services:
                 print(f"   {service_type}: {count}")
-            total_services = sum(count for _, count in services)
+            total_services = sum(count for _, count in report.services)
             print(f"   Total Services: {total_services}")
         else:
             print(f"\n📋 No services recorded this month")
         
-        # Top residents by services
-        cursor.execute('''
-            SELECT r.first_name, r.last_name, COUNT(s.id) as service_count
-            FROM residents r
-            LEFT JOIN services s ON r.id = s.resident_id AND strftime('%Y-%m', s.service_date) = ?
-            GROUP BY r.id
-            ORDER BY service_count DESC
-            LIMIT 5
-        ''', (year_month,))
-        top_residents = cursor.fetchall()
-        
-        if top_residents:
+        if report.top_residents:
             print(f"\n👥 TOP RESIDENTS BY SERVICES")
-            for first, last, count in top_residents:
-                if count > 0:
-                    print(f"   {first} {last}: {count} services")
-        
-        conn.close()
-        
-        # Save to CSV
-        filename = f"shelter_report_{year_month}.csv"
+            for first, last, count in report.top_residents:
+                print(f"   {first} {last}: {count} services")
+
+    @staticmethod
+    def write_monthly_csv(report, filename):
+        """Save a MonthlyReport as a CSV file"""
         with open(filename, 'w', newline='') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(['Safe Shelter Monthly Report', year_month])
+            writer.writerow(['Safe Shelter Monthly Report', report.year_month])
             writer.writerow([])
             writer.writerow(['Metric', 'Value'])
-            writer.writerow(['New Residents', new_residents])
-            writer.writerow(['Total Residents', total_residents])
+            writer.writerow(['New Residents', report.new_residents])
+            writer.writerow(['Total Residents', report.total_residents])
             writer.writerow([])
             writer.writerow(['Service Type', 'Count'])
-            for service_type, count in services:
+            for service_type, count in report.services:
                 writer.writerow([service_type, count])
+        return filename
+
+    @staticmethod
+    def write_combined_csv(reports, filename):
+        """Save several MonthlyReports as one CSV with a section per table
+
+        Laid out like a workbook: a per-month summary, services by type
+        with one column per month, then each month's top residents.
+        """
+        months = [report.year_month for report in reports]
+        by_type = {}
+        for column, report in enumerate(reports):
+            for service_type, count in report.services:
+                by_type.setdefault(service_type, [0] * len(reports))[column] = count
+        
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Safe Shelter Report', f"{months[0]} to {months[-1]}"] if months else
+                            ['Safe Shelter Report'])
+            writer.writerow([])
+            writer.writerow(['Summary'])
+            writer.writerow(['Month', 'New Residents', 'Services'])
+            for report in reports:
+                writer.writerow([report.year_month, report.new_residents,
+                                 sum(count for _, count in report.services)])
+            writer.writerow([])
+            writer.writerow(['Services by Type'])
+            writer.writerow(['Service Type'] + months + ['Total'])
+            for service_type, counts in sorted(by_type.items(), key=lambda item: -sum(item[1])):
+                writer.writerow([service_type] + counts + [sum(counts)])
+            writer.writerow([])
+            writer.writerow(['Top Residents'])
+            writer.writerow(['Month', 'Resident', 'Services'])
+            for report in reports:
+                for first, last, count in report.top_residents:
+                    writer.writerow([report.year_month, f"{first} {last}", count])
+        return filename
+
+    @staticmethod
+    def batch_report(start, end, workers=1, directory='.'):
+        """Write per-month CSVs and one combined CSV for a range of months"""
+        reports = ShelterReports.build_monthly_reports(start, end, workers)
+        os.makedirs(directory, exist_ok=True)
+        filenames = [ShelterReports.write_monthly_csv(
+                         report, os.path.join(directory, f"shelter_report_{report.year_month}.csv"))
+                     for report in reports]
+        combined = ShelterReports.write_combined_csv(
+            reports, os.path.join(directory, f"shelter_report_{start}_to_{end}.csv"))
+        
+        print(f"\n💾 {len(filenames)} monthly reports and {combined} saved")
+        return combined, filenames
+
+    @staticmethod
+    def monthly_report(year_month=None):
+        """Generate monthly activity report"""
+        if year_month is None:
+            year_month = datetime.now().strftime("%Y-%m")
+        
+        report = ShelterReports.build_monthly_report(year_month)
+        ShelterReports.print_monthly_report(report)
+        
+        # Save to CSV
+        filename = ShelterReports.write_monthly_csv(report, f"shelter_report_{year_month}.csv")
         
         print(f"\n💾 Report saved to: {filename}")
         print(f"{'='*60}")
         return filename
 
+    @staticmethod
+    def build_system_report(now=None):
+        """Compute the comprehensive system report as a SystemReport
+
+        Services are aggregated in one pass over a covering index that
+        yields every section at once; residents need only a range scan
+        of the recent rows. Totals come from the trigger counters, and
+        the windowed counts are cached until the next write.
+        """
+        now = now or datetime.now()
+        totals = Stats.totals()
+        
+        thirty_days_ago = day_number(now.date() - timedelta(days=30))
+        current_month = now.strftime("%Y-%m")
+        (recent_residents, month_residents, service_breakdown, total_services,
+         recent_services, month_services) = _system_figures(thirty_days_ago, *month_bounds(current_month))
+        
+        return SystemReport(
+            generated=now.strftime("%Y-%m-%d %H:%M:%S"),
+            total_residents=totals['residents'],
+            total_services=total_services,
+            unique_service_types=len(service_breakdown),
+            active_months=totals['active_months'],
+            recent_residents=recent_residents,
+            recent_services=recent_services,
+            service_breakdown=service_breakdown,
+            current_month=current_month,
+            month_residents=month_residents,
+            month_services=month_services,
+        )
+
     @staticmethod
     def generate_system_report():
         """Generate comprehensive system report"""
-        conn = sqlite3.connect('shelter.db')
-        cursor = conn.cursor()
-        
-        report_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        report = ShelterReports.build_system_report()
         
         print(f"\n{'='*70}")
         print(f"SAFE SHELTER - COMPREHENSIVE SYSTEM REPORT")
-        print(f"Generated: {report_date}")
+        print(f"Generated: {report.generated}")
         print(f"{'='*70}")
         
         # 1. Basic Statistics
-        cursor.execute('SELECT COUNT(*) FROM residents')
-        total_residents = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM services')
-        total_services = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(DISTINCT service_type) FROM services')
-        unique_service_types = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(DISTINCT strftime("%Y-%m", service_date)) FROM services')
-        active_months = cursor.fetchone()[0]
-        
         print(f"\n📈 SYSTEM OVERVIEW")
-        print(f"   Total Residents: {total_residents}")
-        print(f"   Total Services Provided: {total_services}")
-        print(f"   Unique Service Types: {unique_service_types}")
-        print(f"   Active Months (with services): {active_months}")
+        print(f"   Total Residents: {report.total_residents}")
+        print(f"   Total Services Provided: {report.total_services}")
+        print(f"   Unique Service Types: {report.unique_service_types}")
+        print(f"   Active Months (with services): {report.active_months}")
         
         # 2. Recent Activity (last 30 days)
-        thirty_days_ago = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
-        
-        cursor.execute('SELECT COUNT(*) FROM residents WHERE entry_date >= ?', (thirty_days_ago,))
-        recent_residents = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM services WHERE service_date >= ?', (thirty_days_ago,))
-        recent_services = cursor.fetchone()[0]
-        
         print(f"\n🔄 RECENT ACTIVITY (Last 30 days)")
-        print(f"   New Residents: {recent_residents}")
-        print(f"   Services Provided: {recent_services}")
+        print(f"   New Residents: {report.recent_residents}")
+        print(f"   Services Provided: {report.recent_services}")
         
         # 3. Service Breakdown
         print(f"\n📊 SERVICE BREAKDOWN")
-        cursor.execute('''
-            SELECT service_type, COUNT(*) as count, 
-                   COUNT(DISTINCT resident_id) as unique_residents
-            FROM services 
-            GROUP BY service_type 
-            ORDER BY count DESC
-        ''')
-        
-        service_stats = cursor.fetchall()
-        for service_type, count, unique_res in service_stats:
-            print(f"   {service_type}: {count} sessions, {unique_res} residents")
+        for service_type, count, unique_res in report.service_breakdown:
+            print(f"   {service_type}: {count} sessions, {unique_res} residents not yet archived")
         
         # 4. Current Month Summary
-        current_month = datetime.now().strftime("%Y-%m")
-        print(f"\n📅 CURRENT MONTH ({current_month})")
-        
-        cursor.execute('SELECT COUNT(*) FROM residents WHERE strftime("%Y-%m", entry_date) = ?', 
-                      (current_month,))
-        month_residents = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM services WHERE strftime("%Y-%m", service_date) = ?', 
-                      (current_month,))
-        month_services = cursor.fetchone()[0]
-        
-        print(f"   New Residents This Month: {month_residents}")
-        print(f"   Services This Month: {month_services}")
-        
-        conn.close()
+        print(f"\n📅 CURRENT MONTH ({report.current_month})")
+        print(f"   New Residents This Month: {report.month_residents}")
+        print(f"   Services This Month: {report.month_services}")
         
         # Save to file
         filename = f"system_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
         with open(filename, 'w') as f:
             f.write(f"Safe Shelter System Report\n")
-            f.write(f"Generated: {report_date}\n")
+            f.write(f"Generated: {report.generated}\n")
             f.write("="*50 + "\n\n")
-            f.write(f"Total Residents: {total_residents}\n")
-            f.write(f"Total Services: {total_services}\n")
-            f.write(f"Recent Residents (30 days): {recent_residents}\n")
-            f.write(f"Recent Services (30 days): {recent_services}\n")
+            f.write(f"Total Residents: {report.total_residents}\n")
+            f.write(f"Total Services: {report.total_services}\n")
+            f.write(f"Recent Residents (30 days): {report.recent_residents}\n")
+            f.write(f"Recent Services (30 days): {report.recent_services}\n")
         
         print(f"\n💾 Report saved to: {filename}")
         print(f"{'='*70}")
         return filename
 
-# Test the reports
+    @staticmethod
+    def analytics_report(start=None, end=None):
+        """Print occupancy and length of stay for a date range (default: the last year)"""
+        report = analytics.compute(start, end)
+        stay = report.length_of_stay
+        
+        print(f"\n{'='*60}")
+        print(f"SAFE SHELTER - OCCUPANCY ANALYTICS: {report.start} to {report.end}")
+        print(f"{'='*60}")
+        
+        print(f"\n🛏️ OCCUPANCY")
+        print(f"   Average Nightly Residents: {report.average_occupancy:.1f}")
+        print(f"   Peak: {report.peak} on {report.peak_date}")
+        print(f"   Resident Days: {report.resident_days}")
+        
+        print(f"\n📆 LENGTH OF STAY ({stay.stays} discharges)")
+        if stay.stays:
+            print(f"   Mean: {stay.mean:.1f} days, Median: {stay.median}, 90th Percentile: {stay.p90}, "
+                  f"Longest: {stay.longest}")
+            for label, count in stay.buckets:
+                print(f"   {label}: {count}")
+        
+        print(f"\n📋 SERVICES")
+        print(f"   Services Provided: {report.services}")
+        print(f"   Services per Resident Day: {report.services_per_resident_day:.2f}")
+        print(f"{'='*60}")
+        return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Safe Shelter reports")
+    commands = parser.add_subparsers(dest='command')
+    monthly = commands.add_parser('monthly', help="one month's activity report")
+    monthly.add_argument('month', nargs='?', help="YYYY-MM (default: this month)")
+    commands.add_parser('system', help="comprehensive system report")
+    batch = commands.add_parser('batch', help="reports for every month in a range")
+    batch.add_argument('start', help="first month, YYYY-MM")
+    batch.add_argument('end', help="last month, YYYY-MM")
+    batch.add_argument('--workers', type=int, default=1,
+                       help="processes to use, 0 for one per core (default: 1)")
+    batch.add_argument('--output-dir', default='.', help="directory for the CSV files")
+    occupancy = commands.add_parser('analytics', help="occupancy and length of stay over a date range")
+    occupancy.add_argument('--start', help="first day, YYYY-MM-DD (default: a year before --end)")
+    occupancy.add_argument('--end', help="last day, YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    if args.command == 'monthly':
+        ShelterReports.monthly_report(args.month)
+    elif args.command == 'system':
+        ShelterReports.generate_system_report()
+    elif args.command == 'batch':
+        ShelterReports.batch_report(args.start, args.end, args.workers, args.output_dir)
+    elif args.command == 'analytics':
+        ShelterReports.analytics_report(args.start, args.end)
+    else:
+        print("Testing Shelter Reports...")
+        ShelterReports.monthly_report("2025-12")
+        ShelterReports.generate_system_report()
+
+
 if __name__ == "__main__":
-    print("Testing Shelter Reports...")
-    ShelterReports.monthly_report("2025-12")
-    ShelterReports.generate_system_report()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,154 @@
+# seed_data.py - Seeded synthetic residents and service histories for Safe Shelter
+import argparse
+import math
+import random
+import time
+from datetime import date, timedelta
+
+import database
+from database import day_number, transaction
+from models import ServiceType, name_key
+
+FIRST_NAMES = (
+    'Maria', 'Ana', 'Rosa', 'Carmen', 'Lucia', 'Sofia', 'Isabel', 'Elena', 'Aisha', 'Fatima',
+    'Amina', 'Grace', 'Mary', 'Patricia', 'Jennifer', 'Linda', 'Elizabeth', 'Barbara', 'Susan',
+    'Jessica', 'Sarah', 'Karen', 'Nancy', 'Lisa', 'Betty', 'Sandra', 'Ashley', 'Kimberly',
+    'Emily', 'Donna', 'Michelle', 'Laura', 'Angela', 'Tanya', 'Keisha', 'Latoya', 'Mei', 'Linh',
+    'Priya', 'Anjali', 'Olga', 'Irina', 'Nadia', 'Leila', 'Yasmin', 'Chloe', 'Zoe', 'Hannah',
+    'Naomi', 'Ruth',
+)
+LAST_NAMES = (
+    'Garcia', 'Lopez', 'Martinez', 'Rodriguez', 'Hernandez', 'Gonzalez', 'Perez', 'Sanchez',
+    'Ramirez', 'Torres', 'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Miller', 'Davis',
+    'Wilson', 'Anderson', 'Taylor', 'Thomas', 'Moore', 'Jackson', 'Martin', 'Lee', 'Thompson',
+    'White', 'Harris', 'Clark', 'Lewis', 'Robinson', 'Walker', 'Young', 'Allen', 'King',
+    'Nguyen', 'Tran', 'Kim', 'Patel', 'Singh', 'Khan', 'Ali', 'Ivanova', 'Petrova', 'Okafor',
+    'Mensah', 'Cohen', 'Murphy', 'Kelly', 'Diaz',
+)
+
+# Service types with their relative frequency
+SERVICE_TYPES = {
+    'Meals': 45, 'Counseling': 15, 'Case Management': 10, 'Clothing': 8,
+    'Classes': 7, 'Legal Aid': 5, 'Medical': 5, 'Childcare': 5,
+}
+
+MEDIAN_STAY_DAYS = 60
+OPEN_SECONDS = (8 * 3600, 20 * 3600)  # services are logged between 08:00 and 20:00
+BATCH_SIZE = 50000
+
+
+def resident_names(count, rng):
+    """count distinct (first, last) names
+
+    Every first and last name pairing is used once before names become
+    double-barrelled (Garcia-Lopez), then numbered.
+    """
+    firsts = rng.sample(FIRST_NAMES, len(FIRST_NAMES))
+    lasts = rng.sample(LAST_NAMES, len(LAST_NAMES))
+    for i in range(count):
+        rest, first = divmod(i, len(firsts))
+        rest, last = divmod(rest, len(lasts))
+        last = lasts[last]
+        if rest:
+            rest, second = divmod(rest - 1, len(lasts))
+            last = f"{last}-{lasts[second]}"
+            if rest:
+                last = f"{last} {rest + 1}"
+        yield firsts[first], last
+
+
+def _write(sql, rows):
+    with transaction() as conn:
+        conn.executemany(sql, rows)
+
+
+def seed(residents=1000, services=20000, seed=0, end=None, years=5, batch_size=BATCH_SIZE,
+         progress=None):
+    """Insert synthetic residents and their service histories
+
+    Entry dates are spread over the `years` up to `end` (default today)
+    and stays are log-normal around MEDIAN_STAY_DAYS; residents whose
+    stay ended before `end` are discharged. The services are shared out
+    in proportion to each stay, on days within it and at opening hours,
+    with types drawn by SERVICE_TYPES frequency. The same arguments
+    always give the same rows. Returns (residents, services) inserted;
+    progress, if given, is called with (residents done, services done).
+    """
+    rng = random.Random(seed)
+    end_day = day_number(end or date.today())
+    start_day = end_day - int(years * 365.25)
+    conn = database.get_connection()
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'residents'").fetchone()
+    first_id = (row[0] if row else 0) + 1
+
+    stays = []  # (resident id, entry day, days present)
+    batch = []
+    for resident_id, (first, last) in enumerate(resident_names(residents, rng), start=first_id):
+        entry = rng.randint(start_day, end_day)
+        leaves = entry + max(1, round(rng.lognormvariate(math.log(MEDIAN_STAY_DAYS), 0.9)))
+        discharge = leaves if leaves <= end_day else None
+        stays.append((resident_id, entry, (discharge or end_day) - entry + 1))
+        batch.append((resident_id, first, last, entry, name_key(first, last), discharge))
+        if len(batch) >= batch_size:
+            _write('''INSERT INTO residents (id, first_name, last_name, entry_date, name_key, discharge_date)
+                      VALUES (?, ?, ?, ?, ?, ?)''', batch)
+            batch = []
+            if progress:
+                progress(len(stays), 0)
+    if batch:
+        _write('''INSERT INTO residents (id, first_name, last_name, entry_date, name_key, discharge_date)
+                  VALUES (?, ?, ?, ?, ?, ?)''', batch)
+
+    type_ids = [ServiceType.id_for(name) for name in SERVICE_TYPES]
+    cum_weights = []
+    for weight in SERVICE_TYPES.values():
+        cum_weights.append((cum_weights[-1] if cum_weights else 0) + weight)
+
+    total_days = sum(days for _, _, days in stays) or 1
+    days_so_far = done = 0
+    batch = []
+    for resident_id, entry, days in stays:
+        days_so_far += days
+        count = round(services * days_so_far / total_days) - done  # Exactly `services` in all
+        types = rng.choices(type_ids, cum_weights=cum_weights, k=count)
+        batch.extend((resident_id, type_id, entry + rng.randrange(days), rng.randrange(*OPEN_SECONDS))
+                     for type_id in types)
+        done += count
+        if len(batch) >= batch_size:
+            _write('''INSERT INTO services (resident_id, service_type_id, service_date, service_time)
+                      VALUES (?, ?, ?, ?)''', batch)
+            batch = []
+            if progress:
+                progress(residents, done)
+    if batch:
+        _write('''INSERT INTO services (resident_id, service_type_id, service_date, service_time)
+                  VALUES (?, ?, ?, ?)''', batch)
+    return residents, done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a database with synthetic residents and services")
+    parser.add_argument('--residents', type=int, default=1000)
+    parser.add_argument('--services', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0, help="the same seed gives the same data")
+    parser.add_argument('--end', type=date.fromisoformat, help="last day of history (default: today)")
+    parser.add_argument('--years', type=float, default=5, help="years of history (default: 5)")
+    parser.add_argument('--db', help="database file (default: SHELTER_DB or shelter.db)")
+    args = parser.parse_args()
+
+    if args.db:
+        database.configure(args.db)
+    database.create_database()
+    started = time.perf_counter()
+    progress = lambda residents, services: print(
+        f"   {residents:,} residents, {services:,} services", end='\r', flush=True)
+    residents, services = seed(args.residents, args.services, args.seed, args.end, args.years,
+                               progress=progress)
+    end = args.end or date.today()
+    start = end - timedelta(days=int(args.years * 365.25))
+    print(f"✓ Seeded {residents:,} residents and {services:,} services ({start} to {end}) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
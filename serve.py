@@ -0,0 +1,181 @@
+# serve.py - Production server: several worker processes sharing one port
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+import database
+
+RESTART_DELAY = 1.0  # seconds before a worker that died is replaced
+THREADS = 16         # long-lived request threads per worker
+
+
+def listen(host, port, backlog=128):
+    """Bind the listening socket the workers will share"""
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """A WSGI server that handles requests on a fixed pool of threads
+
+    The threads live as long as the server, so each keeps its SQLite
+    connection, and with it the query cache's view of the database,
+    from one request to the next. A request arriving while every pool
+    thread is busy, e.g. holding an open /events stream, gets a thread
+    of its own rather than waiting, and that thread closes its
+    connection when done.
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, threads=THREADS, fd=None):
+        super().__init__(host, port, app, fd=fd)
+        self.threads = threads
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix='shelter-request')
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            pooled = self._busy < self.threads
+            if pooled:
+                self._busy += 1
+        if pooled:
+            self._pool.submit(self._handle, request, client_address, True)
+        else:
+            threading.Thread(target=self._handle, args=(request, client_address, False),
+                             daemon=True).start()
+
+    def _handle(self, request, client_address, pooled):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            if pooled:
+                with self._lock:
+                    self._busy -= 1
+            else:
+                database.close_connection()
+
+    def serve_forever(self, poll_interval=0.5):
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            # Open /events streams never finish by themselves, so do not wait for them
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_worker(sock, host, port, config, threads=THREADS):
+    """Serve requests on the shared socket until told to stop
+
+    The app and its database connections are created here, after the
+    fork, so no SQLite connection is ever shared between processes.
+    Requests run on a PooledWSGIServer's threads.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # Not the parent's handler
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent handles Ctrl+C
+    from app import create_app, writes
+    server = PooledWSGIServer(host, port, create_app(config), threads, fd=sock.fileno())
+    # shutdown() waits for serve_forever() to return, so not from this thread
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    server.serve_forever()  # Calls server_close() on the way out
+    writes.close()  # Commit anything still queued
+
+
+def serve(host='127.0.0.1', port=8000, workers=4, config=None, ready=None, threads=THREADS):
+    """Pre-fork workers processes and keep that many running until stopped
+
+    The database is migrated once, here, before any worker starts.
+    Every worker then reads in WAL mode alongside the others and sends
+    its writes through its own single writer thread; between workers
+    the SQLite write lock serializes commits, a worker waiting up to
+    BUSY_TIMEOUT_MS for it. Stop with SIGINT or SIGTERM. Each worker
+    has its own /metrics, cache and event broker.
+    """
+    config = dict(config or {})
+    if 'DATABASE' in config or 'BUSY_TIMEOUT_MS' in config:
+        database.configure(config.get('DATABASE', database.DB_PATH),
+                           busy_timeout_ms=config.get('BUSY_TIMEOUT_MS'))
+    database.migrate()
+    database.close_connection()
+
+    sock = listen(host, port)
+    port = sock.getsockname()[1]
+    children = {}
+    stopping = False
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock, host, port, config, threads)
+            finally:
+                os._exit(0)
+        children[pid] = time.monotonic()
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        start_worker()
+    if ready:
+        ready(port)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.pop(pid, None)
+        if not stopping:
+            print(f"Worker {pid} exited ({status}); starting another", file=sys.stderr)
+            time.sleep(RESTART_DELAY)
+            start_worker()
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Safe Shelter with several worker processes")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument('--threads', type=int, default=THREADS,
+                        help=f"request threads per worker (default: {THREADS})")
+    parser.add_argument('--db', help="database file (default: SHELTER_DB or shelter.db)")
+    parser.add_argument('--busy-timeout-ms', type=int,
+                        help=f"wait for another worker's write lock (default: {database.BUSY_TIMEOUT_MS})")
+    parser.add_argument('--page-size', type=int)
+    args = parser.parse_args()
+
+    config = {key: value for key, value in (
+        ('DATABASE', args.db), ('BUSY_TIMEOUT_MS', args.busy_timeout_ms), ('PAGE_SIZE', args.page_size),
+    ) if value is not None}
+    serve(args.host, args.port, args.workers, config,
+          ready=lambda port: print(f"✓ Serving on http://{args.host}:{port} with {args.workers} workers",
+                                   flush=True),
+          threads=args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Test occupancy and length of stay analytics
+import random
+from datetime import date
+import pytest
+import analytics
+import archive
+from app import app
+from models import Resident, Service
+from reports import ShelterReports
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def engine(request, monkeypatch):
+    """Run each test with and without numpy"""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(analytics, 'np', None)
+    return request.param
+
+
+@pytest.fixture
+def stays(db):
+    """Three stays around March 2024, one still open"""
+    Resident.save_many([("Maria", "Garcia", "2024-02-20"), ("Ana", "Lopez", "2024-03-05"),
+                        ("Rosa", "Diaz", "2024-03-10")])
+    Resident.discharge(1, date(2024, 3, 3))
+    Resident.discharge(2, date(2024, 3, 15))
+    Service.add_many([(1, "Meals", "2024-03-01"), (2, "Meals", "2024-03-05"),
+                      (2, "Counseling", "2024-03-12"), (3, "Meals", "2024-04-02")])
+    return db
+
+
+def test_daily_occupancy_counts_nights_in_range(engine):
+    stays = [(5, 8), (0, 20), (7, 7), (12, 30)]
+    assert analytics.daily_occupancy(stays, 6, 10) == [2, 2, 1, 1, 1, 1, 2, 2, 2, 2]
+    assert analytics.daily_occupancy([], 6, 3) == [0, 0, 0]
+
+
+def test_length_of_stay_of_discharges_in_range(engine):
+    stay = analytics.length_of_stay([(0, 3), (0, 10), (5, 405), (0, 50), (0, 500)], 3, 405)
+    assert (stay.stays, stay.mean, stay.median, stay.p90, stay.longest) == (4, 115.75, 10, 400, 400)
+    assert stay.buckets[0] == ('0-7 days', 1)
+    assert stay.buckets[-1] == ('over a year', 1)
+    assert analytics.length_of_stay([], 0, 10).stays == 0
+
+
+def test_numpy_and_python_agree(monkeypatch):
+    pytest.importorskip('numpy')
+    rng = random.Random(7)
+    stays = []
+    for _ in range(500):
+        entry = rng.randrange(-100, 400)
+        stays.append((entry, entry + rng.randrange(0, 600)))
+    with_numpy = analytics.daily_occupancy(stays, 0, 365), analytics.length_of_stay(stays, 0, 364)
+    monkeypatch.setattr(analytics, 'np', None)
+    assert (analytics.daily_occupancy(stays, 0, 365), analytics.length_of_stay(stays, 0, 364)) == with_numpy
+
+
+def test_compute_for_a_range(stays, engine):
+    report = analytics.compute('2024-03-01', '2024-03-16')
+    # Maria leaves on the 3rd, Ana stays the 5th to 14th, Rosa from the 10th
+    assert report.occupancy == [1, 1, 0, 0, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 1, 1]
+    assert (report.peak, report.peak_date, report.resident_days) == (2, date(2024, 3, 10), 19)
+    assert report.services == 3
+    assert report.services_per_resident_day == 3 / 19
+    assert report.length_of_stay.stays == 2
+    assert analytics.compute(date(2024, 3, 1), date(2024, 3, 16)) is report  # Cached per range
+
+    Resident.discharge(3, date(2024, 3, 12))
+    assert analytics.compute('2024-03-01', '2024-03-16').resident_days == 14
+
+
+def test_compute_rejects_bad_ranges(db):
+    with pytest.raises(ValueError):
+        analytics.compute('2024-03-10', '2024-03-01')
+    with pytest.raises(ValueError):
+        analytics.compute('March', None)
+    with pytest.raises(ValueError):
+        analytics.compute('2020-01-01', '2029-12-31')
+
+
+def test_archived_stays_are_included(stays):
+    before = analytics.compute('2024-02-01', '2024-03-31')
+    archive.archive(horizon_days=30, pause=0, today=date(2024, 5, 1))
+    assert [r.first_name for r in Resident.get_all()] == ['Rosa']
+    after = analytics.compute('2024-02-01', '2024-03-31')
+    assert after.occupancy == before.occupancy and after.services == before.services
+
+
+def test_analytics_report(stays, capsys):
+    ShelterReports.analytics_report('2024-03-01', '2024-03-16')
+    out = capsys.readouterr().out
+    assert "Peak: 2 on 2024-03-10" in out
+    assert "Median: 10" in out
+
+
+def test_occupancy_endpoint(stays):
+    client = app.test_client()
+    data = client.get('/analytics/occupancy?start=2024-03-01&end=2024-03-04').get_json()
+    assert data['occupancy'] == [1, 1, 0, 0]
+    assert data['length_of_stay']['buckets']['8-30 days'] == 1
+    assert client.get('/analytics/occupancy?start=2024-13-01').status_code == 400
+    assert client.get('/analytics/occupancy?start=0001-01-01&end=9999-12-31').status_code == 400
@@ -0,0 +1,167 @@
+# Test the Flask web application
+import gzip
+import threading
+import pytest
+import database
+from app import app, create_app
+from events import broker
+from models import Resident, Service, ServiceType, Stats
+
+
+@pytest.fixture
+def client(db):
+    app.config['TESTING'] = True
+    return app.test_client()
+
+
+def test_dashboard(client):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    response = client.get('/')
+    assert response.status_code == 200
+    assert b"Maria Garcia" in response.data
+
+
+def test_add_resident_rejects_duplicate(client):
+    client.post('/add_resident', data={'first_name': 'Maria', 'last_name': 'Garcia'})
+    client.post('/add_resident', data={'first_name': 'maria', 'last_name': 'GARCIA'})
+    assert len(Resident.get_all()) == 1
+
+
+def test_discharge_resident(client, monkeypatch):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    notified = []
+    monkeypatch.setattr(broker, 'notify', lambda: notified.append(True))
+    assert b'Discharge</button>' in client.get('/residents').data
+    response = client.post('/discharge_resident', data={'resident_id': '1'})
+    assert response.status_code == 302
+    assert Resident.get_all()[0][5] is not None and notified
+    assert b'Discharge</button>' not in client.get('/residents').data
+
+
+def test_residents_pagination(client):
+    for i in range(5):
+        Resident(f"First{i}", f"Last{i}", f"2024-01-0{i + 1}").save()
+    response = client.get('/residents?size=2')
+    assert b"First4" in response.data and b"First2" not in response.data
+    assert b"Older" in response.data
+
+    assert client.get('/residents?after=bad').status_code == 400
+
+
+def test_services_page_and_search(client):
+    resident = Resident("Maria", "Garcia", "2024-03-15")
+    resident.save()
+    Service.add(resident.id, "Counseling")
+    client.post('/log_service', data={'resident_id': '999', 'service_type': 'Meals'})
+
+    response = client.get('/services')
+    assert response.status_code == 200
+    assert b"<td>Counseling</td>" in response.data and b"<td>Meals</td>" not in response.data
+    assert b'<option value="Counseling">' in response.data  # Service type picker
+
+    found = client.get('/residents/search?q=mar').get_json()
+    assert found['results'] == [{'id': resident.id, 'first_name': 'Maria', 'last_name': 'Garcia',
+                                 'entry_date': '2024-03-15'}]
+    assert found['has_more'] is False
+
+
+def test_dashboard_is_cached_until_write(client):
+    client.get('/')
+    before = client.get('/cache_stats').get_json()
+    client.get('/')
+    after = client.get('/cache_stats').get_json()
+    assert after['hits'] == before['hits'] + 1
+
+    client.post('/add_resident', data={'first_name': 'Ana', 'last_name': 'Lopez'})
+    assert b"Ana Lopez" in client.get('/').data
+
+
+def test_pages_answer_conditional_requests(client):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    first = client.get('/residents')
+    etag, modified = first.headers['ETag'], first.headers['Last-Modified']
+    assert etag.startswith('W/"') and first.headers['Cache-Control'] == 'private, no-cache'
+
+    again = client.get('/residents', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b""
+    assert client.get('/residents', headers={'If-Modified-Since': modified}).status_code == 304
+
+    # A write from another connection, as from another server process
+    other = database.connect()
+    other.execute("INSERT INTO residents (first_name, last_name, entry_date) VALUES ('Ana', 'Lopez', 2460000)")
+    other.close()
+    changed = client.get('/residents', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and b"Ana" in changed.data
+    assert changed.headers['ETag'] != etag
+
+
+def test_large_pages_are_gzipped_and_rendered_once(client):
+    Resident.save_many([(f"First{i}", f"Last{i}", "2024-03-15") for i in range(20)])
+    response = client.get('/residents', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert b"First19" in gzip.decompress(response.data)
+    hits = client.get('/cache_stats').get_json()['hits']
+    plain = client.get('/residents')
+    assert 'Content-Encoding' not in plain.headers and b"First19" in plain.data
+    assert client.get('/cache_stats').get_json()['hits'] == hits + 1  # Served without rendering
+
+
+def test_log_service_for_several_residents(client):
+    Resident.save_many([("Maria", "Garcia", "2024-03-15"), ("Ana", "Lopez", "2024-03-16")])
+    response = client.post('/log_service_batch',
+                           data={'resident_id': ['1', '2', 'x'], 'service_type': 'Meals'})
+    assert response.status_code == 302
+    assert Stats.totals()['services'] == 2
+
+
+def test_new_service_type_is_added_by_the_writer(client, monkeypatch):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    threads = []
+    id_for = ServiceType.id_for
+    monkeypatch.setattr(ServiceType, 'id_for',
+                        lambda name: threads.append(threading.current_thread().name) or id_for(name))
+    client.post('/log_service', data={'resident_id': '1', 'service_type': 'Legal Aid'})
+    assert threads == ['shelter-writer']
+    assert Stats.totals()['services'] == 1
+
+
+def test_export_streams_download(client):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    response = client.get('/export/residents?format=jsonl&start=2024-03-01&gzip=1')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert 'residents_2024-03-01.jsonl.gz' in response.headers['Content-Disposition']
+    assert b'"Garcia"' in gzip.decompress(response.data)
+
+    assert client.get('/export/residents?start=bad').status_code == 400
+    assert client.get('/export/everything').status_code == 404
+
+
+def test_create_app_configures_the_database(db, tmp_path):
+    previous = (database.DB_PATH, database.BUSY_TIMEOUT_MS)
+    try:
+        other = create_app({'DATABASE': str(tmp_path / 'other.db'), 'PAGE_SIZE': 1, 'TESTING': True})
+        assert database.DB_PATH == str(tmp_path / 'other.db')
+        Resident.save_many([("Maria", "Garcia", "2024-03-15"), ("Ana", "Lopez", "2024-03-16")])
+        page = other.test_client().get('/residents').data
+        assert b"Ana" in page and b"Maria" not in page  # One row per page
+    finally:
+        database.configure(previous[0], busy_timeout_ms=previous[1])
+
+
+def test_writes_blocked_by_another_process_get_503(db, tmp_path):
+    previous = (database.DB_PATH, database.BUSY_TIMEOUT_MS)
+    try:
+        client = create_app({'DATABASE': str(tmp_path / 'busy.db'), 'BUSY_TIMEOUT_MS': 50,
+                             'TESTING': True}).test_client()
+        client.get('/')  # Migrates the new database
+        other = database.connect()
+        other.execute('BEGIN IMMEDIATE')  # Holds the write lock
+        response = client.post('/add_resident', data={'first_name': 'Maria', 'last_name': 'Garcia'})
+        assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+        other.execute('ROLLBACK')
+        other.close()
+        assert client.post('/add_resident', data={'first_name': 'Maria', 'last_name': 'Garcia'}).status_code == 302
+        assert len(Resident.get_all()) == 1
+    finally:
+        database.configure(previous[0], busy_timeout_ms=previous[1])
@@ -0,0 +1,94 @@
+# Test moving old rows to the archive database
+import os
+from datetime import date
+import pytest
+import archive
+import database
+from models import Resident, Service, Stats
+from reports import ShelterReports
+
+
+@pytest.fixture
+def history(db):
+    """Three residents, one discharged long ago, with services in 2023 and 2024"""
+    Resident.save_many([("Maria", "Garcia", "2023-01-10"), ("Ana", "Lopez", "2023-01-20"),
+                        ("Rosa", "Diaz", "2024-05-01")])
+    Service.add_many([
+        (1, "Meals", "2023-01-11"), (1, "Counseling", "2023-01-12"),
+        (2, "Meals", "2023-01-21"), (2, "Meals", "2024-05-02"),
+        (3, "Meals", "2024-05-03"),
+    ])
+    Resident.discharge(1, date(2023, 2, 1))
+    return db
+
+
+def test_discharge(db):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    assert Resident.discharge(1, "2024-04-01") == "Resident discharged"
+    assert Resident.get_all()[0][5] == date(2024, 4, 1)
+    assert Resident.discharge(42) == "Resident not found"
+    assert Resident.discharge(1, "2024-03-01") == "Discharge date is before entry date"
+    assert Resident.get_all()[0][5] == date(2024, 4, 1)
+
+
+def test_archive_moves_old_rows_in_batches(history):
+    before = ShelterReports.build_monthly_report("2023-01")
+    assert archive.archive(horizon_days=365, batch_size=1, pause=0, today=date(2024, 6, 1)) == (1, 3)
+    assert os.path.exists(archive.archive_path())
+
+    # Maria left with both her services; Ana stays but her 2023 service moved
+    assert [row[0] for row in Resident.get_all()] == [2, 3]
+    assert [row[0] for row in Service.page().rows] == [5, 4]
+    assert Stats.totals(include_archive=False)['services'] == 2
+    assert database.check_stats() == []
+    assert database.get_connection().execute('SELECT month FROM archived_months').fetchall() == [
+        ('2023-01',)]
+
+    # Reports for the archived month add the archive back in
+    after = ShelterReports.build_monthly_report("2023-01")
+    assert after.new_residents == before.new_residents == 2
+    assert sorted(after.services) == sorted(before.services) == [('Counseling', 1), ('Meals', 2)]
+    assert after.top_residents == before.top_residents
+    assert ShelterReports.build_monthly_report("2024-05").services == [('Meals', 2)]
+
+    assert archive.archive(horizon_days=365, pause=0, today=date(2024, 6, 1)) == (0, 0)
+
+
+def test_no_batch_moves_more_services_than_its_size(history):
+    archive.attach(create=True)
+    cutoff = database.day_number(date(2023, 6, 1))
+    # Maria's two services go one at a time, then she follows with the last
+    batches = [archive.archive_batch(cutoff, batch_size=1) for _ in range(4)]
+    assert batches == [(0, 1), (1, 1), (0, 1), (0, 0)]
+
+
+def test_totals_and_system_report_include_the_archive(history):
+    before = ShelterReports.build_system_report()
+    totals = Stats.totals()
+    archive.archive(horizon_days=365, pause=0, today=date(2024, 6, 1))
+    assert Stats.totals() == totals == {'residents': 3, 'services': 5, 'service_types': 2,
+                                        'active_months': 2}
+    after = ShelterReports.build_system_report()
+    # Archived services count from the rollups; unique residents are of live rows
+    assert before.service_breakdown == [("Meals", 4, 3), ("Counseling", 1, 1)]
+    assert after.service_breakdown == [("Meals", 4, 2), ("Counseling", 1, 0)]
+    assert (after._replace(generated=None, service_breakdown=None)
+            == before._replace(generated=None, service_breakdown=None))
+
+
+def test_archived_months_read_from_read_only_connections(history):
+    archive.archive(horizon_days=365, pause=0, today=date(2024, 6, 1))
+    path = database.DB_PATH
+    database.configure(path, readonly=True)
+    try:
+        assert ShelterReports.build_monthly_report("2023-01").new_residents == 2
+    finally:
+        database.configure(path)
+
+
+def test_archived_month_without_archive_file_is_an_error(history):
+    archive.archive(horizon_days=365, pause=0, today=date(2024, 6, 1))
+    database.close_connection()
+    os.remove(archive.archive_path())
+    with pytest.raises(FileNotFoundError):
+        ShelterReports.build_monthly_report("2023-01")
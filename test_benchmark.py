@@ -0,0 +1,26 @@
+# Test the benchmark harness
+import benchmark
+import seed_data
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 50) == 50
+    assert benchmark.percentile(values, 99) == 99
+    assert benchmark.percentile([5], 95) == 5
+
+
+def test_every_case_runs(db):
+    seed_data.seed(100, 1000, end=benchmark.END)
+    for name, run in benchmark.cases(benchmark.app.test_client()).items():
+        result = benchmark.measure(run, runs=2)
+        assert result['runs'] == 2, name
+        assert result['p50_ms'] <= result['p99_ms']
+
+
+def test_compare_flags_regressions(capsys):
+    def results(commit, p50):
+        return {'commit': commit, 'scales': {'small': {'cases': {
+            'GET /': {'p50_ms': p50, 'p95_ms': p50 * 2}}}}}
+    assert benchmark.compare(results('a', 1.0), results('b', 1.1)) == []
+    assert benchmark.compare(results('a', 1.0), results('b', 2.0)) == [('small', 'GET /', 2.0)]
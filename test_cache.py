@@ -0,0 +1,46 @@
+# Test the query result cache
+import sqlite3
+import database
+from cache import QueryCache
+from models import Resident, Stats
+
+
+def test_hits_until_database_changes(db):
+    cache = QueryCache()
+    count = lambda: cache.get_or_compute('residents', lambda: Stats.totals()['residents'])
+
+    assert count() == 0
+    assert count() == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    assert count() == 1
+    assert cache.misses == 2
+
+
+def test_invalidated_by_other_connections(db):
+    cache = QueryCache()
+    count = lambda: cache.get_or_compute('residents', lambda: Stats.totals()['residents'])
+    assert count() == 0
+
+    other = sqlite3.connect(database.DB_PATH)
+    other.execute("INSERT INTO residents (first_name, last_name, entry_date) VALUES ('Ana', 'Lopez', ?)",
+                  (database.day_number('2024-03-15'),))
+    other.commit()
+    other.close()
+    assert count() == 1
+
+
+def test_lru_eviction_and_memory_cap(db):
+    cache = QueryCache(max_entries=2)
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get_or_compute(key, lambda: key)
+    stats = cache.stats()
+    assert (stats['entries'], stats['evictions']) == (2, 1)
+    assert cache.get_or_compute('a', lambda: 'recomputed') == 'a'  # 'b' was least recent
+
+    small = QueryCache(max_bytes=1000)
+    small.get_or_compute('big', lambda: 'x' * 5000)
+    small.get_or_compute('small', lambda: 'y')
+    assert small.stats()['entries'] == 1
+    assert small.stats()['bytes'] <= 1000
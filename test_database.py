@@ -0,0 +1,136 @@
+# Test the shared database access layer
+import threading
+from datetime import date
+import pytest
+import database
+
+
+def test_connection_reused_per_thread(db):
+    assert database.get_connection() is database.get_connection()
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(database.get_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not database.get_connection()
+
+
+def test_pragmas_applied(db):
+    assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert db.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+
+
+def test_transaction_commits(db):
+    with database.transaction() as conn:
+        conn.execute("INSERT INTO residents (first_name, last_name, entry_date) VALUES ('A', 'B', ?)", (date(2024, 1, 1),))
+    assert db.execute('SELECT COUNT(*) FROM residents').fetchone()[0] == 1
+
+
+def test_transaction_rolls_back_on_error(db):
+    with pytest.raises(RuntimeError):
+        with database.transaction() as conn:
+            conn.execute("INSERT INTO residents (first_name, last_name, entry_date) VALUES ('A', 'B', ?)", (date(2024, 1, 1),))
+            raise RuntimeError("boom")
+    assert db.execute('SELECT COUNT(*) FROM residents').fetchone()[0] == 0
+    assert not db.in_transaction
+
+
+def test_configure_switches_database(db, tmp_path):
+    database.configure(str(tmp_path / 'other.db'))
+    assert database.get_connection() is not db
+
+
+def test_migrations_record_schema_version(db):
+    assert db.execute('PRAGMA user_version').fetchone()[0] == database.SCHEMA_VERSION
+    assert database.migrate() == 0
+
+
+def test_migrate_upgrades_legacy_database(tmp_path, monkeypatch):
+    import sqlite3
+    import models
+    # Migrations keep their own copy of the name normalization they were written with
+    monkeypatch.setattr(models, 'normalize_name', lambda name: 'changed')
+    monkeypatch.setattr(models, 'name_key', lambda first_name, last_name: 'changed')
+    path = str(tmp_path / 'legacy.db')
+    legacy = sqlite3.connect(path)
+    legacy.execute('CREATE TABLE residents (id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT NOT NULL, last_name TEXT NOT NULL, entry_date TEXT NOT NULL)')
+    legacy.execute('CREATE TABLE services (id INTEGER PRIMARY KEY AUTOINCREMENT, resident_id INTEGER NOT NULL, service_type TEXT NOT NULL, service_date TEXT NOT NULL)')
+    legacy.execute("INSERT INTO residents (first_name, last_name, entry_date) VALUES ('Maria', 'Garcia', '2024-03-15')")
+    legacy.executemany("INSERT INTO services (resident_id, service_type, service_date) VALUES (1, ?, '2024-03-16')",
+                       [('Counseling',), ('counseling ',), ('Counseling',), ('Meals',)])
+    legacy.commit()
+    legacy.close()
+
+    previous = database.DB_PATH
+    database.configure(path)
+    try:
+        conn = database.get_connection()
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == database.SCHEMA_VERSION
+        assert conn.execute(
+            'SELECT t.name FROM services s JOIN service_types t ON t.id = s.service_type_id'
+        ).fetchone()[0] == 'Counseling'
+        # Spelling variants were merged into one type
+        from models import Stats
+        assert Stats.service_type_counts() == [('Counseling', 3), ('Meals', 1)]
+        assert Stats.totals()['service_types'] == 2
+        assert database.check_stats() == []
+        # Text dates became day numbers that read back as dates
+        assert conn.execute('SELECT typeof(entry_date), entry_date FROM residents').fetchone() == (
+            'integer', date(2024, 3, 15))
+        assert conn.execute(
+            "SELECT strftime('%Y-%m-%d', service_date), service_time FROM services"
+        ).fetchone() == ('2024-03-16', None)
+        assert conn.execute('SELECT month FROM monthly_new_residents').fetchall() == [('2024-03',)]
+        assert conn.execute('SELECT name_key FROM residents').fetchone()[0] == 'maria|garcia'
+        assert conn.execute('SELECT key FROM service_types ORDER BY id').fetchall() == [
+            ('counseling',), ('meals',)]
+        with pytest.raises(sqlite3.IntegrityError):
+            with database.transaction() as tx:
+                tx.execute("INSERT INTO services (resident_id, service_type_id, service_date) VALUES (99, 1, ?)",
+                           (date(2024, 3, 16),))
+    finally:
+        database.configure(previous)
+
+
+def test_dates_are_stored_as_day_numbers(db):
+    assert database.day_number('2024-03-15') == database.day_number(date(2024, 3, 15))
+    assert database.from_day_number(database.day_number('2024-03-15')) == date(2024, 3, 15)
+    assert db.execute("SELECT date(?)", (date(2024, 3, 15),)).fetchone()[0] == '2024-03-15'
+    import sqlite3
+    with pytest.raises(sqlite3.IntegrityError):
+        with database.transaction() as conn:
+            conn.execute("INSERT INTO residents (first_name, last_name, entry_date) VALUES ('A', 'B', '2024-03-15')")
+    with pytest.raises(ValueError):
+        database.day_number('15/03/2024')
+
+
+def test_stats_follow_inserts_updates_and_deletes(db):
+    from models import Resident, Service, Stats
+    for first in ("Maria", "Ana"):
+        Resident(first, "Garcia", "2024-03-15").save()
+    Service.add(1, "Meals")
+    Service.add(1, "Meals")
+    Service.add(2, "Counseling")
+    assert Stats.totals() == {'residents': 2, 'services': 3, 'service_types': 2, 'active_months': 1}
+
+    with database.transaction() as conn:
+        conn.execute("UPDATE services SET service_date = ? WHERE id = 3", (date(2020, 1, 1),))
+        conn.execute("DELETE FROM services WHERE id IN (1, 2)")
+        conn.execute("DELETE FROM residents WHERE id = 1")
+    assert Stats.totals() == {'residents': 1, 'services': 1, 'service_types': 1, 'active_months': 1}
+    assert Stats.service_type_counts() == [('Counseling', 1)]
+    assert database.check_stats() == []
+
+
+def test_check_stats_repairs_drift(db):
+    from models import Resident, Stats
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    with database.transaction() as conn:
+        conn.execute("UPDATE stats SET value = 40 WHERE name = 'residents'")
+        conn.execute("INSERT INTO service_type_counts VALUES (99, 3)")
+
+    drift = database.check_stats(repair=True)
+    assert ('stats', 'residents', 40, 1) in drift
+    assert ('service_type_counts', '99', 3, None) in drift
+    assert database.check_stats() == []
+    assert Stats.totals()['residents'] == 1
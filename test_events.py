@@ -0,0 +1,76 @@
+# Test the live dashboard event stream
+import json
+from datetime import date
+import pytest
+import database
+import events
+from app import app
+from events import RESET, EventBroker, Subscriber
+from models import Resident, Service
+
+
+@pytest.fixture
+def broker(db):
+    broker = EventBroker(poll_seconds=60)
+    yield broker
+    broker.close()
+
+
+def parse(message):
+    fields = dict(line.split(': ', 1) for line in message.strip().split('\n'))
+    return fields['event'], json.loads(fields['data'])
+
+
+def test_changes_reach_every_subscriber_once(broker):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    first, second = broker.subscribe(), broker.subscribe()
+    assert broker.poll() == []  # Nothing new yet
+
+    Resident("Ana", "Lopez", "2024-03-16").save()
+    Service.add_many([(2, "Meals", date(2024, 3, 17))])
+    messages = broker.poll()
+    assert [parse(message) for message in messages] == [
+        ('resident', {'id': 2, 'first_name': 'Ana', 'last_name': 'Lopez', 'entry_date': '2024-03-16'}),
+        ('service', {'id': 1, 'first_name': 'Ana', 'last_name': 'Lopez', 'service_type': 'Meals',
+                     'service_date': '2024-03-17', 'service_time': None}),
+        ('stats', {'total_residents': 2, 'total_services': 1}),
+    ]
+    # The same encoded messages are handed to both streams
+    assert [first.get(0) for _ in messages] == [second.get(0) for _ in messages] == messages
+    assert first.get(0) is None
+    assert broker.poll() == []
+
+
+def test_out_of_date_or_shrinking_dashboards_reload(broker):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    current = broker.subscribe()
+    assert broker.subscribe(since=broker.count).get(0) is None
+    assert broker.subscribe(since=broker.count - 1).get(0) is RESET
+
+    with database.transaction() as conn:
+        conn.execute('DELETE FROM residents')
+    assert broker.poll() == [RESET]
+    assert current.get(0) is RESET
+
+
+def test_slow_subscriber_is_told_to_reload():
+    subscriber = Subscriber(max_pending=2)
+    for message in ('a', 'b', 'c'):
+        subscriber.put(message)
+    assert subscriber.get(0) is RESET and subscriber.get(0) is None
+
+
+def test_events_endpoint_streams_writes(db):
+    client = app.test_client()
+    client.get('/')
+    response = client.get('/events', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    stream = iter(response.response)
+    assert next(stream) == b'retry: 3000\n\n'
+
+    client.post('/add_resident', data={'first_name': 'Maria', 'last_name': 'Garcia'})
+    chunks = [next(stream).decode() for _ in range(2)]
+    response.close()
+    assert parse(chunks[0])[1]['first_name'] == 'Maria'
+    assert parse(chunks[1]) == ('stats', {'total_residents': 1, 'total_services': 0})
+    assert not events.broker._subscribers
@@ -0,0 +1,76 @@
+# Test streaming exports
+import csv
+import gzip
+import io
+import json
+from datetime import date
+import pytest
+import archive
+import exporter
+from models import Resident, Service
+
+
+@pytest.fixture
+def records(db):
+    for i, entry_date in enumerate(["2024-01-15", "2024-02-10", "2024-03-05"]):
+        Resident(f"First{i}", f"Last{i}", entry_date).save()
+    Service.add_many([(1, "Meals", "2024-01-20"), (2, "Counseling", "2024-02-11"),
+                      (2, "Meals", "2024-03-01"), (3, "Meals", "2024-03-06")])
+
+
+def read(kind, fmt='csv', **options):
+    return b''.join(exporter.export(kind, fmt, **options))
+
+
+def test_csv_export_filters_date_range(records):
+    rows = list(csv.reader(io.StringIO(read('services', start='2024-02-01', end='2024-03-01').decode())))
+    assert rows[0] == ['id', 'resident_id', 'first_name', 'last_name', 'service_type', 'service_date',
+                       'service_time']
+    assert [row[5] for row in rows[1:]] == ['2024-02-11', '2024-03-01']
+    assert [row[6] for row in rows[1:]] == ['', '']  # Back-filled logs have no time
+
+
+def test_jsonl_export_in_small_batches(records):
+    lines = read('residents', 'jsonl', batch_size=2).decode().splitlines()
+    assert [json.loads(line)['first_name'] for line in lines] == ['First0', 'First1', 'First2']
+    assert json.loads(lines[0])['entry_date'] == '2024-01-15'
+
+
+def test_gzip_export_and_empty_range(records):
+    data = gzip.decompress(read('residents', compress=True, start='2025-01-01'))
+    assert data == b'id,first_name,last_name,entry_date\r\n'
+
+
+def test_monthly_summary_export(records):
+    # Bounds select whole months
+    lines = read('monthly_services', 'jsonl', start='2024-02-20', end='2024-03-05').decode().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'month': '2024-02', 'service_type': 'Counseling', 'services': 1},
+        {'month': '2024-03', 'service_type': 'Meals', 'services': 2}]
+
+
+def test_monthly_export_skips_emptied_months(records, db):
+    # Deleting rows leaves their rollups at zero, which the reports skip too
+    db.execute('DELETE FROM services WHERE id = 2 OR resident_id = 3')
+    db.execute('DELETE FROM residents WHERE id = 3')
+    assert 'Counseling' not in read('monthly_services').decode()
+    assert read('monthly_residents').decode().splitlines()[1:] == ['2024-01,1', '2024-02,1']
+
+
+def test_export_rejects_bad_arguments(db):
+    with pytest.raises(ValueError):
+        exporter.export('residents', start='March')
+    with pytest.raises(ValueError):
+        exporter.export('residents', 'xml')
+
+
+def test_archived_rows_are_exported(records):
+    before = {kind: read(kind) for kind in exporter.EXPORTS}
+    Resident.discharge(1, date(2024, 1, 31))
+    archive.archive(horizon_days=30, pause=0, today=date(2024, 4, 1))
+    assert [r.first_name for r in Resident.get_all()] == ['First1', 'First2']
+    assert {kind: read(kind) for kind in exporter.EXPORTS} == before
+    assert read('services', end='2024-01-31').decode().splitlines()[1:] == [
+        '1,1,First0,Last0,Meals,2024-01-20,']
+    # Ranges with nothing archived read the live tables alone
+    assert read('monthly_residents', start='2024-02-01') == b'month,new_residents\r\n2024-02,1\r\n2024-03,1\r\n'
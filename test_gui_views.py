@@ -0,0 +1,35 @@
+# Test the row sources behind the GUI's virtualized lists
+from datetime import date
+import archive
+from gui_views import ListSource, ModelSource
+from models import Resident
+
+
+def test_model_source_walks_the_same_rows_as_pages(db):
+    for i in range(12):
+        Resident(f"First{i}", f"Last{i}", f"2024-01-{i + 1:02d}").save()
+    source = ModelSource(Resident, 'residents')
+    assert source.count() == 12
+
+    first = source.at(0, 5)
+    assert [row[0] for row in first] == [12, 11, 10, 9, 8]
+    assert [row[0] for row in source.after(first[-1], 4)] == [7, 6, 5, 4]
+    assert [row[0] for row in source.before(source.at(6, 1)[0], 3)] == [9, 8, 7]
+    assert source.after(source.at(11, 1)[0], 5) == []
+
+
+def test_model_source_counts_only_listed_rows(db):
+    Resident.save_many([(f"First{i}", f"Last{i}", "2023-01-01") for i in range(10)])
+    for resident_id in range(1, 6):
+        Resident.discharge(resident_id, date(2023, 2, 1))
+    archive.archive(horizon_days=365, pause=0, today=date(2024, 6, 1))
+    source = ModelSource(Resident, 'residents')
+    assert source.count() == len(source.at(0, 20)) == 5
+
+
+def test_list_source_pages_in_memory_rows():
+    source = ListSource([(i, f"Name{i}") for i in range(10)])
+    assert source.count() == 10
+    assert [row[0] for row in source.at(8, 5)] == [8, 9]
+    assert [row[0] for row in source.after((3,), 2)] == [4, 5]
+    assert [row[0] for row in source.before((3,), 5)] == [0, 1, 2]
@@ -0,0 +1,81 @@
+# Test the GUI background worker without a display
+import threading
+import time
+from gui_worker import BackgroundWorker
+
+
+class FakeWidget:
+    """Stands in for a Tk widget: records after() callbacks"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, func, *args):
+        self.scheduled.append((func, args))
+
+    def pump(self, until, timeout=5):
+        deadline = time.time() + timeout
+        while not until() and time.time() < deadline:
+            func, args = self.scheduled.pop(0)
+            func(*args)
+            time.sleep(0.005)
+
+
+def test_results_delivered_on_poll(db):
+    widget = FakeWidget()
+    worker = BackgroundWorker(widget)
+    results, errors = [], []
+    worker.submit(lambda: 42, on_done=results.append)
+    worker.submit(lambda: 1 / 0, on_done=results.append, on_error=errors.append)
+    widget.pump(lambda: results and errors)
+    worker.shutdown()
+    assert results == [42]
+    assert isinstance(errors[0], ZeroDivisionError)
+
+
+def test_newer_job_on_channel_supersedes_older(db):
+    widget = FakeWidget()
+    worker = BackgroundWorker(widget, workers=2)
+    release = threading.Event()
+    results = []
+    worker.submit(lambda: release.wait(5) and "old", channel="list", on_done=results.append)
+    worker.submit(lambda: "new", channel="list", on_done=results.append)
+    widget.pump(lambda: results)
+    release.set()
+    time.sleep(0.05)
+    widget.pump(lambda: False, timeout=0.1)
+    worker.shutdown()
+    assert results == ["new"]
+
+
+def test_progress_reports_running_jobs(db):
+    widget = FakeWidget()
+    progress = []
+    worker = BackgroundWorker(widget, on_progress=progress.append)
+    release = threading.Event()
+    worker.submit(release.wait, 5, description="Loading")
+    widget.pump(lambda: progress and progress[-1])
+    assert progress[-1][0][0] == "Loading"
+    release.set()
+    widget.pump(lambda: progress[-1] == [])
+    worker.shutdown()
+
+
+def test_stale_query_is_interrupted(db):
+    from database import get_connection
+    widget = FakeWidget()
+    worker = BackgroundWorker(widget, workers=1)
+    endless = lambda: get_connection().execute(
+        'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c'
+    ).fetchone()
+    results = []
+    worker.submit(endless, channel="list", on_done=results.append)
+    deadline = time.time() + 5
+    while not worker._running and time.time() < deadline:
+        time.sleep(0.01)
+
+    # Only one worker thread: the new search can run only if the old query stops
+    worker.submit(lambda: "new", channel="list", on_done=results.append)
+    widget.pump(lambda: results)
+    worker.shutdown()
+    assert results == ["new"]
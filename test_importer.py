@@ -0,0 +1,56 @@
+# Test the bulk import pipeline
+import json
+import pytest
+import importer
+from models import Resident
+
+
+def write_csv(path, lines):
+    path.write_text("first_name,last_name,entry_date\n" + "\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_import_residents_dedupes_and_validates(db, tmp_path):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    path = write_csv(tmp_path / 'residents.csv', [
+        "María,garcia,2024-03-16",   # existing resident
+        "Ana,Lopez,2024-03-17",
+        "ana,LOPEZ,2024-03-17",      # repeated in the file
+        "Rosa,,2024-03-18",          # missing last name
+        "Eva,Diaz,not-a-date",
+    ])
+    read, inserted, invalid = importer.import_file(path, 'residents')
+    assert (read, inserted, invalid) == (5, 1, 2)
+    assert sorted(r[1] for r in Resident.get_all()) == ["Ana", "Maria"]
+
+
+def test_import_services_by_id_or_name(db, tmp_path):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    path = tmp_path / 'services.jsonl'
+    path.write_text("\n".join(json.dumps(r) for r in [
+        {'resident_id': 1, 'service_type': 'Meals', 'service_date': '2024-03-16'},
+        {'first_name': 'MARIA', 'last_name': 'Garcia', 'service_type': 'Counseling', 'service_date': '2024-03-17'},
+        {'resident_id': 7, 'service_type': 'Meals', 'service_date': '2024-03-16'},
+    ]))
+    assert importer.import_file(str(path), 'services') == (3, 2, 1)
+
+
+def test_import_resumes_after_failure(db, tmp_path, monkeypatch):
+    path = write_csv(tmp_path / 'residents.csv', [f"First{i},Last{i},2024-01-01" for i in range(5)])
+    calls = []
+
+    def failing_insert(rows):
+        calls.append(rows)
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        return Resident.save_many(rows)
+
+    monkeypatch.setitem(importer.IMPORTERS, 'residents', (importer.resident_batch, failing_insert))
+    with pytest.raises(RuntimeError):
+        importer.import_file(path, 'residents', batch_size=2)
+    assert len(Resident.get_all()) == 2
+
+    monkeypatch.undo()
+    assert importer.import_file(path, 'residents', batch_size=2) == (3, 3, 0)
+    assert len(Resident.get_all()) == 5
+    assert importer.import_file(path, 'residents', batch_size=2) == (0, 0, 0)
@@ -0,0 +1,83 @@
+# Test query tracing and the Prometheus metrics
+import pytest
+import metrics
+from app import app
+from models import Resident, Service
+
+
+@pytest.fixture
+def registry(db):
+    metrics.registry.reset()
+    yield metrics.registry
+    metrics.registry.slow_seconds = metrics.SLOW_QUERY_SECONDS
+
+
+def stats_for(registry, fragment):
+    matches = [stats for sql, stats in registry.statements.items() if fragment in sql]
+    assert len(matches) == 1, fragment
+    return matches[0]
+
+
+def test_statements_are_timed_with_their_rows(registry, db):
+    Resident.save_many([("Maria", "Garcia", "2024-03-15"), ("Ana", "Lopez", "2024-03-16")])
+    Service.add(1, "Meals")
+
+    db.execute('SELECT id FROM residents ORDER BY id').fetchall()
+    db.execute('SELECT id FROM residents ORDER BY id').fetchone()  # Recorded once released
+    list(db.execute('SELECT id FROM residents ORDER BY id'))
+    stats = stats_for(registry, 'SELECT id FROM residents ORDER BY id')
+    assert stats.latency.count == 3
+    assert stats.rows == 2 + 1 + 2
+
+    # Writes count the rows they change and the trigger programs they set off
+    inserts = stats_for(registry, 'INSERT INTO residents')
+    assert inserts.rows == 2
+    assert stats_for(registry, 'INSERT INTO services').trace_events > 1
+
+
+def test_slow_statements_are_logged_with_their_plan(registry, db):
+    registry.slow_seconds = 0
+    db.execute('SELECT * FROM residents WHERE name_key = ?', ('maria|garcia',)).fetchall()
+    slow = registry.slow_queries()[0]
+    assert slow['statement'] == 'SELECT * FROM residents WHERE name_key = ?'
+    assert any('idx_residents_name_key' in step for step in slow['plan'])
+
+
+def test_lock_waits_and_writes_are_not_explained(registry, db):
+    registry.slow_seconds = 0
+    registry.reset()
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    slow = registry.slow_queries()
+    assert slow and all(not entry['statement'].startswith(('BEGIN', 'COMMIT')) for entry in slow)
+    inserts = [entry for entry in slow if entry['statement'].startswith('INSERT')]
+    assert inserts and all(entry['plan'] == [] for entry in inserts)
+
+
+def test_iteration_is_timed_per_batch(registry, db):
+    Resident.save_many([(f"R{i}", "Garcia", "2024-03-15") for i in range(metrics.ITER_BATCH + 10)])
+    cursor = db.execute('SELECT id FROM residents ORDER BY id')
+    assert next(cursor) == (1,)
+    assert cursor.fetchone() == (2,)  # Read ahead by the first batch
+    assert len(cursor.fetchmany(5)) == 5 and len(list(cursor)) == metrics.ITER_BATCH + 3
+    stats = stats_for(registry, 'SELECT id FROM residents ORDER BY id')
+    assert (stats.latency.count, stats.rows) == (1, metrics.ITER_BATCH + 10)
+
+
+def test_metrics_endpoint(registry):
+    client = app.test_client()
+    client.get('/residents')
+    client.get('/export/nothing')
+    text = client.get('/metrics').data.decode()
+    assert 'shelter_http_request_seconds_count{method="GET",route="/residents"} 1' in text
+    assert 'shelter_http_responses_total{method="GET",route="/export/<kind>",status="404"} 1' in text
+    assert 'shelter_sql_seconds_bucket{id="' in text
+    assert 'le="+Inf"' in text
+    assert client.get('/slow_queries').get_json() == []
+
+
+def test_labels_are_escaped():
+    histogram = metrics.Histogram()
+    histogram.observe(0.002)
+    lines = list(histogram.lines('x', metrics._statement('SELECT "a\\b"')))
+    assert 'statement="SELECT \\"a\\\\b\\""' in lines[0]
+    assert lines[2].endswith(' 1') and lines[1].endswith(' 0')  # le=0.001 empty, le=0.0025 has it
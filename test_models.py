@@ -0,0 +1,213 @@
+# Test the Resident and Service models
+import re
+import threading
+from contextlib import contextmanager
+from datetime import date
+import metrics
+from database import day_number
+from models import Resident, ResidentRecord, Service, ServiceRecord, ServiceType, Stats, name_key
+
+
+@contextmanager
+def statements_run(db):
+    """Collect the statements SQLite runs, then put back the metrics tracer"""
+    statements = []
+    db.set_trace_callback(statements.append)
+    try:
+        yield statements
+    finally:
+        db.set_trace_callback(metrics.registry.trace if metrics.ENABLED else None)
+
+
+def test_name_key_ignores_case_accents_and_spacing():
+    assert name_key(" María ", "GARCIA") == name_key("maria", "garcia")
+    assert name_key("Mary  Ann", "Smith") == name_key("mary ann", "smith")
+    assert name_key("Mary", "Ann Smith") != name_key("Mary Ann", "Smith")
+
+
+def test_save_rejects_duplicate(db):
+    first = Resident("Maria", "Garcia", "2024-03-15")
+    assert first.save() == "Resident saved"
+    assert first.id is not None
+
+    again = Resident("MARÍA", " garcia", "2024-03-16")
+    assert again.save() == "Duplicate resident"
+    assert again.id is None
+    assert Resident.check_duplicate("maria", "garcia")
+    assert not Resident.check_duplicate("John", "Doe")
+    assert len(Resident.get_all()) == 1
+
+
+def test_concurrent_saves_insert_once(db):
+    results = []
+
+    def save():
+        results.append(Resident("Ana", "Lopez", "2024-03-15").save())
+
+    threads = [threading.Thread(target=save) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count("Resident saved") == 1
+    assert len(Resident.get_all()) == 1
+
+
+def test_service_add(db):
+    resident = Resident("Maria", "Garcia", "2024-03-15")
+    resident.save()
+    assert Service.add(resident.id, "Counseling") == "Service logged"
+    service_id, _, _, service_type, service_date, service_time = Service.page().rows[0]
+    assert (service_type, service_date) == ("Counseling", date.today())
+    assert re.fullmatch(r"\d\d:\d\d:\d\d", service_time)
+
+
+def add_residents(count):
+    for i in range(count):
+        Resident(f"First{i}", f"Last{i}", f"2024-01-{i % 28 + 1:02d}").save()
+
+
+def test_resident_pages_walk_forward_and_back(db):
+    add_residents(25)
+    seen = []
+    page = Resident.page(limit=10)
+    assert page.newer is None
+    pages = [page]
+    while page.older:
+        page = Resident.page(after=page.older, limit=10)
+        pages.append(page)
+    for page in pages:
+        seen.extend(row[0] for row in page.rows)
+
+    expected = [row[0] for row in sorted(Resident.get_all(), key=lambda r: (r[3], r[0]), reverse=True)]
+    assert seen == expected
+    assert [len(page.rows) for page in pages] == [10, 10, 5]
+
+    back = Resident.page(before=pages[2].newer, limit=10)
+    assert [row[0] for row in back.rows] == [row[0] for row in pages[1].rows]
+    assert back.newer is not None
+
+
+def test_service_page(db):
+    add_residents(3)
+    for resident_id in (1, 2, 3):
+        Service.add(resident_id, "Meals")
+    page = Service.page(limit=2)
+    assert [row[0] for row in page.rows] == [3, 2]
+    assert [row[0] for row in Service.page(after=page.older, limit=2).rows] == [1]
+    assert page.older == f"{day_number(date.today())}~2"
+
+
+def test_page_at_matches_keyset_pages(db):
+    add_residents(25)
+    newest_first = [row[0] for row in sorted(Resident.get_all(), key=lambda r: (r[3], r[0]), reverse=True)]
+    assert [row[0] for row in Resident.page_at(7, limit=5).rows] == newest_first[7:12]
+    assert Resident.page_at(25).rows == []
+
+    jumped = Resident.page_at(20, limit=10)
+    assert [row[0] for row in jumped.rows] == newest_first[20:]
+    assert jumped.older is None
+    assert [row[0] for row in Resident.page(before=jumped.newer, limit=3).rows] == newest_first[17:20]
+
+    for resident_id in (1, 2, 3):
+        Service.add(resident_id, "Meals")
+    assert [row[0] for row in Service.page_at(1).rows] == [2, 1]
+    next_page = Service.page(after=Service.cursor(Service.page_at(0, limit=1).rows[0]))
+    assert [row[0] for row in next_page.rows] == [2, 1]
+
+
+def test_search_matches_word_prefixes_by_rank(db):
+    Resident("María", "Garcia", "2024-03-15").save()
+    Resident("Mary Ann", "Smith", "2024-03-15").save()
+    Resident("Ana", "Marsh", "2024-03-15").save()
+
+    rows, has_more = Resident.search("mar")
+    assert sorted(r[1] for r in rows) == ["Ana", "Mary Ann", "María"]
+    assert not has_more
+    assert [r[2] for r in Resident.search("maria gar")[0]] == ["Garcia"]
+    assert [r[2] for r in Resident.search("SMI ann")[0]] == ["Smith"]
+    assert Resident.search("  \"*")[0] == []
+
+    first, has_more = Resident.search("mar", limit=2)
+    rest, _ = Resident.search("mar", limit=2, offset=2)
+    assert has_more and len(first) == 2 and len(rest) == 1
+
+
+def test_search_index_follows_renames(db):
+    import database
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    with database.transaction() as conn:
+        conn.execute("UPDATE residents SET last_name = 'Lopez' WHERE id = 1")
+    assert Resident.search("garcia")[0] == []
+    assert [r[2] for r in Resident.search("lop")[0]] == ["Lopez"]
+
+
+def test_log_service_for_many_residents(db):
+    add_residents(3)
+    assert Service.log_for_residents([1, 3, 3, 42], "Meals", "2024-03-16") == 2
+    assert [(row[1], row[3]) for row in Service.page().rows] == [("First2", "Meals"), ("First0", "Meals")]
+
+
+def test_service_type_ids_follow_a_restored_file(db, tmp_path):
+    import shutil
+    import database
+    live = database.DB_PATH
+    backup = str(tmp_path / 'backup.db')
+    database.configure(backup)
+    assert ServiceType.id_for("Meals") == 1
+    database.configure(live)
+    ServiceType.id_for("Counseling")
+    assert ServiceType.id_for("Meals") == 2
+
+    # The backup is copied over the live file while the process runs
+    database.close_connection()
+    shutil.copy(backup, live)
+    assert ServiceType.id_for("Meals") == 1
+
+
+def test_rows_are_records_and_stream_in_batches(db):
+    add_residents(7)
+    Service.add_many([(1, "Meals", "2024-03-16"), (7, "Counseling", "2024-03-17")])
+
+    resident = Resident.get_all()[0]
+    assert isinstance(resident, ResidentRecord)
+    assert (resident.first_name, resident.entry_date) == ("First0", date(2024, 1, 1))
+    assert resident[1] == resident.first_name  # Still a tuple
+
+    with statements_run(db) as statements:
+        residents = Resident.iter_all(batch_size=3)
+        assert statements == []  # Nothing is read until the first row is wanted
+        streamed = list(residents)
+    assert len(statements) == 3  # Batches of 3, 3 and 1
+    assert streamed == Resident.get_all()
+
+    services = list(Service.iter_services(batch_size=1))
+    assert all(isinstance(row, ServiceRecord) for row in services)
+    assert [(row.id, row.first_name, row.service_type, row.service_date) for row in services] == [
+        (1, "First0", "Meals", date(2024, 3, 16)), (2, "First6", "Counseling", date(2024, 3, 17))]
+    assert isinstance(Service.page().rows[0], ServiceRecord)
+
+
+
+def test_service_types_are_canonical_and_interned(db):
+    import database
+    counseling = ServiceType.id_for("Counseling")
+    assert ServiceType.id_for("  counseling ") == counseling
+    assert ServiceType.id_for("Meals") != counseling
+
+    with statements_run(db) as statements:
+        ServiceType.id_for("COUNSELING")
+    assert statements == []  # Served from the in-process cache
+
+    # A type added in a transaction that rolls back is not remembered
+    try:
+        with database.transaction():
+            ServiceType.id_for("Laundry")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    Service.add_many([(1, "Laundry", "2024-03-16")])
+    assert Stats.service_type_counts() == [("Laundry", 1)]
+    assert [name for _, name in ServiceType.all()][0] == "Laundry"
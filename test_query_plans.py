@@ -0,0 +1,139 @@
+# Test that the hot queries are answered from indexes (EXPLAIN QUERY PLAN)
+import re
+from datetime import date
+import pytest
+
+# Queries that filter, join or sort. None of them may scan a table
+# row by row or sort their rows through a temporary b-tree.
+HOT_QUERIES = {
+    'recent residents': (
+        'SELECT * FROM residents ORDER BY entry_date DESC, id DESC LIMIT 6', ()),
+    'recent services': ('''
+        SELECT s.id, r.first_name, r.last_name, t.name, s.service_date, time(s.service_time, 'unixepoch')
+        FROM services s
+        JOIN residents r ON s.resident_id = r.id
+        JOIN service_types t ON t.id = s.service_type_id
+        ORDER BY s.service_date DESC, s.id DESC LIMIT 6
+    ''', ()),
+    'resident dropdown': (
+        'SELECT id, first_name, last_name FROM residents ORDER BY last_name', ()),
+    'duplicate check': (
+        'SELECT id FROM residents WHERE name_key = ?', ('maria|garcia',)),
+    'residents since': (
+        'SELECT COUNT(*) FROM residents WHERE entry_date >= ?', (date(2024, 1, 1),)),
+    'services since': (
+        'SELECT COUNT(*) FROM services WHERE service_date >= ?', (date(2024, 1, 1),)),
+    'monthly new residents': (
+        'SELECT COUNT(*) FROM residents WHERE entry_date >= ? AND entry_date < ?',
+        (date(2024, 3, 1), date(2024, 4, 1))),
+    'monthly services': ('''
+        SELECT service_type_id, COUNT(*) FROM services
+        WHERE service_date >= ? AND service_date < ?
+        GROUP BY service_type_id
+    ''', (date(2024, 3, 1), date(2024, 4, 1))),
+    'monthly top residents': ('''
+        SELECT r.first_name, r.last_name, COUNT(*) as service_count
+        FROM services s
+        JOIN residents r ON r.id = s.resident_id
+        WHERE s.service_date >= ? AND s.service_date < ?
+        GROUP BY s.resident_id
+    ''', (date(2024, 3, 1), date(2024, 4, 1))),
+    'residents page': (
+        'SELECT * FROM residents WHERE (entry_date, id) < (?, ?) ORDER BY entry_date DESC, id DESC LIMIT 51',
+        (date(2024, 3, 15), 10)),
+    'services page': ('''
+        SELECT s.id, r.first_name, r.last_name, t.name, s.service_date
+        FROM services s
+        JOIN residents r ON s.resident_id = r.id
+        JOIN service_types t ON t.id = s.service_type_id
+        WHERE (s.service_date, s.id) < (?, ?)
+        ORDER BY s.service_date DESC, s.id DESC LIMIT 51
+    ''', (date(2024, 3, 15), 10)),
+    'residents batch': (
+        'SELECT * FROM residents WHERE id > ? ORDER BY id LIMIT 1000', (10,)),
+    'services batch': ('''
+        SELECT s.id, r.first_name, r.last_name, t.name, s.service_date, time(s.service_time, 'unixepoch')
+        FROM services s
+        JOIN residents r ON s.resident_id = r.id
+        JOIN service_types t ON t.id = s.service_type_id
+        WHERE s.id > ? ORDER BY s.id LIMIT 1000
+    ''', (10,)),
+    'resident search': ('''
+        SELECT r.* FROM residents_fts f
+        JOIN residents r ON r.id = f.rowid
+        WHERE residents_fts MATCH ? ORDER BY f.rank LIMIT 21 OFFSET 0
+    ''', ('"mar"*',)),
+    'services export': ('''
+        SELECT s.id, s.resident_id, r.first_name, r.last_name, t.name, s.service_date
+        FROM services s
+        JOIN residents r ON s.resident_id = r.id
+        JOIN service_types t ON t.id = s.service_type_id
+        WHERE s.service_date >= ? AND s.service_date < ? ORDER BY s.service_date, s.id
+    ''', (date(2024, 1, 1), date(2024, 4, 1))),
+    'services for resident': (
+        'SELECT * FROM services WHERE resident_id = ? ORDER BY service_date', (1,)),
+    'residents to archive': (
+        'SELECT id FROM residents WHERE discharge_date < ? ORDER BY discharge_date LIMIT ?',
+        (date(2024, 1, 1), 500)),
+    'services to archive': (
+        'SELECT id FROM services WHERE service_date < ? ORDER BY service_date LIMIT ?',
+        (date(2024, 1, 1), 500)),
+}
+
+# Whole-table aggregates necessarily visit every row, but must do so
+# through a covering index rather than the table itself.
+AGGREGATE_QUERIES = {
+    'service breakdown': ('''
+        SELECT service_type_id, COUNT(*), COUNT(DISTINCT resident_id)
+        FROM services GROUP BY service_type_id
+    ''', ()),
+    # OFFSET walks used by page_at to jump to a scroll position
+    'residents offset': (
+        'SELECT entry_date, id FROM residents ORDER BY entry_date DESC, id DESC LIMIT 1 OFFSET ?', (100,)),
+    'services offset': (
+        'SELECT service_date, id FROM services ORDER BY service_date DESC, id DESC LIMIT 1 OFFSET ?', (100,)),
+}
+
+
+def query_plan(conn, sql, params):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def full_scans(plan):
+    """Plan steps that read a table without any index or sort the rows"""
+    return [step for step in plan
+            if re.match(r'SCAN \w+( AS \w+)?$', step)
+            or 'TEMP B-TREE FOR ORDER BY' in step]
+
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_query_uses_index(db, name):
+    plan = query_plan(db, *HOT_QUERIES[name])
+    assert not full_scans(plan), plan
+
+
+@pytest.mark.parametrize('name', sorted(AGGREGATE_QUERIES))
+def test_aggregate_uses_covering_index(db, name):
+    plan = query_plan(db, *AGGREGATE_QUERIES[name])
+    assert not full_scans(plan), plan
+    assert any('COVERING INDEX' in step for step in plan), plan
+
+
+def test_monthly_report_never_reads_services(db):
+    plans = [
+        query_plan(db, 'SELECT count FROM monthly_new_residents WHERE month = ?', ('2024-03',)),
+        query_plan(db, '''
+            SELECT t.name, m.count FROM monthly_service_counts m
+            JOIN service_types t ON t.id = m.service_type_id
+            WHERE m.month = ? ORDER BY m.count DESC
+        ''', ('2024-03',)),
+        query_plan(db, '''
+            SELECT r.first_name, r.last_name, m.count
+            FROM monthly_resident_services m
+            JOIN residents r ON r.id = m.resident_id
+            WHERE m.month = ? ORDER BY m.count DESC LIMIT 5
+        ''', ('2024-03',)),
+    ]
+    for plan in plans:
+        assert not any(re.match(r'SCAN \w+( AS \w+)?$', step) for step in plan), plan
+        assert not any(re.match(r'(SCAN|SEARCH) services\b', step) for step in plan), plan
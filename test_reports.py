@@ -0,0 +1,78 @@
+# Test the reporting module
+import csv
+from datetime import date
+import pytest
+import database
+from models import Resident, Service
+from reports import ShelterReports
+
+
+@pytest.fixture
+def history(db, tmp_path, monkeypatch):
+    """Two residents with services across two months"""
+    monkeypatch.chdir(tmp_path)
+    Resident.save_many([("Maria", "Garcia", "2024-03-15"), ("Ana", "Lopez", "2024-04-02")])
+    Service.add_many([
+        (1, "Meals", "2024-03-16"), (1, "Meals", "2024-03-17"),
+        (1, "Counseling", "2024-03-20"), (2, "Meals", "2024-03-31"),
+        (2, "Classes", "2024-04-01"),
+    ])
+    return db
+
+
+def read_csv(filename):
+    with open(filename, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_monthly_report_reads_rollups(history, capsys):
+    rows = read_csv(ShelterReports.monthly_report("2024-03"))
+    assert ['New Residents', '1'] in rows
+    assert ['Total Residents', '2'] in rows
+    assert rows[-2:] == [['Meals', '3'], ['Counseling', '1']]
+    assert "Maria Garcia: 3 services" in capsys.readouterr().out
+
+
+def test_rollups_follow_updates_and_deletes(history):
+    with database.transaction() as conn:
+        conn.execute("UPDATE services SET service_date = ? WHERE id = 1", (date(2024, 4, 5),))
+        conn.execute("DELETE FROM services WHERE id = 4")
+    rows = read_csv(ShelterReports.monthly_report("2024-03"))
+    assert sorted(rows[-2:]) == [['Counseling', '1'], ['Meals', '1']]
+    assert database.check_stats() == []
+
+
+def test_backfill_rebuilds_rollups(history):
+    with database.transaction() as conn:
+        conn.execute('DELETE FROM monthly_service_counts')
+    assert database.check_stats()
+    database.backfill_rollups()
+    assert database.check_stats() == []
+
+
+def test_build_system_report(history):
+    from datetime import datetime
+    report = ShelterReports.build_system_report(now=datetime(2024, 4, 10))
+    assert report.total_residents == 2
+    assert report.total_services == 5
+    assert report.unique_service_types == 3
+    assert report.active_months == 2
+    assert (report.recent_residents, report.recent_services) == (2, 5)  # since 2024-03-11
+    assert (report.month_residents, report.month_services) == (1, 1)
+    assert report.service_breakdown[0] == ("Meals", 3, 2)
+    assert report.current_month == "2024-04"
+
+
+def test_batch_report_in_worker_processes(history):
+    combined, filenames = ShelterReports.batch_report("2024-02", "2024-04", workers=2)
+    assert filenames == ["./shelter_report_2024-02.csv", "./shelter_report_2024-03.csv",
+                         "./shelter_report_2024-04.csv"]
+    assert read_csv(filenames[1])[-2:] == [['Meals', '3'], ['Counseling', '1']]
+
+    rows = read_csv(combined)
+    assert rows[0] == ['Safe Shelter Report', '2024-02 to 2024-04']
+    assert rows[4:7] == [['2024-02', '0', '0'], ['2024-03', '1', '4'], ['2024-04', '1', '1']]
+    assert ['Meals', '0', '3', '0', '3'] in rows
+    assert ['2024-04', 'Ana Lopez', '1'] in rows
+    assert ShelterReports.build_monthly_reports("2024-02", "2024-04", workers=1) == \
+        ShelterReports.build_monthly_reports("2024-02", "2024-04", workers=3)
@@ -0,0 +1,43 @@
+# Test the synthetic data generator
+from datetime import date
+import database
+import seed_data
+from models import Stats
+
+
+def snapshot(conn):
+    return (conn.execute('SELECT * FROM residents ORDER BY id').fetchall(),
+            conn.execute('SELECT * FROM services ORDER BY id').fetchall())
+
+
+def test_seed_is_realistic_and_consistent(db):
+    assert seed_data.seed(200, 3000, seed=7, end=date(2024, 12, 31), years=2) == (200, 3000)
+    assert Stats.totals()['residents'] == 200
+    assert Stats.totals()['services'] == 3000
+    assert database.check_stats() == []
+
+    # Services fall within each resident's stay, at opening hours
+    assert db.execute('''
+        SELECT COUNT(*) FROM services s JOIN residents r ON r.id = s.resident_id
+        WHERE s.service_date < r.entry_date
+           OR s.service_date > COALESCE(r.discharge_date, ?)
+           OR s.service_time NOT BETWEEN 8 * 3600 AND 20 * 3600
+    ''', (date(2024, 12, 31),)).fetchone()[0] == 0
+    assert db.execute('SELECT MIN(entry_date) FROM residents').fetchone()[0] >= database.day_number('2022-12-31')
+    assert 0 < db.execute('SELECT COUNT(*) FROM residents WHERE discharge_date IS NULL').fetchone()[0] < 200
+    assert Stats.service_type_counts()[0][0] == 'Meals'
+
+
+def test_same_seed_same_rows(db, tmp_path):
+    seed_data.seed(50, 500, seed=3, end=date(2024, 6, 30))
+    first = snapshot(db)
+    database.configure(str(tmp_path / 'again.db'))
+    seed_data.seed(50, 500, seed=3, end=date(2024, 6, 30))
+    assert snapshot(database.get_connection()) == first
+
+
+def test_names_stay_unique_past_every_pairing():
+    import random
+    count = len(seed_data.FIRST_NAMES) * len(seed_data.LAST_NAMES) * 3
+    names = list(seed_data.resident_names(count, random.Random(0)))
+    assert len(set(names)) == count
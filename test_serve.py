@@ -0,0 +1,60 @@
+# Test the multi-process server
+import http.client
+import json
+import threading
+from urllib.parse import urlencode
+import loadtest
+import serve
+
+
+def test_workers_share_one_database(tmp_path):
+    path = str(tmp_path / 'serve.db')
+    process, port = loadtest.start_server(2, path)
+    try:
+        for name in ("Maria", "Ana", "Rosa"):
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            conn.request('POST', '/add_resident', urlencode({'first_name': name, 'last_name': 'Garcia'}),
+                         {'Content-Type': 'application/x-www-form-urlencoded'})
+            assert conn.getresponse().status == 302
+            conn.close()
+        # Whichever worker answers sees every write
+        for _ in range(4):
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            conn.request('GET', '/residents')
+            page = conn.getresponse().read()
+            conn.close()
+            assert all(name in page for name in (b"Maria", b"Ana", b"Rosa"))
+    finally:
+        process.terminate()
+        assert process.wait(timeout=10) == 0
+
+
+def get(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('GET', path)
+    body = conn.getresponse().read()
+    conn.close()
+    return body
+
+
+def test_request_threads_share_the_cache(tmp_path):
+    process, port = loadtest.start_server(1, str(tmp_path / 'serve.db'))
+    try:
+        get(port, '/residents')  # Fill the cache
+        misses = json.loads(get(port, '/cache_stats'))['misses']
+        clients = [threading.Thread(target=lambda: [get(port, '/residents') for _ in range(5)])
+                   for _ in range(4)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        stats = json.loads(get(port, '/cache_stats'))
+        # A thread's first request does not invalidate what another cached
+        assert stats['hits'] >= 20 and stats['misses'] == misses
+        metrics = get(port, '/metrics').decode()
+        opened = [line for line in metrics.splitlines()
+                  if line.startswith('shelter_sql_seconds_count') and 'busy_timeout' in line]
+        assert int(opened[0].rsplit(' ', 1)[1]) <= serve.THREADS + 2  # Pool, writer and startup
+    finally:
+        process.terminate()
+        assert process.wait(timeout=10) == 0
@@ -0,0 +1,63 @@
+# Test group commits through the write queue
+import sqlite3
+import threading
+from datetime import date
+import pytest
+from models import Resident, ServiceType, Stats
+from write_queue import WriteQueue
+
+INSERT = 'INSERT INTO services (resident_id, service_type_id, service_date) VALUES (?, ?, ?)'
+
+
+def test_concurrent_writes_share_commits(db):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    meals = ServiceType.id_for("Meals")
+    writes = WriteQueue(max_delay=0.05)
+    barrier = threading.Barrier(20)
+
+    def write():
+        barrier.wait()
+        writes.execute(INSERT, (1, meals, date(2024, 3, 16)))
+
+    threads = [threading.Thread(target=write) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writes.close()
+
+    assert Stats.totals()['services'] == 20
+    assert writes.writes == 20 and writes.commits < 20
+
+
+def test_failed_write_does_not_spoil_its_batch(db):
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    meals = ServiceType.id_for("Meals")
+    writes = WriteQueue(max_delay=0.05)
+    good = writes.submit(INSERT, (1, meals, date(2024, 3, 16)))
+    bad = writes.submit(INSERT, (999, meals, date(2024, 3, 16)))  # No such resident
+    also_good = writes.submit(INSERT, (1, meals, date(2024, 3, 17)))
+    writes.close()
+
+    assert good.result() and also_good.result()
+    with pytest.raises(sqlite3.IntegrityError):
+        bad.result()
+    assert Stats.totals()['services'] == 2
+
+
+def test_service_type_ids_are_cached_by_the_writer(db):
+    from models import Service
+    Resident("Maria", "Garcia", "2024-03-15").save()
+    ServiceType.id_for("Meals")  # Committed before the queue sees it
+    ServiceType._ids.clear()
+    writes = WriteQueue()
+    for service_type in ("Meals", "Legal Aid", "Legal Aid"):
+        writes.call(Service.add, 1, service_type)
+    # A type whose item rolls back to its savepoint is not remembered
+    with pytest.raises(sqlite3.IntegrityError):
+        writes.call(Service.add, 99, "Laundry")
+    writes.close()
+
+    assert set(ServiceType._ids) == {"meals", "legal aid"}
+    assert db.execute("SELECT COUNT(*) FROM service_types WHERE key = 'laundry'").fetchone()[0] == 0
+    assert Stats.totals()['services'] == 3
@@ -0,0 +1,127 @@
+# write_queue.py - Group commit for small concurrent writes
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from database import get_connection, transaction
+
+MAX_BATCH = 256
+MAX_DELAY = 0.005  # seconds a write may wait for others to join its commit
+
+
+def _execute(sql, params):
+    return get_connection().execute(sql, params).lastrowid
+
+
+class WriteQueue:
+    """Coalesces single-row writes from many threads into group commits
+
+    Callers hand over one statement each and block until it is
+    committed. A single writer thread takes the first waiting statement,
+    gathers whatever else arrives within max_delay (up to max_batch) and
+    commits them all in one transaction, so a burst of N writes costs
+    one commit instead of N and never queues on the write lock.
+
+    Each statement runs in its own SAVEPOINT: one that fails (e.g. an
+    unknown resident) is rolled back and its caller gets the exception,
+    while the rest of the batch still commits.
+
+    Model methods can be queued too, with call(): they run on the
+    writer thread and their own transaction() joins the group commit,
+    so all of a process's writes share one serialized path.
+    """
+
+    def __init__(self, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.commits = self.writes = 0
+
+    def submit(self, sql, params=()):
+        """Queue a statement; the Future resolves to its cursor's lastrowid"""
+        return self.submit_call(_execute, sql, params)
+
+    def submit_call(self, func, *args):
+        """Queue func(*args) for the writer thread; the Future resolves to its result"""
+        future = Future()
+        self._start()
+        self._pending.put((func, args, future))
+        return future
+
+    def execute(self, sql, params=(), timeout=None):
+        """Run a statement in the next group commit and wait for it"""
+        return self.submit(sql, params).result(timeout)
+
+    def call(self, func, *args, timeout=None):
+        """Run func(*args) in the next group commit and return its result"""
+        return self.submit_call(func, *args).result(timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='shelter-writer', daemon=True)
+                self._thread.start()
+
+    def _take_batch(self):
+        """Wait for a write, then gather more for up to max_delay
+
+        Returns (batch, closing); closing is True once close() has been
+        called.
+        """
+        batch = []
+        item = self._pending.get()
+        deadline = time.perf_counter() + self.max_delay
+        while item is not None:
+            batch.append(item)
+            remaining = deadline - time.perf_counter()
+            if len(batch) >= self.max_batch:
+                return batch, False
+            try:
+                item = self._pending.get(timeout=remaining) if remaining > 0 else self._pending.get_nowait()
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def _run(self):
+        closing = False
+        while not closing:
+            batch, closing = self._take_batch()
+            self._commit(batch)
+
+    def _commit(self, batch):
+        if not batch:
+            return
+        results = []
+        try:
+            with transaction() as conn:
+                for func, args, future in batch:
+                    conn.execute('SAVEPOINT item')
+                    try:
+                        results.append((future, func(*args), None))
+                        conn.execute('RELEASE item')
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO item')
+                        conn.execute('RELEASE item')
+                        results.append((future, None, e))
+        except Exception as e:  # The commit itself failed
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.commits += 1
+        self.writes += len(batch)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        """Commit everything queued so far and stop the writer thread"""
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._pending.put(None)
+            thread.join()